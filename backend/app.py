@@ -1,8 +1,13 @@
 import logging
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from typing import List
 import os
 import json
+import asyncio
+import time
 from dotenv import load_dotenv
 from datetime import datetime
 import openai
@@ -10,16 +15,21 @@ from document_processor import DocumentProcessor
 from openai_service import OpenAIService
 from storage_service import StorageService
 from pinecone_service import PineconeService
-
-# Set up logging to file and console
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
+from embedding_service import EmbeddingService
+from embedding_cache import EmbeddingCache
+from storage_cache import StorageCache
+from category_classifier import CategoryClassifier
+from job_queue import LocalJobQueue
+from query_pipeline import QueryPipeline
+from ingestion_pipeline import IngestionPipeline
+from local_vector_index import LocalVectorIndex
+from request_logging import setup_logging, shutdown_logging, start_request
+from service_registry import ServiceRegistry, HttpPool
+from llm_scheduler import llm_scheduler, set_priority, PRIORITY_INTERACTIVE
+from metrics import registry, current_metrics, start_request_timings, server_timing, SERVER_TIMING_HEADER
+
+# Set up logging to a rotating file and console, written from a background queue
+setup_logging()
 
 # Load environment variables
 load_dotenv()
@@ -30,8 +40,103 @@ from openai_service import OpenAIService
 from storage_service import StorageService
 from pinecone_service import PineconeService
 
+# Services are created on first use (and warmed up in the background after startup) rather than at
+# import time, so a slow or unreachable backend neither delays nor breaks boot; see /ready
+services = ServiceRegistry()
+services.register("http_pool", HttpPool)
+services.register("openai_service", lambda: OpenAIService(http_pool=services.get("http_pool"), scheduler=llm_scheduler))
+services.register("document_processor", lambda: DocumentProcessor(openai_service=services.get("openai_service")))
+services.register("storage_cache", StorageCache)
+services.register("storage_service", lambda: StorageService(
+    bucket_name=os.getenv("GCS_BUCKET_NAME"), cache=services.get("storage_cache")
+))
+
+def create_vector_service():
+    # VECTOR_BACKEND=local keeps the index in-process instead of calling Pinecone
+    if os.getenv("VECTOR_BACKEND", "pinecone").lower() == "local":
+        return LocalVectorIndex()
+    return PineconeService()
+
+services.register("vector_service", create_vector_service)
+services.register("embedding_cache", EmbeddingCache)
+services.register("embedding_service", lambda: EmbeddingService(
+    services.get("openai_service").client, services.get("openai_service").async_client,
+    cache=services.get("embedding_cache")
+))
+services.register("category_classifier", lambda: CategoryClassifier(
+    services.get("embedding_service"), llm_client=services.get("openai_service").async_client
+))
+services.register("query_pipeline", lambda: QueryPipeline(
+    services.get("openai_service"), services.get("embedding_service"), services.get("category_classifier"),
+    services.get("vector_service")
+))
+services.register("ingestion_pipeline", lambda: IngestionPipeline(
+    services.get("document_processor"), services.get("openai_service"), services.get("storage_service"),
+    services.get("vector_service"), services.get("embedding_service"), services.get("category_classifier")
+))
+
+async def run_ingestion(job):
+    return await (await services.aget("ingestion_pipeline")).run(job)
+
+async def run_ingestion_batch(jobs):
+    return await (await services.aget("ingestion_pipeline")).run_batch(jobs)
+
+job_queue = LocalJobQueue(run_ingestion, batch_handler=run_ingestion_batch)
+warm_up_task = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global warm_up_task
+    await job_queue.start()
+    warm_up_task = asyncio.create_task(warm_up_services())
+    yield
+    warm_up_task.cancel()
+    await job_queue.stop()
+    document_processor = services.peek("document_processor")
+    if document_processor is not None:
+        document_processor.shutdown()
+    # The local index and the category centroids are saved on a timer; write out their last changes
+    vector_service = services.peek("vector_service")
+    if isinstance(vector_service, LocalVectorIndex):
+        vector_service.flush()
+    category_classifier = services.peek("category_classifier")
+    if category_classifier is not None:
+        category_classifier.flush()
+    embedding_cache = services.peek("embedding_cache")
+    if embedding_cache is not None:
+        embedding_cache.close()
+    storage_cache = services.peek("storage_cache")
+    if storage_cache is not None:
+        storage_cache.close()
+    http_pool = services.peek("http_pool")
+    if http_pool is not None:
+        await http_pool.aclose()
+    shutdown_logging()
+
+async def warm_up_services():
+    """Create the services, start the extraction workers and fill the storage cache, in the background"""
+    await services.warm_up()
+    document_processor = services.peek("document_processor")
+    if document_processor is not None:
+        document_processor.warm_up()
+    storage_service = services.peek("storage_service")
+    if storage_service is None:
+        return
+    prefixes = [prefix for prefix in os.getenv("STORAGE_CACHE_WARM_PREFIXES", "processed/").split(",") if prefix]
+    try:
+        await asyncio.to_thread(storage_service.warm_cache, prefixes)
+    except Exception:
+        logging.exception("Storage cache warm-up failed")
+    # Without saved centroids, build the query classifier's prototypes from the documents ingested so far
+    category_classifier = services.peek("category_classifier")
+    if category_classifier is not None and category_classifier.needs_backfill:
+        try:
+            await asyncio.to_thread(category_classifier.backfill, storage_service)
+        except Exception:
+            logging.exception("Category prototype backfill failed")
+
 # Create FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -42,376 +147,168 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize components
-document_processor = DocumentProcessor()
-openai_service = OpenAIService()
-storage_service = StorageService(bucket_name=os.getenv("GCS_BUCKET_NAME"))
-pinecone_service = PineconeService()
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Tag every log line of a request with one correlation id, echoed back in X-Request-ID"""
+    request_id = start_request(request.headers.get("X-Request-ID"))
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+def route_label(request: Request):
+    """The matched route's path template, so /jobs/{job_id} is one label rather than one per job"""
+    endpoint = request.scope.get("endpoint")
+    for route in app.routes:
+        if getattr(route, "endpoint", None) is endpoint:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """Observe every request in http_request_seconds and optionally return its per-stage timings.
+
+    Stages record into the request's timings through metrics.span; with SERVER_TIMING_HEADER=true they
+    come back in a Server-Timing header. Streamed responses only include the stages run before the
+    first byte (retrieval, not generation), since headers go out first.
+    """
+    timings = start_request_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    current_metrics().request_seconds.observe(elapsed, method=request.method, route=route_label(request),
+                                              status=response.status_code)
+    if SERVER_TIMING_HEADER:
+        timings["total"] = [elapsed, 1]
+        response.headers["Server-Timing"] = server_timing(timings)
+    return response
 
 @app.post("/upload")
 async def upload_document(file: UploadFile = File(...)):
+    """Spool the upload and queue it for background ingestion; poll GET /jobs/{job_id} for progress"""
     try:
-        # Read file content
-        content = await file.read()
-        filename = file.filename
-        
-        # Process document content and detect type
-        extracted_content, filetype = document_processor.extract_content(filename, content)
-        
-        # Process with OpenAI (chunking and tagging)
-        chunks, tags = openai_service.process_document(extracted_content, filename, filetype=filetype)
-        
-        # Ensure each chunk has its tags properly set
-        for i, chunk in enumerate(chunks):
-            if isinstance(chunk, dict):
-                # If the chunk doesn't already have tags field, add it
-                if 'tags' not in chunk:
-                    # If we have tags for this chunk in the global tags list, use them
-                    if tags and i < len(tags):
-                        chunk['tags'] = tags[i]
-                    else:
-                        chunk['tags'] = []
-            else:
-                # If chunks are simple strings, convert to dict with tags
-                chunk_obj = {"text": chunk}
-                if tags and i < len(tags):
-                    chunk_obj['tags'] = tags[i]
-                else:
-                    chunk_obj['tags'] = []
-                chunks[i] = chunk_obj  # Replace the string with the dict
-
-        # Generate embeddings for each chunk
-        chunk_objs = []
-        for chunk in chunks:
-            embedding_response = openai_service.client.embeddings.create(
-                input=chunk["text"] if isinstance(chunk, dict) and "text" in chunk else chunk,
-                model="text-embedding-ada-002"
-            )
-            embedding = embedding_response.data[0].embedding
-            chunk_obj = {
-                "text": chunk["text"] if isinstance(chunk, dict) and "text" in chunk else chunk,
-                "embedding": embedding,
-                "tags": chunk.get("tags", []) if isinstance(chunk, dict) else [],
-                "chunk_id": chunk.get("chunk_id", f"{filename}-chunk-{len(chunk_objs)}")
-            }
-            chunk_objs.append(chunk_obj)
-        
-        # Upsert to Pinecone
-        pinecone_service.upsert_chunks(filename, chunk_objs)
-        
-        # Store in GCS
-        gcs_path = storage_service.upload_file(content, filename)
-        
-        # Store processed results
-        processed_data = {
-            "filename": filename,
-            "gcs_path": gcs_path,
-            "chunks": chunks,
-            "tags": tags,
-            "processed_date": str(datetime.now())
-        }
-        
-        # Store processed data in GCS
-        storage_service.store_processed_content(filename, processed_data)
-        
+        # Copied to the spool in pieces rather than read into memory
+        job = await job_queue.submit(file.filename, file)
         return {
-            "filename": filename,
-            "chunks_processed": len(chunks),
-            "tags": tags,
-            "gcs_path": gcs_path
+            "job_id": job.id,
+            "filename": job.filename,
+            "status": job.status
         }
     except Exception as e:
         logging.exception("Error in /upload endpoint")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/upload/batch")
+async def upload_documents(files: List[UploadFile] = File(...)):
+    """Queue several uploads as one ingestion batch; their chunks share embedding requests and vector upserts"""
+    try:
+        jobs = await job_queue.submit_batch([(file.filename, file) for file in files])
+        return {
+            "jobs": [
+                {"job_id": job.id, "filename": job.filename, "status": job.status}
+                for job in jobs
+            ]
+        }
+    except Exception as e:
+        logging.exception("Error in /upload/batch endpoint")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Report the status and per-stage progress of an ingestion job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 @app.post("/query")
 async def query_content(request: Request):
     try:
-        # Clear the log file
-        with open("app.log", "w") as f:
-            f.write("")
-            
         data = await request.json()
         query = data.get("query", "")
-
-        # First, analyze the query to determine relevant subcategories
-        category_analysis = openai_service.client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": """You are an expert at categorizing educational content queries.
-Analyze the user's query and determine which of these 16 subcategories it relates to:
-
-ACTION category:
-- Results
-- Execution
-- Fearless Presenter
-- Seize Opportunities
-
-RELATIONSHIPS category:
-- Connection
-- Leadership
-- Collaboration
-- Awareness
-
-DISCIPLINE category:
-- Planning
-- Constructive Thinking
-- Organize
-- Control
-
-PURPOSE category:
-- Authenticity
-- CEO Perspective
-- Vision
-- Growth Mindset
-
-Return ONLY a JSON array of the most relevant subcategories (maximum 3) that the query relates to.
-Example response: ["Leadership", "Vision", "Planning"]"""},
-                {"role": "user", "content": query}
-            ]
-        )
-        
-        relevant_categories = json.loads(category_analysis.choices[0].message.content)
-        
-        # Generate embedding for query
-        query_embedding_response = openai_service.client.embeddings.create(
-            input=query,
-            model="text-embedding-ada-002"
-        )
-        query_embedding = query_embedding_response.data[0].embedding
-        
-        # Query Pinecone with category filter
-        matches = pinecone_service.query(query_embedding, top_k=20)
-        
-        # Filter matches to only include chunks with relevant categories
-        filtered_matches = []
-        for match in matches:
-            chunk_tags = match["metadata"].get("tags", [])
-            if any(tag in relevant_categories for tag in chunk_tags):
-                filtered_matches.append(match)
-
-        # If no matches after filtering, use original matches
-        if not filtered_matches:
-            filtered_matches = matches
-
-        # Log each chunk with its metadata
-        logging.info("=== CHUNKS RETRIEVED FROM PINECONE ===")
-        for i, match in enumerate(filtered_matches):
-            metadata = match["metadata"]
-            chunk_text = metadata.get("chunkText", "")
-            chunk_tags = metadata.get("tags", [])
-            
-            logging.info(f"CHUNK {i+1}:")
-            logging.info(f"ID: {metadata.get('chunk_id', f'chunk-{i}')}")
-            logging.info(f"Filename: {metadata.get('filename', 'unknown')}")
-            logging.info(f"Tags: {chunk_tags}")
-            logging.info(f"Text: {chunk_text[:300]}...")
-            logging.info("---")
-        logging.info("=== END CHUNKS ===")
-
-        # Build context from filtered chunks
-        context = ""
-        for i, match in enumerate(filtered_matches):
-            metadata = match["metadata"]
-            context += f"\n--- CHUNK {i+1} ---\n"
-            context += f"Source: {metadata.get('filename', 'unknown')}\n"
-            context += f"Chunk ID: {metadata.get('chunkId', 'unknown')}\n"
-            context += f"Tags: {metadata.get('tags', [])}\n" 
-            context += f"Content: {metadata.get('chunkText', '')}\n"
-            context += "---\n"
-
-        # Log the context and prompt
-        logging.info("=== FULL CONTEXT BEING FED TO GPT ===")
-        logging.info(context)
-        logging.info("=== END CONTEXT ===")
-        
-        # Use GPT-4o to answer
-        messages = [
-      {"role": "system", "content": """You are an expert curriculum developer specializing in entrepreneurship education at the Wolff Center for Entrepreneurship (WCE). 
-
-IMPORTANT INSTRUCTIONS FOR EXTRACTING CONTENT:
-1. Extract ONLY direct quotes from the provided context. Do NOT paraphrase or summarize.
-2. Each chunk may come from different documents - look for a 'filename' field in the chunk metadata if available.
-3. If the filename is not explicitly given, refer to the chunk by its content and position (e.g., "Chunk about Law of Curiosity").
-4. When providing references, be specific about where in the document the content appears (e.g., section title, page if available).
-5. If you can't find an exact location reference, explicitly state "Reference: [Document name], exact location unknown".
-6. If the content doesn't contain information about a requested competency, don't include that chunk dont attempt to extract irrelevant content.
-
-Your goal is to provide a structured lesson plan with accurate, directly quoted content and precise source attributions."""},
-            {"role": "user", "content": f"""
-I need you to analyze the provided context and extract the most relevant material for developing a lesson plan for the Wolff Center for Entrepreneurship (WCE) at the University of Houston's C. T. Bauer College of Business.
-
-The WCE is guided by a philosophy centered on empowering students to understand their values, articulate their dreams, and achieve tangible outcomes. The program emphasizes both academic rigor and real-world application, preparing students to assume leadership roles in business by teaching them how to develop and implement their own ventures. WCE fosters personal and professional growth through mentorship, experiential learning, and a commitment to integrity and innovation.
-
-Our program focuses on four core value categories, each with four specific behavioral competencies:
-
-1. ACTION
-   - Results
-   - Execution
-   - Fearless Presenter
-   - Seize Opportunities
-
-2. RELATIONSHIPS
-   - Connection
-   - Leadership
-   - Collaboration
-   - Awareness
-
-3. DISCIPLINE
-   - Planning
-   - Constructive Thinking
-   - Organize
-   - Control
-
-4. PURPOSE
-   - Authenticity
-   - CEO Perspective
-   - Vision
-   - Growth Mindset
-
-For the behavioral competency: {query}
-
-Please extract 8-10 relevant sections from the context, provide precise references for each, and suggest how to incorporate them into our entrepreneurship-focused lesson plan. Each suggestion should specifically reinforce the behavioral competency while aligning with WCE's overall philosophy. Conclude with an overall approach for teaching this competency.
-
-In the reference output, please explicitly mention the filename from the content. It is listed in the metadata at the top of each file as "filename".
-
-The additional user and assistant prompts are only for reference. Do not use them in your response. Please only use use the context provided. Do not assume the lesson plan the user is asking for, allow them to tell you. 
-
-Context:
-{context}
-"""},
-            {"role": "user", "content": "We want to develop a lesson plan on 'Fearless Presenter' for our WCE students. Please extract the relevant material and provide suggestions that align with this behavioral competency under the ACTION core value."},
-            {"role": "assistant", "content": """
-{
-  "competency": "Fearless Presenter",
-  "category": "ACTION",
-  "extracts": [
-    {
-      "content": "Effective communication is not merely about slide design or voice projection—it's about conveying conviction in your venture's value proposition. Research indicates that investors make preliminary funding decisions within the first 3 minutes of a pitch, responding primarily to the founder's passionate belief in their solution.",
-      "reference": "Entrepreneurial_Communication_Guide.pdf, Chapter 4, 'Pitch Psychology,' Pages 78-82",
-      "teaching_suggestion": "Structure a progressive pitching exercise where students present the same concept three times with increasing stakes: first to a peer, then to a small group, and finally to a panel of visiting entrepreneurs. Provide specific feedback on how their conviction comes through in each iteration."
-    },
-    {
-      "content": "Fear management techniques distinguish novice from experienced presenters. The entrepreneurial mindset reframes presentation anxiety as excitement, utilizing physiological arousal as fuel rather than allowing it to become an obstacle to effective delivery.",
-      "reference": "Founder_Psychology_Handbook.pdf, Section 5.3, 'Performance Under Pressure'",
-      "teaching_suggestion": "Teach specific pre-presentation routines that embrace nervous energy, including power posing, controlled breathing, and positive visualization. Have students develop personalized 5-minute pre-presentation rituals they can implement before important pitches."
-    },
-    {
-      "content": "Story-driven presentations generate 63% better recall than fact-based approaches. The entrepreneurial narrative arc—establishing the problem, revealing the journey to the solution, and painting the vision of impact—creates both emotional connection and logical understanding.",
-      "reference": "Pitch_Deck_Development_Manual.pdf, Chapter 2, 'Narrative Structures for Entrepreneurs'",
-      "teaching_suggestion": "Challenge students to identify their venture's 'origin story' and craft it into a 2-minute opening that establishes both credibility and emotional resonance before any business metrics are shared."
-    },
-    {
-      "content": "Data visualization literacy separates memorable presentations from forgettable ones. Entrepreneurs must transform complex business information into instantly comprehensible visual insights that support rather than overwhelm their core message.",
-      "reference": "Data_Communication_Guide.pdf, Pages 45-51, 'Visual Storytelling for Business Impact'",
-      "teaching_suggestion": "Conduct a workshop where students bring their venture's most complex dataset and develop three different visualization approaches, then test which creates the fastest understanding with audience members."
-    }
-  ],
-  "lesson_approach": "To develop 'Fearless Presenter' competency in WCE students, I recommend an immersive approach that integrates technical presentation skills with emotional resilience building. The lesson should begin by addressing the psychological barriers many entrepreneurs face when presenting their ventures, framing fear as a natural response that can be channeled productively. I suggest implementing a 'presentation laboratory' format where students regularly present in increasingly challenging scenarios—from informal peer sessions to formal investor panels with real-world entrepreneurs. Throughout this progression, focus on three pillars: (1) authentic message development that aligns with the student's personal values, (2) strategic presentation design that emphasizes story over slides, and (3) embodied communication techniques that build physical confidence. The most effective approach would culminate in a high-stakes presentation opportunity where students must respond to unexpected challenges or questions, reinforcing WCE's action-oriented philosophy. Consider recording presentations at various stages of development so students can witness their own growth, reinforcing the Growth Mindset competency from the Purpose category while building their confidence as Fearless Presenters."
-}
-
-"""},
-            {"role": "user", "content": "We want to develop a lesson plan on 'CEO Perspective' for our WCE students. Please extract the relevant material and provide suggestions that align with this behavioral competency under the PURPOSE core value."},
-            {"role": "assistant", "content": """
-
-{
-  "competency": "CEO Perspective",
-  "category": "PURPOSE",
-  "extracts": [
-    {
-      "content": "The CEO Perspective requires entrepreneurs to simultaneously hold three time horizons: immediate tactical execution, mid-range strategic positioning, and long-term vision fulfillment. Research with successful founders reveals that this cognitive flexibility—switching between operational details and big-picture thinking—correlates strongly with venture longevity.",
-      "reference": "Executive_Mindset_Manual.pdf, Chapter 3, 'Temporal Leadership Dimensions,' Pages 72-79",
-      "teaching_suggestion": "Implement a 'three horizons exercise' where students make decisions about the same business challenge from three different timeframes (next week, next year, next decade), then analyze how these perspectives lead to different priorities and actions."
-    },
-    {
-      "content": "CEO Perspective encompasses the ability to analyze stakeholder ecosystems holistically. Novice entrepreneurs often optimize for customer needs alone, while experienced founders balance the interests of customers, team members, investors, partners, and community with sophisticated tradeoff analysis.",
-      "reference": "Stakeholder_Management_Guide.pdf, Section 4.2, 'Multi-constituency Decision Making'",
-      "teaching_suggestion": "Create a stakeholder simulation where student teams navigate a complex business decision with actors representing different stakeholders with competing interests. Debrief by evaluating how effectively they balanced diverse needs while staying true to core venture values."
-    },
-    {
-      "content": "The psychological burden of ultimate accountability distinguishes the CEO role from all others. Research on entrepreneur resilience indicates that those who develop rituals for processing failure, celebrating small wins, and maintaining perspective during crises demonstrate significantly higher leadership effectiveness scores.",
-      "reference": "Founder_Psychology_Report.pdf, Pages 115-127, 'Decision-Making Under Uncertainty'",
-      "teaching_suggestion": "Establish a regular 'CEO reflection practice' where students document their decision processes, assumptions, and emotional responses to outcomes. Partner with the Psychology department to provide structured feedback on their self-awareness and emotional regulation strategies."
-    },
-    {
-      "content": "Houston's most successful entrepreneurs demonstrate a distinct form of CEO Perspective through their ability to connect industry-specific opportunities with broader economic and social trends. This contextual intelligence—seeing how their venture fits within larger systems—enables more strategic resource allocation and more compelling narrative creation.",
-      "reference": "Houston_Entrepreneurship_Case_Studies.pdf, Volume 3, 'Systems Thinking in Practice'",
-      "teaching_suggestion": "Organize small-group sessions with successful Houston CEOs where students present their analysis of how macro trends impact their specific venture concept, receiving feedback on their contextual intelligence and systems thinking."
-    },
-    {
-      "content": "Financial literacy transforms from a technical skill to a strategic advantage when entrepreneurs develop what veteran CEOs call 'number sense'—the ability to quickly identify which metrics truly drive business health and which are vanity metrics that distract from core value creation.",
-      "reference": "Financial_Leadership_for_Entrepreneurs.pdf, Chapter 8, 'From Accounting to Strategy'",
-      "teaching_suggestion": "Challenge students to identify the 3-5 most critical metrics for their venture and defend why these specific numbers deserve CEO attention. Have them create a one-page 'CEO Dashboard' that would guide their weekly decision-making."
-    }
-  ],
-  "lesson_approach": "To develop the 'CEO Perspective' competency under the PURPOSE core value, I recommend a lesson approach that balances conceptual understanding with experiential learning. Begin with a session exploring the distinction between management (doing things right) and leadership (doing the right things), using case studies that illustrate how CEO Perspective manifests in entrepreneurial decision-making. The heart of the lesson should utilize a comprehensive business simulation where students rotate through the CEO role, facing escalating challenges that require them to balance competing priorities, make decisions with incomplete information, and communicate their reasoning to various stakeholders. Critical to this approach is structured reflection after each simulation round, where students articulate how their decisions align with both immediate business needs and longer-term vision. Throughout the lesson, deliberately connect CEO Perspective to the other PURPOSE competencies, particularly Vision and Authenticity, showing how effective CEOs maintain alignment between personal values, company mission, and strategic decisions. Consider partnering with the WCE mentorship network to arrange shadow opportunities where students observe real CEOs navigating complex decisions, followed by debrief conversations about the thought processes witnessed. The assessment should evaluate students not on the specific decisions made, but on their ability to articulate comprehensive reasoning that demonstrates holistic understanding of their venture's ecosystem."
-}
-     
-"""},
-            {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
-        ]
-        
-        # Log the complete messages being sent to GPT
-        logging.info("\n=== COMPLETE MESSAGES BEING SENT TO GPT ===")
-        for i, msg in enumerate(messages, 1):
-            logging.info(f"\n--- Message {i} ---")
-            logging.info(f"Role: {msg['role']}")
-            logging.info(f"Content:\n{msg['content']}")
-            logging.info("--- End Message ---")
-        logging.info("\n=== END MESSAGES ===")
-        
-        response = openai_service.client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages
-        )
-        response_json = response.choices[0].message.content
-        try:
-            data = json.loads(response_json)
-            # Post-process: ensure 'content' in each extract is a direct quote from the context
-            for extract in data.get('extracts', []):
-                quote = extract.get('content', '')
-                found_in_context = False
-                # Check if the quote is a direct substring of any chunk in the context
-                for match in filtered_matches:
-                    chunk_text = match["metadata"].get("chunkText", "")
-                    if quote.strip() and quote.strip() in chunk_text:
-                        found_in_context = True
-                        break
-                if not found_in_context:
-                    # If not a direct quote, use GPT to extract a direct quote from the chunk
-                    # Find the most relevant chunk (by filename or other metadata if available)
-                    # For simplicity, use the first chunk
-                    chunk_text = filtered_matches[0]["metadata"].get("chunkText", "") if filtered_matches else ""
-                    quote_prompt = [
-                        {"role": "system", "content": "You are an expert at extracting direct quotes from educational content. Given a chunk of text and a question, extract the most relevant section (3-4 sentences) from the text that is most relevant to the topic in the question. Only return the exact quote, do not paraphrase or summarize and write out the full section. If no relevant quote exists, return an empty string."},
-                        {"role": "user", "content": f"Text: {chunk_text}\n\nQuestion: {query}"}
-                    ]
-                    quote_response = openai_service.client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=quote_prompt
-                    )
-                    new_quote = quote_response.choices[0].message.content.strip().strip('"')
-                    if new_quote:
-                        extract['content'] = new_quote
-            formatted = f"### Competency: {data.get('competency', '')}  \n**Category:** {data.get('category', '')}\n\n\n\n## Extracts\n\n"
-            teaching_suggestions = []
-            for i, extract in enumerate(data.get('extracts', []), 1):
-                teaching_suggestion = extract.get('teaching_suggestion', '').replace('. ', '.\n   - ')
-                teaching_suggestions.append(teaching_suggestion)
-                formatted += f"{i}. **Content:**  \n   {extract.get('content', '')}  \n   **Reference:**  \n   {extract.get('reference', '')}\n\n"
-            formatted += "\n\n\n## Lesson Approach\n\n" + data.get('lesson_approach', '')
-            # Add all teaching suggestions at the end
-            formatted += "\n\n\n## Teaching Suggestions\n\n"
-            for i, suggestion in enumerate(teaching_suggestions, 1):
-                formatted += f"{i}. {suggestion}\n\n"
-        except Exception:
-            formatted = response_json  # fallback to raw if not JSON
+        # Interactive LLM calls go ahead of queued ingestion calls
+        set_priority(PRIORITY_INTERACTIVE)
+        query_pipeline = await services.aget("query_pipeline")
+        formatted = await query_pipeline.answer(query)
         return {"reply": formatted}
     except Exception as e:
         logging.exception("Error in /query endpoint")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def query_content_stream(request: Request):
+    """Stream the /query answer as server-sent events: sources, then tokens, then the final reply"""
+    try:
+        data = await request.json()
+        query = data.get("query", "")
+        set_priority(PRIORITY_INTERACTIVE)
+        query_pipeline = await services.aget("query_pipeline")
+    except Exception as e:
+        # Nothing has been streamed yet, so fail like /query does; later errors arrive as an error event
+        logging.exception("Error in /query/stream endpoint")
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(
+        query_pipeline.stream_events(query),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy"} 
\ No newline at end of file
+    """Liveness: the process is up and serving, whether or not its backends are reachable yet"""
+    return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: every service has been created (so GCS and the vector index were reachable) and workers run"""
+    global warm_up_task
+    ready = services.ready() and job_queue.is_running()
+    if not ready and (warm_up_task is None or warm_up_task.done()):
+        # Retry services that failed to start, without holding up the probe
+        warm_up_task = asyncio.create_task(services.warm_up())
+    body = {"status": "ready" if ready else "starting", "services": services.status()}
+    return body if ready else JSONResponse(status_code=503, content=body)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Embedding and storage cache hit/miss counters, LLM fallbacks and which index search paths ran"""
+    embedding_cache = await services.aget("embedding_cache")
+    storage_cache = await services.aget("storage_cache")
+    category_classifier = await services.aget("category_classifier")
+    query_pipeline = await services.aget("query_pipeline")
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "storage_cache": storage_cache.stats(),
+        "category_llm_fallbacks": category_classifier.llm_calls,
+        "retrieval_paths": dict(query_pipeline.retrieval_stats)
+    }
+
+def collect_service_metrics():
+    """Cache hit rates and queue depths, read from the services when /metrics is scraped"""
+    cache_stats = [(name, services.peek(f"{name}_cache")) for name in ("embedding", "storage")]
+    cache_stats = [(name, cache.stats()) for name, cache in cache_stats if cache is not None]
+    llm_queue_depth = llm_scheduler.stats()["queue_depth"]
+    return [
+        ("cache_hits_total", "counter", "Cache lookups served locally",
+         [({"cache": name}, stats["hits"]) for name, stats in cache_stats]),
+        ("cache_misses_total", "counter", "Cache lookups that went to the backend",
+         [({"cache": name}, stats["misses"]) for name, stats in cache_stats]),
+        ("cache_hit_ratio", "gauge", "Share of cache lookups served locally since startup",
+         [({"cache": name}, stats["hit_rate"]) for name, stats in cache_stats]),
+        ("ingestion_queue_depth", "gauge", "Upload jobs waiting for an ingestion worker", [({}, job_queue.depth())]),
+        ("llm_queue_depth", "gauge", "OpenAI calls waiting in the scheduler", [
+            ({"model": model, "priority": priority}, depth)
+            for model, depths in llm_queue_depth.items() for priority, depth in depths.items()
+        ])
+    ]
+
+registry.register_collector(collect_service_metrics)
+
+@app.get("/metrics")
+def metrics():
+    """Stage latency histograms, token usage, cache hit rates and queue depths in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """LLM scheduler queue depth per model and priority, queue wait times, and retry/429 counters"""
+    return llm_scheduler.stats()
@@ -1,9 +1,11 @@
 import json
 from openai import OpenAI
+from llm_scheduler import ScheduledClient
 
 class AutoTagger:
     def __init__(self, api_key):
-        self.client = OpenAI(api_key=api_key)
+        # Calls are rate limited and retried by the shared LLM scheduler
+        self.client = ScheduledClient(OpenAI(api_key=api_key, max_retries=0))
         self.tag_structure = {
             "Action": ["Lecture", "Assignment", "Reading", "Exercise", "Quiz", "Lab", "Project", "Discussion", "Demonstration"],
             "Relationships": ["Student-Led", "Group Work", "Prerequisite", "Follow-up", "Reference", "Supplemental", "Core", "Optional", "Collaborative"],
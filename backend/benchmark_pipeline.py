@@ -0,0 +1,420 @@
+"""Offline benchmark of /upload and /query, end to end and per stage, against fake OpenAI, Pinecone and GCS.
+
+Usage: python benchmark_pipeline.py [--documents 4] [--pages 12] [--queries 8] [--llm-latency 0.3] ...
+       python benchmark_pipeline.py --output after.json --compare before.json
+Latency and failure rates of each fake are configurable (see --help). The run uses a scratch directory
+for caches, spool and logs, so it never touches the real backends or local state.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tempfile
+import statistics
+from collections import Counter
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_STAGES = ["extraction", "tagging", "embedding", "upsert", "storage"]
+QUERY_STAGES = ["query_embedding", "category_analysis", "retrieval", "generation", "quote_repair"]
+QUERIES = [
+    "How can students develop a clear vision for their venture?",
+    "Activities that build leadership in small teams",
+    "Teaching students to plan and organize a product launch",
+    "How do founders present fearlessly to investors?",
+    "Building authentic connections with mentors",
+    "Exercises for a growth mindset after failure",
+    "Helping students take a CEO perspective on their business",
+    "Seizing opportunities in a changing market",
+]
+SENTENCES = [
+    "Entrepreneurs who write down a clear vision make better decisions when the market shifts",
+    "Leadership in a small team starts with listening before assigning work",
+    "A weekly planning ritual keeps founders focused on the few results that matter",
+    "Presenting to investors is a skill that improves with deliberate rehearsal and feedback",
+    "Authentic relationships with mentors grow from asking for advice rather than favours",
+    "A growth mindset treats every failed experiment as data for the next attempt",
+    "Thinking like a CEO means weighing cash flow, people and strategy at the same time",
+    "Opportunities appear to founders who talk with customers every week",
+    "Organized founders keep their commitments visible so nothing falls through the cracks",
+    "Constructive thinking turns a setback into a concrete list of next steps",
+    "Collaboration works best when each partner knows exactly what the other one owns",
+    "Awareness of your own habits is the first step towards controlling them",
+]
+
+
+def make_pdf(page_texts):
+    """A minimal PDF with one text page per entry, readable by PyPDF2"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        lines = []
+        line = ""
+        for word in text.split():
+            if len(line) + len(word) > 90:
+                lines.append(line)
+                line = ""
+            line = f"{line} {word}".strip()
+        lines.append(line)
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = "BT /F1 10 Tf 50 750 Td 12 TL " + " ".join(f"({line}) Tj T*" for line in escaped) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return output
+
+
+def make_documents(count, pages, seed):
+    """Synthetic PDFs of `pages` pages, each page a dozen sentences about the competencies"""
+    rng = random.Random(seed)
+    documents = []
+    for i in range(count):
+        page_texts = [". ".join(rng.sample(SENTENCES, len(SENTENCES))) + "." for _ in range(pages)]
+        documents.append((f"benchmark-{i + 1}.pdf", make_pdf(page_texts)))
+    return documents
+
+
+class StageTimer:
+    """Collects (start, end) of every call to a pipeline stage"""
+
+    def __init__(self):
+        self.spans = {}
+
+    def record(self, stage, start, end):
+        self.spans.setdefault(stage, []).append((start, end))
+
+    def reset(self):
+        self.spans = {}
+
+    def summary(self, stages):
+        """Per stage: calls, busy time (sum of call durations), wall time (first start to last end), mean and p95"""
+        report = {}
+        for stage in stages:
+            spans = self.spans.get(stage, [])
+            durations = sorted(end - start for start, end in spans)
+            report[stage] = {
+                "calls": len(spans),
+                "busy_seconds": round(sum(durations), 4),
+                "wall_seconds": round(max(end for _, end in spans) - min(start for start, _ in spans), 4) if spans else 0.0,
+                "mean_ms": round(1000 * statistics.mean(durations), 2) if durations else 0.0,
+                "p95_ms": round(1000 * percentile(durations, 0.95), 2)
+            }
+        return report
+
+    def wrap_async(self, stage, obj, name):
+        func = getattr(obj, name)
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.record(stage, start, time.perf_counter())
+        setattr(obj, name, timed)
+
+    def wrap_sync(self, stage, obj, name):
+        func = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, start, time.perf_counter())
+        setattr(obj, name, timed)
+
+    def wrap_async_iter(self, stage, obj, name):
+        """Time each step of an async generator (e.g. waiting for the next parsed PDF page)"""
+        func = getattr(obj, name)
+
+        async def timed(*args, **kwargs):
+            iterator = func(*args, **kwargs).__aiter__()
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    self.record(stage, start, time.perf_counter())
+                yield item
+        setattr(obj, name, timed)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))] if ordered else 0.0
+
+
+def latency_summary(values):
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.5), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "max": round(max(values), 4) if values else 0.0
+    }
+
+
+def install_fakes(app, args):
+    """Register service factories that use the fake backends; returns the fakes for their counters"""
+    from fake_backends import FakeLatency, FakeOpenAI, FakePinecone, FakeGCSClient
+    from llm_scheduler import ScheduledClient, llm_scheduler, parse_rate_limits
+    from openai_service import OpenAIService
+    from storage_service import StorageService
+    from pinecone_service import PineconeService
+
+    fake_openai = FakeOpenAI(FakeLatency(args.llm_latency, args.llm_jitter, args.llm_failure_rate, args.seed),
+                             completion_seconds_per_token=args.llm_seconds_per_token,
+                             paraphrased_quote_rate=args.paraphrased_quote_rate)
+    fake_pinecone = FakePinecone(FakeLatency(args.index_latency, args.index_latency / 2, args.index_failure_rate,
+                                             args.seed + 1))
+    fake_gcs = FakeGCSClient(FakeLatency(args.storage_latency, args.storage_latency / 2, args.storage_failure_rate,
+                                         args.seed + 2))
+    if args.rate_limits:
+        llm_scheduler.rate_limits.update(parse_rate_limits(args.rate_limits))
+
+    def openai_service():
+        service = OpenAIService(http_pool=app.services.get("http_pool"), scheduler=llm_scheduler)
+        service.async_client = ScheduledClient(fake_openai, llm_scheduler, is_async=True)
+        return service
+
+    app.services.register("openai_service", openai_service)
+    app.services.register("storage_service", lambda: StorageService(
+        "benchmark", cache=app.services.get("storage_cache"), client=fake_gcs
+    ))
+    app.services.register("vector_service", lambda: PineconeService(pc=fake_pinecone))
+    return fake_openai, fake_pinecone, fake_gcs
+
+
+def instrument(app, timer):
+    """Time the pipeline stages by wrapping the methods of the (already created) service instances"""
+    services = app.services
+    document_processor = services.get("document_processor")
+    timer.wrap_async("extraction", document_processor, "extract_content_async")
+    timer.wrap_async("extraction", document_processor, "count_pdf_pages_async")
+    timer.wrap_async_iter("extraction", document_processor, "iter_pdf_pages")
+    timer.wrap_async("tagging", services.get("openai_service"), "_process_unit_async")
+    embedding_service = services.get("embedding_service")
+    timer.wrap_async("embedding", embedding_service, "embed_chunks_async")
+    timer.wrap_async("query_embedding", embedding_service, "embed_text_async")
+    timer.wrap_sync("upsert", services.get("vector_service"), "upsert_chunks")
+    storage_service = services.get("storage_service")
+    timer.wrap_sync("storage", storage_service, "upload_file")
+    timer.wrap_sync("storage", storage_service, "store_processed_content")
+    timer.wrap_async("category_analysis", services.get("category_classifier"), "classify_async")
+    query_pipeline = services.get("query_pipeline")
+    timer.wrap_async("retrieval", query_pipeline, "search")
+    timer.wrap_async("generation", query_pipeline, "generate")
+    timer.wrap_async("quote_repair", query_pipeline, "repair_quote")
+
+
+async def wait_for_job(client, job_id):
+    while True:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        await asyncio.sleep(0.02)
+
+
+async def run_uploads(client, documents, batch):
+    """Upload every document (concurrently, or in one /upload/batch) and wait for the jobs to finish"""
+    start = time.perf_counter()
+    latencies = []
+
+    async def finish(job_id):
+        job = await wait_for_job(client, job_id)
+        latencies.append(time.perf_counter() - start)
+        return job
+
+    if batch:
+        response = await client.post("/upload/batch", files=[("files", (name, data)) for name, data in documents])
+        jobs = await asyncio.gather(*[finish(job["job_id"]) for job in response.json()["jobs"]])
+    else:
+        async def upload(name, data):
+            response = await client.post("/upload", files={"file": (name, data)})
+            return await finish(response.json()["job_id"])
+        jobs = await asyncio.gather(*[upload(name, data) for name, data in documents])
+    failed = [job for job in jobs if job["status"] == "failed"]
+    for job in failed:
+        logging.warning(f"Upload of {job['filename']} failed: {job['error']}")
+    return {
+        "documents": len(documents),
+        "failed": len(failed),
+        "wall_seconds": round(time.perf_counter() - start, 4),
+        "latency_seconds": latency_summary(latencies)
+    }
+
+
+async def run_queries(client, count, concurrency):
+    """Send count /query requests, at most concurrency at a time"""
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    failed = 0
+
+    async def query(text):
+        nonlocal failed
+        async with slots:
+            start = time.perf_counter()
+            response = await client.post("/query", json={"query": text})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failed += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[query(QUERIES[i % len(QUERIES)]) for i in range(count)])
+    return {
+        "queries": count,
+        "failed": failed,
+        "wall_seconds": round(time.perf_counter() - start, 4),
+        "latency_seconds": latency_summary(latencies)
+    }
+
+
+async def run_benchmark(args):
+    import httpx
+    import app
+    from llm_scheduler import llm_scheduler
+
+    fake_openai, fake_pinecone, fake_gcs = install_fakes(app, args)
+    timer = StageTimer()
+    report = {"label": args.label, "date": str(datetime.now()), "config": vars(args)}
+    async with app.lifespan(app.app):
+        # Build every service up front so construction is not part of the measurements
+        await app.services.warm_up()
+        if not app.services.ready():
+            raise RuntimeError(f"Services failed to start: {app.services.status()}")
+        instrument(app, timer)
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            documents = make_documents(args.documents, args.pages, args.seed)
+            report["upload"] = await run_uploads(client, documents, args.batch)
+            report["upload"]["pages"] = args.documents * args.pages
+            report["upload"]["stages"] = timer.summary(UPLOAD_STAGES)
+            upload_llm = fake_openai.stats()
+
+            timer.reset()
+            report["query"] = await run_queries(client, args.queries, args.query_concurrency)
+            report["query"]["stages"] = timer.summary(QUERY_STAGES)
+
+    models = fake_openai.stats()
+    report["llm"] = {
+        "models": models,
+        "upload_calls": sum(model["calls"] for model in upload_llm.values()),
+        "query_calls": sum(model["calls"] for model in models.values()) - sum(model["calls"] for model in upload_llm.values()),
+        "prompt_tokens": sum(model["prompt_tokens"] for model in models.values()),
+        "completion_tokens": sum(model["completion_tokens"] for model in models.values()),
+        "failures_injected": sum(model["failures"] for model in models.values()),
+        "retries": llm_scheduler.stats()["retries"]
+    }
+    index_calls = Counter()
+    for index in fake_pinecone.indexes.values():
+        index_calls.update(index.calls)
+    report["index_calls"] = dict(index_calls)
+    report["storage_calls"] = {name: dict(bucket.calls) for name, bucket in fake_gcs.buckets.items()}
+    return report
+
+
+def headline_metrics(report):
+    """The scalar metrics printed and compared across runs"""
+    metrics = {
+        "upload wall s": report["upload"]["wall_seconds"],
+        "upload p50 s": report["upload"]["latency_seconds"]["p50"],
+        "query wall s": report["query"]["wall_seconds"],
+        "query p50 s": report["query"]["latency_seconds"]["p50"],
+        "query p95 s": report["query"]["latency_seconds"]["p95"],
+    }
+    for phase in ("upload", "query"):
+        for stage, stats in report[phase]["stages"].items():
+            metrics[f"{stage} busy s"] = stats["busy_seconds"]
+            metrics[f"{stage} calls"] = stats["calls"]
+    for key in ("upload_calls", "query_calls", "prompt_tokens", "completion_tokens", "retries"):
+        metrics[f"llm {key.replace('_', ' ')}"] = report["llm"][key]
+    return metrics
+
+
+def print_report(report, baseline=None):
+    current = headline_metrics(report)
+    previous = headline_metrics(baseline) if baseline else {}
+    header = f"{'metric':<28}{'value':>12}"
+    if baseline:
+        header += f"{baseline.get('label') or 'baseline':>14}{'change':>10}"
+    print(header)
+    for name, value in current.items():
+        line = f"{name:<28}{value:>12}"
+        if baseline:
+            old = previous.get(name)
+            change = f"{100 * (value - old) / old:+.1f}%" if old else "-"
+            line += f"{'-' if old is None else old:>14}{change:>10}"
+        print(line)
+    upload, query = report["upload"], report["query"]
+    print(f"\n{upload['documents']} documents ({upload['pages']} pages, {upload['failed']} failed), "
+          f"{query['queries']} queries ({query['failed']} failed), "
+          f"{report['llm']['failures_injected']} LLM failures injected")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--label", default=None, help="Name of this run in comparisons")
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=12, help="Pages per document")
+    parser.add_argument("--batch", action="store_true", help="Upload all documents through /upload/batch")
+    parser.add_argument("--queries", type=int, default=8)
+    parser.add_argument("--query-concurrency", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds per OpenAI call")
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--llm-seconds-per-token", type=float, default=0.0, help="Extra seconds per completion token")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="Share of OpenAI calls failing with 429/500")
+    parser.add_argument("--paraphrased-quote-rate", type=float, default=0.25, help="Share of quotes needing repair")
+    parser.add_argument("--rate-limits", default=None, help="Scheduler limits, as in LLM_RATE_LIMITS")
+    parser.add_argument("--index-latency", type=float, default=0.05, help="Seconds per Pinecone call")
+    parser.add_argument("--index-failure-rate", type=float, default=0.0)
+    parser.add_argument("--storage-latency", type=float, default=0.05, help="Seconds per GCS call")
+    parser.add_argument("--storage-failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=None, help="Write the full report as JSON")
+    parser.add_argument("--compare", default=None, help="JSON report of an earlier run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's INFO logging")
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    # Caches, spool and logs go to a scratch directory; app modules are imported from the backend
+    os.chdir(tempfile.mkdtemp(prefix="benchmark-"))
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ["LOG_FILE"] = os.path.join(os.getcwd(), "benchmark.log")
+    os.environ.setdefault("PINECONE_INDEX_NAME", "benchmark")
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["INGESTION_SPOOL_DIR"] = os.path.join(os.getcwd(), "spool")
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    report = asyncio.run(run_benchmark(args))
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
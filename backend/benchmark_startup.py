@@ -0,0 +1,84 @@
+"""Measure cold start: how long `import app` takes, and how long a fresh server needs to answer /health and /ready.
+
+Usage: python benchmark_startup.py [--runs 3] [--port 8765] [--ready-timeout 60]
+Runs against the backends configured in the environment (.env), like the real server.
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+import urllib.request
+import urllib.error
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_import():
+    """Seconds a fresh interpreter spends importing app"""
+    code = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def wait_for(url, deadline):
+    """Poll url until it answers 200; returns the time it did, or None at the deadline"""
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.05)
+    return None
+
+
+def measure_server(port, ready_timeout):
+    """Seconds from launching uvicorn until /health, then /ready, answer 200 (None if /ready never did)"""
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = start + ready_timeout
+        healthy = wait_for(f"http://127.0.0.1:{port}/health", deadline)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", deadline) if healthy else None
+    finally:
+        server.terminate()
+        server.wait()
+    return (healthy - start if healthy else None), (ready - start if ready else None)
+
+
+def summarize(label, values):
+    measured = [value for value in values if value is not None]
+    if not measured:
+        print(f"{label:<22} not reached")
+        return
+    print(f"{label:<22} median {statistics.median(measured):6.2f}s  min {min(measured):6.2f}s  "
+          f"max {max(measured):6.2f}s  ({len(measured)}/{len(values)} runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ready-timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    imports, healthy, ready = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import())
+        first_request, first_ready = measure_server(args.port, args.ready_timeout)
+        healthy.append(first_request)
+        ready.append(first_ready)
+
+    summarize("import app", imports)
+    summarize("first /health 200", healthy)
+    summarize("first /ready 200", ready)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import os
+import json
+import logging
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from openai_service import VALID_COMPETENCIES
+
+load_dotenv()
+
+# Minimum margin between the best competency score and the median score before the LLM fallback is used
+DEFAULT_CONFIDENCE_THRESHOLD = float(os.getenv("CATEGORY_CONFIDENCE_THRESHOLD", "0.03"))
+# Set CATEGORY_LLM_FALLBACK=false to never call the LLM for category analysis
+DEFAULT_LLM_FALLBACK = os.getenv("CATEGORY_LLM_FALLBACK", "true").lower() == "true"
+# How much the centroid of tagged chunks contributes to a competency prototype (0-1)
+DEFAULT_EXAMPLE_WEIGHT = float(os.getenv("CATEGORY_EXAMPLE_WEIGHT", "0.5"))
+DEFAULT_PROTOTYPES_PATH = os.getenv("CATEGORY_PROTOTYPES_PATH", "category_prototypes.npz")
+# Centroid updates are written to disk at most this often (and by flush() at shutdown)
+DEFAULT_SAVE_SECONDS = float(os.getenv("CATEGORY_PROTOTYPES_SAVE_SECONDS", "60"))
+
+COMPETENCY_DESCRIPTIONS = {
+    "Results": "Delivering measurable outcomes, hitting goals and being accountable for tangible results.",
+    "Execution": "Turning plans into action, following through, getting things done efficiently and on time.",
+    "Fearless Presenter": "Public speaking, pitching ideas with confidence, presenting to investors and audiences.",
+    "Seize Opportunities": "Recognizing and acting on opportunities, taking initiative and calculated risks.",
+    "Connection": "Building genuine relationships, networking, empathy and rapport with others.",
+    "Leadership": "Guiding and inspiring a team, setting direction, mentoring and taking responsibility for others.",
+    "Collaboration": "Working effectively in teams, cooperation, sharing ideas and resolving conflict together.",
+    "Awareness": "Self-awareness and social awareness, understanding emotions, perspectives and context.",
+    "Planning": "Setting goals, strategy, roadmaps, schedules and preparing for the future.",
+    "Constructive Thinking": "Problem solving, critical and creative thinking, reframing challenges positively.",
+    "Organize": "Structuring work, time management, managing resources, information and priorities.",
+    "Control": "Self-discipline, managing impulses and emotions, staying composed under pressure.",
+    "Authenticity": "Acting according to personal values, integrity, honesty and being true to oneself.",
+    "CEO Perspective": "Big-picture business thinking, stakeholders, finances and strategic decision making.",
+    "Vision": "Articulating dreams and long-term direction, imagining the future and purpose of a venture.",
+    "Growth Mindset": "Learning from failure, resilience, embracing feedback and continuous self-improvement."
+}
+
+CATEGORY_ANALYSIS_PROMPT = """You are an expert at categorizing educational content queries.
+Analyze the user's query and determine which of these 16 subcategories it relates to:
+
+ACTION category:
+- Results
+- Execution
+- Fearless Presenter
+- Seize Opportunities
+
+RELATIONSHIPS category:
+- Connection
+- Leadership
+- Collaboration
+- Awareness
+
+DISCIPLINE category:
+- Planning
+- Constructive Thinking
+- Organize
+- Control
+
+PURPOSE category:
+- Authenticity
+- CEO Perspective
+- Vision
+- Growth Mindset
+
+Return ONLY a JSON array of the most relevant subcategories (maximum 3) that the query relates to.
+Example response: ["Leadership", "Vision", "Planning"]"""
+
+
+class CategoryClassifier:
+    """Map a query embedding onto the 16 competencies using cosine similarity to prototype embeddings.
+
+    Each prototype blends the embedding of the competency name and description with the centroid
+    of chunks already tagged with that competency. The LLM is only consulted when the local
+    result is not confident.
+    """
+
+    def __init__(self, embedding_service, llm_client=None, confidence_threshold=DEFAULT_CONFIDENCE_THRESHOLD,
+                 llm_fallback=DEFAULT_LLM_FALLBACK, example_weight=DEFAULT_EXAMPLE_WEIGHT,
+                 prototypes_path=DEFAULT_PROTOTYPES_PATH, save_seconds=DEFAULT_SAVE_SECONDS):
+        self.embedding_service = embedding_service
+        self.llm_client = llm_client
+        self.confidence_threshold = confidence_threshold
+        self.llm_fallback = llm_fallback
+        self.example_weight = example_weight
+        self.prototypes_path = prototypes_path
+        self.save_seconds = save_seconds
+        self.competencies = list(VALID_COMPETENCIES)
+        self.llm_calls = 0
+        self._lock = threading.Lock()
+        self._description_vectors = None
+        self._example_sums = None
+        self._example_counts = np.zeros(len(self.competencies), dtype=np.float32)
+        self._prototypes = None
+        self._unsaved = False
+        self._save_timer = None
+        # No saved centroids yet: backfill() builds them from the documents ingested so far
+        self.needs_backfill = not self._load_examples()
+
+    async def ensure_built_async(self):
+        """Embed the competency descriptions once (cached on disk by the embedding service)"""
+        if self._description_vectors is None:
+            texts = [f"{name}: {COMPETENCY_DESCRIPTIONS[name]}" for name in self.competencies]
+            self._set_description_vectors(await self.embedding_service.embed_texts_async(texts))
+
+    def ensure_built(self):
+        """Blocking variant of ensure_built_async"""
+        if self._description_vectors is None:
+            texts = [f"{name}: {COMPETENCY_DESCRIPTIONS[name]}" for name in self.competencies]
+            self._set_description_vectors(self.embedding_service.embed_texts(texts))
+
+    def add_tagged_chunks(self, chunks):
+        """Fold embedded, tagged chunks into the competency centroids; they are saved within save_seconds"""
+        self._update_examples(chunks, 1.0)
+
+    def remove_tagged_chunks(self, chunks):
+        """Take replaced or deleted chunks (as they were added) back out of the competency centroids"""
+        self._update_examples(chunks, -1.0)
+
+    def backfill(self, storage_service):
+        """Build the centroids from the processed/ artifacts of documents ingested before any were saved"""
+        documents = 0
+        for filename in storage_service.list_processed():
+            try:
+                processed = storage_service.get_processed(filename)
+            except Exception as e:
+                logging.error(f"Could not read {filename} for the category prototypes: {str(e)}")
+                continue
+            if processed:
+                self.add_tagged_chunks(processed.get("chunks", []))
+                documents += 1
+        self.needs_backfill = False
+        self.flush()
+        logging.info(f"Built category prototypes from {documents} processed documents")
+
+    def _update_examples(self, chunks, sign):
+        index = {name: i for i, name in enumerate(self.competencies)}
+        with self._lock:
+            for chunk in chunks:
+                embedding = chunk.get("embedding")
+                if embedding is None or not len(embedding):
+                    continue
+                vector = self._normalize(np.asarray(embedding, dtype=np.float32))
+                if self._example_sums is None:
+                    self._example_sums = np.zeros((len(self.competencies), vector.shape[0]), dtype=np.float32)
+                # Tags are ranked, so the most relevant tag counts the most
+                for rank, tag in enumerate(chunk.get("tags", [])):
+                    if tag in index:
+                        weight = sign / (rank + 1)
+                        self._example_sums[index[tag]] += weight * vector
+                        self._example_counts[index[tag]] += weight
+            # Reset competencies whose examples were all removed (float rounding leaves them slightly off zero),
+            # or that went negative because chunks were removed that were never added
+            emptied = self._example_counts < 1e-3
+            self._example_counts[emptied] = 0
+            if self._example_sums is not None:
+                self._example_sums[emptied] = 0
+            self._prototypes = None
+            self._unsaved = True
+            if self._save_timer is None and self.prototypes_path:
+                self._save_timer = threading.Timer(self.save_seconds, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Save the centroids if they changed since the last save (called at shutdown and by the save timer)"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._unsaved:
+                self._save_examples()
+                self._unsaved = False
+
+    def score(self, query_embedding):
+        """Return cosine similarity of the query to every competency prototype"""
+        prototypes = self._get_prototypes()
+        query = self._normalize(np.asarray(query_embedding, dtype=np.float32))
+        return prototypes @ query
+
+    def classify(self, query_embedding, top_k=3):
+        """Return the top_k competencies for a query embedding and a confidence value"""
+        scores = self.score(query_embedding)
+        top = np.argsort(-scores)[:top_k]
+        confidence = float(scores[top[0]] - np.median(scores))
+        return [self.competencies[i] for i in top], confidence
+
+    async def classify_async(self, query, query_embedding, top_k=3):
+        """Classify locally, falling back to the LLM only when confidence is low"""
+        await self.ensure_built_async()
+        categories, confidence = self.classify(query_embedding, top_k=top_k)
+        if confidence >= self.confidence_threshold or not self.llm_fallback or self.llm_client is None:
+            return categories
+
+        logging.info(f"Category confidence {confidence:.3f} below threshold, asking the LLM")
+        self.llm_calls += 1
+        try:
+            response = await self.llm_client.chat.completions.create(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": CATEGORY_ANALYSIS_PROMPT},
+                    {"role": "user", "content": query}
+                ]
+            )
+            llm_categories = self._parse_categories(response.choices[0].message.content)
+            return llm_categories[:top_k] or categories
+        except Exception as e:
+            logging.error(f"Category LLM fallback failed: {str(e)}")
+            return categories
+
+    def _parse_categories(self, response_text):
+        """Pull a JSON array of valid competencies out of an LLM reply"""
+        start = response_text.find('[')
+        end = response_text.rfind(']') + 1
+        if start < 0 or end <= start:
+            return []
+        try:
+            categories = json.loads(response_text[start:end])
+        except json.JSONDecodeError:
+            return []
+        if not isinstance(categories, list):
+            return []
+        return [category for category in categories if category in self.competencies]
+
+    def _set_description_vectors(self, embeddings):
+        with self._lock:
+            self._description_vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+            self._prototypes = None
+
+    def _get_prototypes(self):
+        """Blend description embeddings with tagged-chunk centroids into a normalized prototype matrix"""
+        if self._prototypes is not None:
+            return self._prototypes
+        self.ensure_built()
+        with self._lock:
+            prototypes = self._description_vectors.copy()
+            if self._example_sums is not None and self._example_sums.shape[1] == prototypes.shape[1]:
+                has_examples = self._example_counts > 0
+                centroids = self._normalize(self._example_sums[has_examples])
+                prototypes[has_examples] = ((1 - self.example_weight) * prototypes[has_examples]
+                                            + self.example_weight * centroids)
+            self._prototypes = self._normalize(prototypes)
+            return self._prototypes
+
+    def _normalize(self, vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _load_examples(self):
+        """Load persisted tagged-chunk centroids if present; returns whether they were loaded"""
+        if not self.prototypes_path or not os.path.exists(self.prototypes_path):
+            return False
+        try:
+            data = np.load(self.prototypes_path)
+            if list(data["competencies"]) == self.competencies:
+                self._example_sums = data["sums"]
+                self._example_counts = data["counts"]
+                return True
+        except Exception as e:
+            logging.error(f"Could not load category prototypes: {str(e)}")
+        return False
+
+    def _save_examples(self):
+        """Persist tagged-chunk centroids (lock must be held)"""
+        if not self.prototypes_path or self._example_sums is None:
+            return
+        try:
+            # Write to a temporary file first so a crash never leaves a half-written file
+            with open(f"{self.prototypes_path}.tmp", "wb") as f:
+                np.savez(f, competencies=np.array(self.competencies),
+                         sums=self._example_sums, counts=self._example_counts)
+            os.replace(f"{self.prototypes_path}.tmp", self.prototypes_path)
+        except Exception as e:
+            logging.error(f"Could not save category prototypes: {str(e)}")
@@ -0,0 +1,120 @@
+import os
+import re
+from dotenv import load_dotenv
+from embedding_service import estimate_tokens
+from quote_aligner import tokenize
+
+load_dotenv()
+
+# Token budget for the retrieved context in the /query prompt
+QUERY_CONTEXT_TOKEN_BUDGET = int(os.getenv("QUERY_CONTEXT_TOKEN_BUDGET", "6000"))
+# Word-trigram Jaccard similarity above which a chunk counts as a near-duplicate of one already kept
+DUPLICATE_THRESHOLD = float(os.getenv("QUERY_CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+SENTENCE_PATTERN = re.compile(r"[^.!?\n]+(?:[.!?]+[\"'”’)]*|\n|$)")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "i", "in", "is", "it", "of",
+    "on", "or", "our", "that", "the", "this", "to", "we", "what", "with", "you", "your", "want", "lesson", "plan"
+}
+
+
+def format_chunk(index, metadata, text):
+    """One chunk of the context block"""
+    return (f"\n--- CHUNK {index} ---\n"
+            f"Source: {metadata.get('filename', 'unknown')}\n"
+            f"Chunk ID: {metadata.get('chunkId', 'unknown')}\n"
+            f"Tags: {metadata.get('tags', [])}\n"
+            f"Content: {text}\n"
+            "---\n")
+
+
+def _shingles(text):
+    words = [word for word, _, _ in tokenize(text)]
+    return {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class ContextPacker:
+    """Build the /query context block within a token budget.
+
+    Matches are taken in retrieval order; near-duplicates of a chunk already kept are dropped,
+    and chunks that do not fit their share of the budget are trimmed to the sentences that share
+    the most words with the query (kept in document order, gaps marked with "...").
+    """
+
+    def __init__(self, token_budget=QUERY_CONTEXT_TOKEN_BUDGET, duplicate_threshold=DUPLICATE_THRESHOLD):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+
+    def pack(self, query, matches):
+        """Return (context, report) where report counts dropped and trimmed chunks and tokens saved"""
+        full_context = "".join(format_chunk(i + 1, match["metadata"], match["metadata"].get("chunkText", ""))
+                               for i, match in enumerate(matches))
+
+        kept = []
+        kept_shingles = []
+        for match in matches:
+            shingles = _shingles(match["metadata"].get("chunkText", ""))
+            if any(_jaccard(shingles, other) >= self.duplicate_threshold for other in kept_shingles):
+                continue
+            kept.append(match)
+            kept_shingles.append(shingles)
+
+        query_terms = self._terms(query)
+        context = ""
+        trimmed = 0
+        for i, match in enumerate(kept):
+            metadata = match["metadata"]
+            header_tokens = estimate_tokens(format_chunk(i + 1, metadata, ""))
+            # Split what is left evenly over the remaining chunks, so short chunks leave room for long ones
+            allowance = (self.token_budget - estimate_tokens(context)) // (len(kept) - i) - header_tokens
+            if allowance <= 0:
+                break
+            text = metadata.get("chunkText", "")
+            if estimate_tokens(text) > allowance:
+                text = self.trim(text, query_terms, allowance)
+                trimmed += 1
+            context += format_chunk(i + 1, metadata, text)
+
+        full_tokens = estimate_tokens(full_context)
+        packed_tokens = estimate_tokens(context)
+        report = {
+            "chunks_retrieved": len(matches),
+            "duplicates_dropped": len(matches) - len(kept),
+            "chunks_trimmed": trimmed,
+            "context_tokens_full": full_tokens,
+            "context_tokens_packed": packed_tokens
+        }
+        return context, report
+
+    def trim(self, text, query_terms, max_tokens):
+        """Keep the sentences of text most relevant to the query within max_tokens"""
+        sentences = [s.strip() for s in SENTENCE_PATTERN.findall(text) if s.strip()]
+        ranked = sorted(range(len(sentences)),
+                        key=lambda i: (-len(self._terms(sentences[i]) & query_terms), i))
+        chosen = []
+        used = 0
+        for i in ranked:
+            cost = estimate_tokens(sentences[i])
+            if used + cost > max_tokens:
+                continue
+            chosen.append(i)
+            used += cost
+        if not chosen:
+            # Not even one sentence fits: cut the most relevant one
+            return sentences[ranked[0]][:max_tokens * 4] if sentences else ""
+
+        parts = []
+        previous = None
+        for i in sorted(chosen):
+            if previous is not None and i != previous + 1:
+                parts.append("...")
+            parts.append(sentences[i])
+            previous = i
+        return " ".join(parts)
+
+    def _terms(self, text):
+        return {word for word, _, _ in tokenize(text) if word not in STOPWORDS and len(word) > 2}
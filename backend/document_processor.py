@@ -1,11 +1,139 @@
 import os
 import io
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from openai_service import OpenAIService
+from metrics import span, traced
 import docx
 
+# Extraction runs in a process pool so parsing never blocks the API process
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 2)))
+# Large PDFs are split into page ranges of this size and parsed in parallel
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+# Smaller ranges when streaming pages, so the first pages reach tagging sooner
+PDF_STREAM_PAGES_PER_TASK = int(os.getenv("PDF_STREAM_PAGES_PER_TASK", "5"))
+
+
+def _open_pdf(source):
+    """File object for a PDF given as bytes or as a path; a path is read lazily rather than loaded whole"""
+    return io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+
+
+def _count_pdf_pages(source):
+    """Number of pages in a PDF given as bytes or a path (runs in a worker process)"""
+    import PyPDF2
+    with _open_pdf(source) as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def _extract_pdf_page_range(source, start, end):
+    """Extract the text of pages [start, end) from a PDF given as bytes or a path (runs in a worker process)"""
+    import PyPDF2
+    with _open_pdf(source) as f:
+        reader = PyPDF2.PdfReader(f)
+        return [reader.pages[i].extract_text() or "" for i in range(start, min(end, len(reader.pages)))]
+
+
+def _extract_docx_text(file_content):
+    """Extract paragraph text from a DOCX given as bytes (runs in a worker process)"""
+    doc = docx.Document(io.BytesIO(file_content))
+    return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+
+
+def _decode_text(file_content):
+    return file_content.decode('utf-8')
+
+
 class DocumentProcessor:
-    def __init__(self):
-        self.openai_service = OpenAIService()
+    def __init__(self, max_workers=EXTRACTION_WORKERS, pages_per_task=PDF_PAGES_PER_TASK,
+                 stream_pages_per_task=PDF_STREAM_PAGES_PER_TASK, openai_service=None):
+        # Image OCR goes through the app's OpenAIService when one is given
+        self.openai_service = openai_service or OpenAIService()
+        self.max_workers = max_workers
+        self.pages_per_task = pages_per_task
+        self.stream_pages_per_task = stream_pages_per_task
+        self._executor = None
+
+    def _get_executor(self):
+        """Create the process pool on first use"""
+        if self._executor is None:
+            # spawn avoids forking a process that already runs threads (uvicorn, OpenAI clients)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def warm_up(self):
+        """Start the worker processes ahead of the first upload"""
+        executor = self._get_executor()
+        for _ in range(self.max_workers):
+            executor.submit(_decode_text, b"")
+
+    def shutdown(self):
+        """Stop the extraction worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @traced("extraction")
+    async def count_pdf_pages_async(self, path):
+        """Number of pages in a PDF on disk, counted in the process pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), _count_pdf_pages, path)
+
+    async def iter_pdf_pages(self, path, page_count=None):
+        """Yield the text of each page of a PDF on disk, in order.
+
+        Small page ranges are parsed in the process pool with at most max_workers ranges in flight, so
+        early pages are yielded while later ones are still parsing and memory does not grow with the file.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        if page_count is None:
+            page_count = await self.count_pdf_pages_async(path)
+        pending = deque()
+        for start in range(0, page_count, self.stream_pages_per_task):
+            pending.append(loop.run_in_executor(
+                executor, _extract_pdf_page_range, path, start, start + self.stream_pages_per_task
+            ))
+            if len(pending) >= self.max_workers:
+                with span("extraction"):
+                    page_texts = await pending.popleft()
+                for page_text in page_texts:
+                    yield page_text
+        while pending:
+            with span("extraction"):
+                page_texts = await pending.popleft()
+            for page_text in page_texts:
+                yield page_text
+
+    @traced("extraction")
+    async def extract_content_async(self, file_path, file_content):
+        """Extract content like extract_content, but in the process pool; large PDFs are parsed in parallel page ranges"""
+        loop = asyncio.get_running_loop()
+        file_extension = file_path.split('.')[-1].lower()
+        if file_extension == 'pdf':
+            executor = self._get_executor()
+            page_count = await loop.run_in_executor(executor, _count_pdf_pages, file_content)
+            ranges = [(start, start + self.pages_per_task) for start in range(0, page_count, self.pages_per_task)]
+            # gather keeps the ranges in order, so pages are merged back in document order
+            results = await asyncio.gather(*[
+                loop.run_in_executor(executor, _extract_pdf_page_range, file_content, start, end)
+                for start, end in ranges
+            ])
+            return [page for pages in results for page in pages], 'text'
+        elif file_extension in ['doc', 'docx']:
+            text = await loop.run_in_executor(self._get_executor(), _extract_docx_text, file_content)
+            return text, 'text'
+        elif file_extension == 'txt':
+            text = await loop.run_in_executor(self._get_executor(), _decode_text, file_content)
+            return text, 'text'
+        else:
+            # Images go to GPT-4o Vision, which is network-bound rather than CPU-bound
+            return await asyncio.to_thread(self.extract_content, file_path, file_content)
 
     def extract_content(self, file_path, file_content=None):
         """Extract text from various file types: PDF (PyPDF2, returns list of page texts), DOCX (python-docx), TXT (read), images (GPT-4o Vision)."""
@@ -80,4 +208,4 @@ class DocumentProcessor:
             current_chunk += paragraph + "\n\n"
         if current_chunk.strip():
             chunks.append(current_chunk.strip())
-        return chunks 
\ No newline at end of file
+        return chunks
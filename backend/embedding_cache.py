@@ -0,0 +1,162 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+DEFAULT_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Hits update last_access in memory; they are written to SQLite before evicting or once this many are pending
+ACCESS_FLUSH_ENTRIES = 1000
+
+
+def text_hash(text):
+    """Content address for a text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Disk-backed embedding cache keyed by (model, sha256(text)) with LRU eviction and a size cap.
+
+    Embeddings are stored as float32 blobs in SQLite. When the stored vectors exceed max_bytes,
+    the least recently used entries are evicted. Reads do not write: access times of hits are kept
+    in memory and written in one statement before the next eviction check (or when many are pending).
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending_access = {}  # (model, text_hash) -> last access time not yet written
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get(self, model, text):
+        """Return the cached embedding for a text, or None"""
+        return self.get_many(model, [text])[0]
+
+    def put(self, model, text, embedding):
+        """Store the embedding for a text"""
+        self.put_many(model, [text], [embedding])
+
+    def get_many(self, model, texts):
+        """Return cached embeddings for texts in order, with None for misses"""
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            unique_hashes = list(dict.fromkeys(hashes))
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model] + batch
+                ).fetchall()
+                for row_hash, vector in rows:
+                    found[row_hash] = array("f", vector).tolist()
+            if found:
+                now = time.time()
+                for row_hash in found:
+                    self._pending_access[(model, row_hash)] = now
+                if len(self._pending_access) >= ACCESS_FLUSH_ENTRIES:
+                    self._write_access()
+                    self._conn.commit()
+            results = [found.get(h) for h in hashes]
+            hit_count = sum(1 for result in results if result is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put_many(self, model, texts, embeddings):
+        """Store embeddings for texts, evicting least recently used entries over the size cap"""
+        now = time.time()
+        rows = {}
+        for text, embedding in zip(texts, embeddings):
+            blob = array("f", embedding).tobytes()
+            rows[text_hash(text)] = (model, text_hash(text), blob, len(blob), now)
+        rows = list(rows.values())
+        if not rows:
+            return
+        with self._lock:
+            for model_name, row_hash, _, _, _ in rows:
+                existing = self._conn.execute(
+                    "SELECT size FROM embeddings WHERE model = ? AND text_hash = ?", (model_name, row_hash)
+                ).fetchone()
+                if existing:
+                    self._total_bytes -= existing[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._total_bytes += sum(row[3] for row in rows)
+            # Eviction orders by last_access, so recent hits must be in the table first
+            self._write_access()
+            self._evict()
+            self._conn.commit()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def close(self):
+        with self._lock:
+            self._write_access()
+            self._conn.commit()
+            self._conn.close()
+
+    def _write_access(self):
+        """Write the pending access times of cache hits (lock must be held; the caller commits)"""
+        if not self._pending_access:
+            return
+        self._conn.executemany(
+            "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ? AND last_access < ?",
+            [(now, model, row_hash, now) for (model, row_hash), now in self._pending_access.items()]
+        )
+        self._pending_access = {}
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits under max_bytes (lock must be held)"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        cursor = self._conn.execute("SELECT model, text_hash, size FROM embeddings ORDER BY last_access ASC")
+        victims = []
+        for model, row_hash, size in cursor:
+            if self._total_bytes <= self.max_bytes:
+                break
+            victims.append((model, row_hash))
+            self._total_bytes -= size
+            evicted += 1
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", victims)
+        logging.info(f"Embedding cache evicted {evicted} entries")
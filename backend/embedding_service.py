@@ -0,0 +1,149 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from metrics import traced
+from request_logging import in_request_context
+
+load_dotenv()
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# OpenAI allows up to 2048 inputs and ~300k tokens per embeddings request, and 8191 tokens per input.
+# The defaults stay well below those limits so a single batch never gets rejected.
+MAX_BATCH_INPUTS = int(os.getenv("EMBEDDING_MAX_BATCH_INPUTS", "256"))
+MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "100000"))
+MAX_INPUT_TOKENS = 8191
+MAX_CONCURRENT_BATCHES = int(os.getenv("EMBEDDING_MAX_CONCURRENT_BATCHES", "4"))
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used for batch packing"""
+    return len(text) // 4 + 1
+
+
+class EmbeddingService:
+    """Generate embeddings for many texts by packing them into batched requests"""
+
+    def __init__(self, client, async_client=None, model=DEFAULT_EMBEDDING_MODEL,
+                 max_batch_inputs=MAX_BATCH_INPUTS, max_batch_tokens=MAX_BATCH_TOKENS,
+                 max_concurrent_batches=MAX_CONCURRENT_BATCHES, cache=None):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+        self.max_batch_inputs = max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrent_batches = max_concurrent_batches
+        self.cache = cache
+
+    def embed_text(self, text):
+        """Embed a single text"""
+        return self.embed_texts([text])[0]
+
+    async def embed_text_async(self, text):
+        """Embed a single text without blocking the event loop"""
+        return (await self.embed_texts_async([text]))[0]
+
+    def embed_texts(self, texts):
+        """Embed a list of texts, returning embeddings in the same order"""
+        texts = [self._prepare_input(text) for text in texts]
+        cached, missing = self._split_cached(texts)
+        batches = self._make_batches(missing)
+        fresh = [None] * len(missing)
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_batches) as executor:
+            results = executor.map(in_request_context(lambda batch: self._embed_batch(missing, batch)), batches)
+            for batch, batch_embeddings in zip(batches, results):
+                for index, embedding in zip(batch, batch_embeddings):
+                    fresh[index] = embedding
+        return self._merge(texts, cached, missing, fresh)
+
+    async def embed_texts_async(self, texts):
+        """Embed a list of texts with several batches in flight, returning embeddings in order"""
+        if self.async_client is None:
+            return await asyncio.to_thread(self.embed_texts, texts)
+
+        texts = [self._prepare_input(text) for text in texts]
+        cached, missing = await asyncio.to_thread(self._split_cached, texts)
+        batches = self._make_batches(missing)
+        semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+
+        async def run_batch(batch):
+            async with semaphore:
+                response = await self.async_client.embeddings.create(
+                    input=[missing[i] for i in batch],
+                    model=self.model
+                )
+                return self._sorted_embeddings(response)
+
+        fresh = [None] * len(missing)
+        results = await asyncio.gather(*[run_batch(batch) for batch in batches])
+        for batch, batch_embeddings in zip(batches, results):
+            for index, embedding in zip(batch, batch_embeddings):
+                fresh[index] = embedding
+        return await asyncio.to_thread(self._merge, texts, cached, missing, fresh)
+
+    @traced("embedding")
+    def embed_chunks(self, chunks):
+        """Embed chunk dicts and return a mapping of chunk_id -> embedding"""
+        embeddings = self.embed_texts([chunk["text"] for chunk in chunks])
+        return {chunk["chunk_id"]: embedding for chunk, embedding in zip(chunks, embeddings)}
+
+    @traced("embedding")
+    async def embed_chunks_async(self, chunks):
+        """Embed chunk dicts without blocking the event loop, returning chunk_id -> embedding"""
+        embeddings = await self.embed_texts_async([chunk["text"] for chunk in chunks])
+        return {chunk["chunk_id"]: embedding for chunk, embedding in zip(chunks, embeddings)}
+
+    def _split_cached(self, texts):
+        """Look texts up in the cache, returning cached embeddings (None for misses) and the unique misses"""
+        cached = self.cache.get_many(self.model, texts) if self.cache else [None] * len(texts)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, cached) if embedding is None))
+        return cached, missing
+
+    def _merge(self, texts, cached, missing, fresh):
+        """Store freshly generated embeddings in the cache and combine them with the cached ones"""
+        if self.cache and missing:
+            self.cache.put_many(self.model, missing, fresh)
+        fresh_by_text = dict(zip(missing, fresh))
+        return [embedding if embedding is not None else fresh_by_text[text] for text, embedding in zip(texts, cached)]
+
+    def _embed_batch(self, texts, batch):
+        """Send one embeddings request for the given batch of text indices"""
+        response = self.client.embeddings.create(
+            input=[texts[i] for i in batch],
+            model=self.model
+        )
+        return self._sorted_embeddings(response)
+
+    def _sorted_embeddings(self, response):
+        """Return embeddings from a response in input order"""
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def _prepare_input(self, text):
+        """Make a text acceptable as a single embeddings input"""
+        # The API rejects empty strings and inputs over the per-input token limit
+        text = text if text and text.strip() else " "
+        max_chars = MAX_INPUT_TOKENS * 3
+        if len(text) > max_chars:
+            logging.warning(f"Truncating embedding input from {len(text)} to {max_chars} characters")
+            text = text[:max_chars]
+        return text
+
+    def _make_batches(self, texts):
+        """Greedily pack text indices into batches under the input and token limits"""
+        batches = []
+        current_batch = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = estimate_tokens(text)
+            if current_batch and (len(current_batch) >= self.max_batch_inputs
+                                  or current_tokens + tokens > self.max_batch_tokens):
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+            current_batch.append(i)
+            current_tokens += tokens
+        if current_batch:
+            batches.append(current_batch)
+        return batches
@@ -0,0 +1,366 @@
+"""Local stand-ins for the OpenAI client, the Pinecone index and the GCS bucket, used by benchmark_pipeline.
+
+Each fake answers with the same shapes the real client returns, sleeps for a configurable latency
+and can inject failures, so the pipeline runs offline with realistic timings and retries.
+"""
+import json
+import time
+import random
+import hashlib
+import asyncio
+import threading
+import types
+from collections import Counter
+import httpx
+import numpy as np
+import openai
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+from embedding_service import estimate_tokens
+from openai_service import VALID_COMPETENCIES
+from query_pipeline import LESSON_PLAN_SYSTEM_PROMPT, QUOTE_EXTRACTION_PROMPT
+from category_classifier import CATEGORY_ANALYSIS_PROMPT
+
+SENTENCE_END = ". "
+# Stands in for a quote the model paraphrased; it matches no chunk, so it goes to quote repair
+PARAPHRASED_QUOTE = "Remember this lesson about your goals and act on it every single day."
+
+
+class FakeLatency:
+    """Latency and failure injection shared by the fakes: seconds = latency +/- jitter, fails with failure_rate"""
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self, extra=0.0):
+        """Return (seconds to sleep, whether to fail) for one call"""
+        with self._lock:
+            seconds = max(0.0, self.latency + extra + self._random.uniform(-self.jitter, self.jitter))
+            return seconds, self._random.random() < self.failure_rate
+
+    def choice(self, options):
+        with self._lock:
+            return self._random.choice(options)
+
+
+def fake_embedding(text, dimension=1536):
+    """Deterministic unit vector for a text, so identical texts embed identically"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _sentences(text, count):
+    parts = [part.strip() for part in text.replace("\n", " ").split(SENTENCE_END) if part.strip()]
+    return SENTENCE_END.join(parts[:count]) + ("." if parts else "")
+
+
+class FakeOpenAI:
+    """Async stand-in for AsyncOpenAI: chat.completions.create and embeddings.create.
+
+    Chat replies are chosen from the prompt (page analysis JSON, tags, category list, lesson plan,
+    quote) so the pipeline parses them like real answers. Lesson plans quote the context verbatim,
+    except for a paraphrased_quote_rate share of extracts, which exercises quote repair.
+    Completion latency grows with completion_seconds_per_token. Counts calls and tokens per model.
+    """
+
+    def __init__(self, latency=None, completion_seconds_per_token=0.0, paraphrased_quote_rate=0.25):
+        self.latency = latency or FakeLatency()
+        self.completion_seconds_per_token = completion_seconds_per_token
+        self.paraphrased_quote_rate = paraphrased_quote_rate
+        self.calls = Counter()
+        self.prompt_tokens = Counter()
+        self.completion_tokens = Counter()
+        self.failures = Counter()
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._create_chat))
+        self.embeddings = types.SimpleNamespace(create=self._create_embeddings)
+
+    def stats(self):
+        models = set(self.calls) | set(self.failures)
+        return {
+            model: {
+                "calls": self.calls[model],
+                "failures": self.failures[model],
+                "prompt_tokens": self.prompt_tokens[model],
+                "completion_tokens": self.completion_tokens[model]
+            }
+            for model in sorted(models)
+        }
+
+    async def _create_chat(self, model, messages, stream=False, **kwargs):
+        content = self._reply(messages, kwargs)
+        prompt_tokens = sum(estimate_tokens(self._text(message.get("content"))) for message in messages)
+        completion_tokens = estimate_tokens(content)
+        await self._call(model, prompt_tokens, completion_tokens)
+        usage = types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                      total_tokens=prompt_tokens + completion_tokens)
+        if stream:
+            include_usage = (kwargs.get("stream_options") or {}).get("include_usage", False)
+            return self._stream(content, usage if include_usage else None)
+        message = types.SimpleNamespace(role="assistant", content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(index=0, message=message, finish_reason="stop")],
+                                     usage=usage, model=model)
+
+    async def _create_embeddings(self, model, input, **kwargs):
+        texts = input if isinstance(input, list) else [input]
+        prompt_tokens = sum(estimate_tokens(text) for text in texts)
+        await self._call(model, prompt_tokens, 0)
+        data = [types.SimpleNamespace(index=i, embedding=fake_embedding(text)) for i, text in enumerate(texts)]
+        return types.SimpleNamespace(data=data, model=model,
+                                     usage=types.SimpleNamespace(prompt_tokens=prompt_tokens, total_tokens=prompt_tokens))
+
+    async def _call(self, model, prompt_tokens, completion_tokens):
+        seconds, fail = self.latency.draw(completion_tokens * self.completion_seconds_per_token)
+        await asyncio.sleep(seconds)
+        if fail:
+            self.failures[model] += 1
+            raise self._error()
+        self.calls[model] += 1
+        self.prompt_tokens[model] += prompt_tokens
+        self.completion_tokens[model] += completion_tokens
+
+    def _error(self):
+        status = self.latency.choice([429, 500])
+        request = httpx.Request("POST", "https://api.openai.com/v1/fake")
+        response = httpx.Response(status, request=request)
+        if status == 429:
+            return openai.RateLimitError("Injected rate limit", response=response, body=None)
+        return openai.InternalServerError("Injected server error", response=response, body=None)
+
+    async def _stream(self, content, usage=None):
+        for start in range(0, len(content), 16):
+            delta = types.SimpleNamespace(content=content[start:start + 16])
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(index=0, delta=delta)], usage=None)
+        if usage is not None:
+            # Like the API with stream_options={"include_usage": True}: a final chunk with no choices
+            yield types.SimpleNamespace(choices=[], usage=usage)
+
+    def _text(self, content):
+        if isinstance(content, str) or content is None:
+            return content or ""
+        return " ".join(part.get("text", "") for part in content)
+
+    def _tags(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return list(dict.fromkeys(VALID_COMPETENCIES[b % len(VALID_COMPETENCIES)] for b in digest[:3]))
+
+    def _reply(self, messages, kwargs):
+        system = self._text(messages[0].get("content"))
+        user = self._text(messages[-1].get("content"))
+        if kwargs.get("response_format", {}).get("type") == "json_object":
+            return json.dumps({"summary": _sentences(user, 2), "tags": self._tags(user)})
+        if system == CATEGORY_ANALYSIS_PROMPT:
+            return json.dumps(self._tags(user)[:3])
+        if system == QUOTE_EXTRACTION_PROMPT:
+            return _sentences(user.split("Text: ", 1)[-1].split("\n\nQuestion:", 1)[0], 3)
+        if system == LESSON_PLAN_SYSTEM_PROMPT:
+            return self._lesson_plan(user)
+        if "JSON array" in system:
+            return json.dumps(self._tags(user))
+        return _sentences(user, 2)
+
+    def _lesson_plan(self, prompt):
+        """A lesson plan JSON quoting the first sentence of each context chunk"""
+        contents = [line[len("Content: "):] for line in prompt.splitlines() if line.startswith("Content: ")]
+        extracts = []
+        for i, content in enumerate(contents[:5]):
+            sentence = content.split(SENTENCE_END, 1)[0].strip().rstrip(".") + "."
+            paraphrased = self.latency.choice(range(100)) < self.paraphrased_quote_rate * 100
+            extracts.append({
+                "content": PARAPHRASED_QUOTE if paraphrased else sentence,
+                "reference": f"Chunk {i + 1}",
+                "teaching_suggestion": "Discuss in pairs. Report back to the class."
+            })
+        return json.dumps({
+            "competency": "Vision",
+            "category": "PURPOSE",
+            "extracts": extracts,
+            "lesson_approach": "Open with a question, read the extracts together, then apply them to a case."
+        })
+
+
+class FakePineconeIndex:
+    """Stand-in for a Pinecone Index: upsert, query (with a tags $in filter) and delete, held in memory"""
+
+    def __init__(self, latency=None):
+        self.latency = latency or FakeLatency()
+        self.vectors = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors):
+        self._call("upsert")
+        with self._lock:
+            for vector in vectors:
+                vector_id, values, metadata = (vector["id"], vector["values"], vector["metadata"]) \
+                    if isinstance(vector, dict) else vector
+                self.vectors[vector_id] = (np.asarray(values, dtype=np.float32), metadata)
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector, top_k=10, include_metadata=True, filter=None):
+        self._call("query")
+        allowed = set(filter["tags"]["$in"]) if filter else None
+        query = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            scored = [
+                {"id": vector_id, "score": float(values @ query), "metadata": metadata}
+                for vector_id, (values, metadata) in self.vectors.items()
+                if allowed is None or allowed & set(metadata.get("tags", []))
+            ]
+        scored.sort(key=lambda match: -match["score"])
+        return types.SimpleNamespace(matches=scored[:top_k])
+
+    def delete(self, ids):
+        self._call("delete")
+        with self._lock:
+            for vector_id in ids:
+                self.vectors.pop(vector_id, None)
+
+    def _call(self, operation):
+        seconds, fail = self.latency.draw()
+        time.sleep(seconds)
+        self.calls[operation] += 1
+        if fail:
+            raise ConnectionError(f"Injected Pinecone {operation} failure")
+
+
+class FakePinecone:
+    """Stand-in for the Pinecone client, holding one FakePineconeIndex per name"""
+
+    def __init__(self, latency=None):
+        self.latency = latency or FakeLatency()
+        self.indexes = {}
+
+    def list_indexes(self):
+        return [types.SimpleNamespace(name=name) for name in self.indexes]
+
+    def create_index(self, name, **kwargs):
+        self.indexes[name] = FakePineconeIndex(self.latency)
+
+    def Index(self, name, **kwargs):
+        return self.indexes.setdefault(name, FakePineconeIndex(self.latency))
+
+
+class FakeBlobWriter:
+    """Stand-in for the blob.open("wb") writer; an injected failure resends just the failed chunk"""
+
+    def __init__(self, blob, chunk_size):
+        self.blob = blob
+        self.chunk_size = chunk_size
+        self._buffer = b""
+        self._received = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._send(self._buffer[:self.chunk_size])
+            self._buffer = self._buffer[self.chunk_size:]
+        return len(data)
+
+    def close(self):
+        self._send(self._buffer)
+        self.blob.upload_from_string(b"".join(self._received), count=False)
+
+    def _send(self, payload):
+        while True:
+            try:
+                self.blob.bucket.call("upload_chunk")
+                break
+            except ServiceUnavailable:
+                pass
+        self._received.append(payload)
+
+
+class FakeBlob:
+    """Stand-in for google.cloud.storage.Blob with generations and ranged downloads"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def generation(self):
+        return self.bucket.objects[self.name][0]
+
+    def upload_from_string(self, data, content_type=None, count=True):
+        if count:
+            self.bucket.call("upload")
+        data = data.encode("utf-8") if isinstance(data, str) else data
+        with self.bucket.lock:
+            generation = self.bucket.objects.get(self.name, (0, b""))[0] + 1
+            self.bucket.objects[self.name] = (generation, data)
+
+    def open(self, mode, chunk_size=None, content_type=None, retry=None):
+        assert mode == "wb"
+        return FakeBlobWriter(self, chunk_size)
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None):
+        self.bucket.call("download")
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        generation, data = self.bucket.objects[self.name]
+        if if_generation_match is not None and if_generation_match != generation:
+            raise ServiceUnavailable(f"Generation of {self.name} changed")
+        data = data[start:None if end is None else end + 1]
+        self.bucket.bytes_downloaded += len(data)
+        return data
+
+    download_as_string = download_as_bytes
+
+    def delete(self):
+        self.bucket.call("delete")
+        with self.bucket.lock:
+            if self.bucket.objects.pop(self.name, None) is None:
+                raise NotFound(self.name)
+
+
+class FakeBucket:
+    def __init__(self, name, latency=None):
+        self.name = name
+        self.latency = latency or FakeLatency()
+        self.objects = {}
+        self.calls = Counter()
+        self.bytes_downloaded = 0
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        self.call("get")
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def call(self, operation):
+        seconds, fail = self.latency.draw()
+        time.sleep(seconds)
+        self.calls[operation] += 1
+        if fail:
+            raise ServiceUnavailable(f"Injected GCS {operation} failure")
+
+
+class FakeGCSClient:
+    """Stand-in for google.cloud.storage.Client: get_bucket and list_blobs over in-memory FakeBuckets"""
+
+    def __init__(self, latency=None):
+        self.latency = latency or FakeLatency()
+        self.buckets = {}
+
+    def get_bucket(self, bucket_name):
+        if bucket_name not in self.buckets:
+            self.buckets[bucket_name] = FakeBucket(bucket_name, self.latency)
+        return self.buckets[bucket_name]
+
+    def list_blobs(self, bucket_name, prefix=""):
+        bucket = self.get_bucket(bucket_name)
+        bucket.call("list")
+        return [FakeBlob(bucket, name) for name in sorted(bucket.objects) if name.startswith(prefix)]
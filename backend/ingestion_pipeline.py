@@ -0,0 +1,263 @@
+import os
+import asyncio
+import logging
+from array import array
+from datetime import datetime
+from dotenv import load_dotenv
+from request_logging import start_request
+
+load_dotenv()
+
+# Tagged pages are embedded and upserted in batches of this size, or once no new page arrived for this long
+INGESTION_BATCH_SIZE = int(os.getenv("INGESTION_BATCH_SIZE", "32"))
+INGESTION_LINGER_SECONDS = float(os.getenv("INGESTION_LINGER_SECONDS", "0.5"))
+# Documents of one batch upload that are extracted and tagged at the same time
+INGESTION_BATCH_DOCUMENTS = int(os.getenv("INGESTION_BATCH_DOCUMENTS", "8"))
+
+
+class IngestionPipeline:
+    """Ingest uploaded documents: extract, tag, embed, upsert and store.
+
+    PDF pages stream through the stages: pages are parsed from the spooled upload in small ranges,
+    each page is tagged as soon as it is parsed, and tagged pages are embedded and upserted in
+    batches while later pages are still being parsed and tagged. Documents ingested together
+    (run_batch) share one LLM concurrency limit and one writer, so chunks from different documents
+    fill the same embedding requests and vector upserts.
+    """
+
+    def __init__(self, document_processor, openai_service, storage_service, vector_service, embedding_service,
+                 category_classifier, batch_size=INGESTION_BATCH_SIZE, linger_seconds=INGESTION_LINGER_SECONDS,
+                 batch_documents=INGESTION_BATCH_DOCUMENTS):
+        self.document_processor = document_processor
+        self.openai_service = openai_service
+        self.storage_service = storage_service
+        self.vector_service = vector_service
+        self.embedding_service = embedding_service
+        self.category_classifier = category_classifier
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self.batch_documents = batch_documents
+
+    async def run(self, job):
+        """Run the full ingestion pipeline for a queued upload, reporting per-stage progress on the job"""
+        result = (await self.run_batch([job]))[0]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    async def run_batch(self, jobs):
+        """Ingest several queued uploads together; returns one result (or exception) per job, in order"""
+        chunk_queue = asyncio.Queue()
+        writer = asyncio.create_task(self._write_chunks(chunk_queue))
+        llm_slots = asyncio.Semaphore(self.openai_service.max_concurrency)
+        document_slots = asyncio.Semaphore(self.batch_documents)
+
+        async def run_document(job):
+            async with document_slots:
+                return await self._run_document(job, chunk_queue, llm_slots)
+
+        try:
+            results = await asyncio.gather(*[run_document(job) for job in jobs], return_exceptions=True)
+            chunk_queue.put_nowait(None)
+            await writer
+        finally:
+            writer.cancel()
+        return results
+
+    async def _run_document(self, job, chunk_queue, llm_slots):
+        start_request(f"job-{job.id[:8]}")
+        filename = job.filename
+
+        # Store the original in GCS from the spool file while the document is processed
+        upload = asyncio.create_task(asyncio.to_thread(self._upload_original, job.path, filename))
+        try:
+            chunks, tags, previous_hashes, previous_chunks = await self._process(job, chunk_queue, llm_slots)
+
+            # Drop vectors of pages that no longer exist, and their part of the query classifier's centroids
+            page_hashes = {chunk["chunk_id"]: chunk["content_hash"] for chunk in chunks}
+            removed_ids = [chunk_id for chunk_id in previous_hashes if chunk_id not in page_hashes]
+            if removed_ids:
+                await asyncio.to_thread(self.vector_service.delete_chunks, removed_ids)
+                removed_chunks = [previous_chunks[chunk_id] for chunk_id in removed_ids if chunk_id in previous_chunks]
+                await asyncio.to_thread(self.category_classifier.remove_tagged_chunks, removed_chunks)
+            job.progress["chunks_removed"] = len(removed_ids)
+
+            # Wait for the original upload started at the beginning
+            job.stage = "storing"
+            gcs_path = await upload
+
+            # Store processed results
+            processed_data = {
+                "filename": filename,
+                "gcs_path": gcs_path,
+                "chunks": chunks,
+                "tags": tags,
+                "page_hashes": page_hashes,
+                "processed_date": str(datetime.now())
+            }
+            await asyncio.to_thread(self.storage_service.store_processed_content, filename, processed_data)
+        finally:
+            # The upload thread cannot be interrupted; whichever step failed, let it finish (or fail)
+            # before the spool file goes away
+            await asyncio.gather(upload, return_exceptions=True)
+
+        return {
+            "filename": filename,
+            "chunks_processed": len(chunks),
+            "chunks_changed": job.progress["chunks_upserted"],
+            "chunks_removed": len(removed_ids),
+            "tags": tags,
+            "gcs_path": gcs_path
+        }
+
+    async def _process(self, job, chunk_queue, llm_slots):
+        """Extract and tag a document, queueing its chunks for the writer.
+
+        Returns (chunks, tags, previous page hashes, previous chunks by id).
+        """
+        filename = job.filename
+        # Extract (or, for PDFs, open) the document while fetching the previous ingestion of this file (if any)
+        job.stage = "extracting"
+        if filename.split('.')[-1].lower() == 'pdf':
+            page_count, previous = await asyncio.gather(
+                self.document_processor.count_pdf_pages_async(job.path),
+                asyncio.to_thread(self.storage_service.get_processed_if_exists, filename)
+            )
+            job.progress["pages_total"] = page_count
+            extracted_content, filetype = self._stream_pages(job, page_count), 'text'
+        else:
+            content = await asyncio.to_thread(job.read_content)
+            (extracted_content, filetype), previous = await asyncio.gather(
+                self.document_processor.extract_content_async(filename, content),
+                asyncio.to_thread(self.storage_service.get_processed_if_exists, filename)
+            )
+            pages_total = len(extracted_content) if isinstance(extracted_content, list) else 1
+            job.progress["pages_total"] = pages_total
+            job.progress["pages_extracted"] = pages_total
+        previous = previous or {}
+        document = {
+            "job": job,
+            "filename": filename,
+            "previous_chunks": {chunk["chunk_id"]: chunk for chunk in previous.get("chunks", []) if "chunk_id" in chunk},
+            "previous_hashes": previous.get("page_hashes", {}),
+            "written": asyncio.get_running_loop().create_future(),
+            "error": None
+        }
+
+        # Tag pages as they arrive; the writer embeds and upserts them in batches alongside
+        job.stage = "processing"
+
+        def on_chunk(chunk):
+            job.progress["pages_tagged"] += 1
+            chunk_queue.put_nowait(("chunk", document, chunk))
+
+        try:
+            # Pages ingested before (matched by content, wherever they moved) reuse their summary and tags
+            chunks, tags = await self.openai_service.process_document_async(
+                extracted_content, filename, filetype=filetype, on_chunk=on_chunk,
+                previous_chunks=document["previous_chunks"], semaphore=llm_slots
+            )
+        finally:
+            chunk_queue.put_nowait(("done", document))
+        await document["written"]
+        if document["error"] is not None:
+            raise document["error"]
+        return chunks, tags, document["previous_hashes"], document["previous_chunks"]
+
+    async def _stream_pages(self, job, page_count):
+        """Yield PDF page texts from the spooled upload, counting them as they are extracted"""
+        async for page_text in self.document_processor.iter_pdf_pages(job.path, page_count):
+            job.progress["pages_extracted"] += 1
+            yield page_text
+
+    async def _write_chunks(self, chunk_queue):
+        """Embed and upsert queued (document, chunk) pairs in batches until None is queued.
+
+        A document's "done" marker resolves document["written"] once every chunk queued before it has been
+        written, so a batch can mix the last pages of one document with the first pages of the next.
+        """
+        batch = []
+        waiting = []
+        finished = False
+        while not finished:
+            try:
+                item = await asyncio.wait_for(chunk_queue.get(), timeout=self.linger_seconds if batch else None)
+                if item is None:
+                    finished = True
+                elif item[0] == "done":
+                    waiting.append(item[1])
+                    if batch:
+                        continue
+                else:
+                    batch.append(item[1:])
+                    if len(batch) < self.batch_size:
+                        continue
+            except asyncio.TimeoutError:
+                pass
+            if batch:
+                await self._write_batch(batch)
+                batch = []
+            for document in waiting:
+                document["written"].set_result(None)
+            waiting = []
+
+    async def _write_batch(self, batch):
+        """Embed and upsert the new, edited or moved chunks of a batch of (document, chunk) pairs.
+
+        A chunk that carries an embedding was reused from the previous ingestion (same content_hash); if it
+        moved, only its new id and metadata are upserted, with the stored embedding.
+        """
+        try:
+            changed = []
+            for document, chunk in batch:
+                previous_chunk = document["previous_chunks"].get(chunk["chunk_id"], {})
+                if (document["previous_hashes"].get(chunk["chunk_id"]) != chunk["content_hash"]
+                        or previous_chunk.get("chunk_index") != chunk["chunk_index"]):
+                    changed.append((document, chunk))
+                else:
+                    document["job"].progress["pages_unchanged"] += 1
+            if not changed:
+                return
+
+            to_embed = [chunk for _, chunk in changed if chunk.get("embedding") is None or not len(chunk["embedding"])]
+            embeddings = await self.embedding_service.embed_chunks_async(to_embed) if to_embed else {}
+            chunk_objs = []
+            for document, chunk in changed:
+                if chunk["chunk_id"] in embeddings:
+                    document["job"].progress["chunks_embedded"] += 1
+                    # Kept with the chunk as float32 for the processed/ artifact
+                    chunk["embedding"] = array('f', embeddings[chunk["chunk_id"]])
+                else:
+                    document["job"].progress["pages_moved"] += 1
+                chunk_objs.append({
+                    "text": chunk["text"],
+                    "embedding": list(chunk["embedding"]),
+                    "tags": chunk.get("tags", []),
+                    "chunk_id": chunk["chunk_id"],
+                    "chunk_index": chunk["chunk_index"],
+                    "filename": document["filename"]
+                })
+            # One upsert for the whole batch, whichever documents its chunks came from; every chunk carries its
+            # own filename, so the upsert gets a label for its log line rather than one document's name
+            filenames = {document["filename"] for document, _ in changed}
+            label = next(iter(filenames)) if len(filenames) == 1 else f"{len(filenames)} documents"
+            await asyncio.to_thread(self.vector_service.upsert_chunks, label, chunk_objs)
+            for document, _ in changed:
+                document["job"].progress["chunks_upserted"] += 1
+
+            # Keep the query classifier's centroids in step with the index: the chunk a page replaces comes
+            # out, the page's chunk goes in
+            replaced = [document["previous_chunks"][chunk["chunk_id"]] for document, chunk in changed
+                        if chunk["chunk_id"] in document["previous_chunks"]]
+            if replaced:
+                await asyncio.to_thread(self.category_classifier.remove_tagged_chunks, replaced)
+            await asyncio.to_thread(self.category_classifier.add_tagged_chunks, chunk_objs)
+        except Exception as e:
+            # Only the documents with chunks in this batch fail; the writer keeps serving the others
+            logging.error(f"Writing a batch of {len(batch)} chunks failed: {str(e)}")
+            for document, _ in batch:
+                document["error"] = document["error"] or e
+
+    def _upload_original(self, path, filename):
+        with open(path, 'rb') as f:
+            return self.storage_service.upload_file(f, filename)
@@ -0,0 +1,206 @@
+import os
+import uuid
+import asyncio
+import logging
+import tempfile
+from datetime import datetime
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_NUM_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+DEFAULT_SPOOL_DIR = os.getenv("INGESTION_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "ingestion_spool"))
+# Uploads are copied to the spool in pieces of this size
+SPOOL_CHUNK_BYTES = int(os.getenv("INGESTION_SPOOL_CHUNK_BYTES", str(1024 * 1024)))
+# Finished jobs kept around for GET /jobs/{id}
+MAX_FINISHED_JOBS = int(os.getenv("INGESTION_MAX_FINISHED_JOBS", "1000"))
+
+
+class Job:
+    """A queued document ingestion and its per-stage progress"""
+
+    def __init__(self, filename, path):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.path = path
+        self.status = "queued"  # queued -> running -> completed | failed
+        self.stage = None
+        self.progress = {
+            "pages_total": 0,
+            "pages_extracted": 0,
+            "pages_tagged": 0,
+            "pages_unchanged": 0,
+            "pages_moved": 0,
+            "chunks_removed": 0,
+            "chunks_embedded": 0,
+            "chunks_upserted": 0
+        }
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+
+    def read_content(self):
+        """Read the spooled upload bytes"""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": str(self.created_at),
+            "started_at": str(self.started_at) if self.started_at else None,
+            "finished_at": str(self.finished_at) if self.finished_at else None
+        }
+
+
+class LocalJobQueue:
+    """In-process stand-in for an external job queue.
+
+    Uploaded bytes are spooled to a local directory, job state lives in memory, and a bounded
+    pool of asyncio workers runs handler(job) for each submitted job. Jobs submitted together with
+    submit_batch are run by one worker as batch_handler(jobs), which returns a result or an
+    exception per job.
+    """
+
+    def __init__(self, handler, num_workers=DEFAULT_NUM_WORKERS, spool_dir=DEFAULT_SPOOL_DIR,
+                 max_finished_jobs=MAX_FINISHED_JOBS, batch_handler=None):
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.num_workers = num_workers
+        self.spool_dir = spool_dir
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._workers = []
+
+    async def start(self):
+        """Start the worker pool (call from the running event loop)"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+        logging.info(f"Started {self.num_workers} ingestion workers")
+
+    async def stop(self):
+        """Cancel the workers; queued jobs are dropped"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, filename, content):
+        """Spool the upload and enqueue a job for it.
+
+        content is either bytes or a file with an async read(size), like UploadFile, which is copied
+        in SPOOL_CHUNK_BYTES pieces so the upload is never held in memory as a whole.
+        """
+        job = await self._spool(filename, content)
+        self.jobs[job.id] = job
+        await self._queue.put(job)
+        return job
+
+    async def submit_batch(self, files):
+        """Spool several uploads, given as (filename, content) pairs, and enqueue them as one batch"""
+        jobs = []
+        try:
+            for filename, content in files:
+                jobs.append(await self._spool(filename, content))
+        except BaseException:
+            for job in jobs:
+                self._remove_spool(job.path)
+            raise
+        for job in jobs:
+            self.jobs[job.id] = job
+        if self.batch_handler:
+            await self._queue.put(jobs)
+        else:
+            for job in jobs:
+                await self._queue.put(job)
+        return jobs
+
+    def is_running(self):
+        return bool(self._workers)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def depth(self):
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            jobs = item if isinstance(item, list) else [item]
+            for job in jobs:
+                job.status = "running"
+                job.started_at = datetime.now()
+            try:
+                try:
+                    if isinstance(item, list):
+                        results = await self.batch_handler(jobs)
+                    else:
+                        results = [await self.handler(item)]
+                except Exception as e:
+                    results = [e] * len(jobs)
+                for job, result in zip(jobs, results):
+                    if isinstance(result, Exception):
+                        logging.error(f"Ingestion job {job.id} ({job.filename}) failed", exc_info=result)
+                        job.status = "failed"
+                        job.error = str(result)
+                    else:
+                        job.result = result
+                        job.status = "completed"
+            finally:
+                for job in jobs:
+                    job.finished_at = datetime.now()
+                    job.stage = None
+                    self._remove_spool(job.path)
+                self._prune()
+                self._queue.task_done()
+
+    async def _spool(self, filename, content):
+        path = os.path.join(self.spool_dir, uuid.uuid4().hex)
+        if isinstance(content, bytes):
+            await asyncio.to_thread(self._write_spool, path, content)
+        else:
+            await self._stream_spool(path, content)
+        return Job(filename, path)
+
+    def _write_spool(self, path, content):
+        with open(path, "wb") as f:
+            f.write(content)
+
+    async def _stream_spool(self, path, upload):
+        f = await asyncio.to_thread(open, path, "wb")
+        try:
+            while True:
+                piece = await upload.read(SPOOL_CHUNK_BYTES)
+                if not piece:
+                    break
+                await asyncio.to_thread(f.write, piece)
+        except BaseException:
+            f.close()
+            self._remove_spool(path)
+            raise
+        f.close()
+
+    def _remove_spool(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond max_finished_jobs"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ("completed", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
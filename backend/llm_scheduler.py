@@ -0,0 +1,428 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import threading
+import types
+import contextvars
+from contextlib import contextmanager
+from collections import deque
+import openai
+from dotenv import load_dotenv
+from embedding_service import estimate_tokens
+from metrics import current_metrics, record_usage
+
+load_dotenv()
+
+# Lower runs first: interactive /query calls overtake queued ingestion calls
+PRIORITY_INTERACTIVE = 0
+PRIORITY_INGESTION = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_INGESTION: "ingestion"}
+
+# Requests and tokens per minute per model, as "model=rpm:tpm,model=rpm:tpm" (set them to the account's quota).
+# Unset, calls are not throttled; 429s are still retried and pause the model's queue.
+RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "")
+# Limits of models not listed in LLM_RATE_LIMITS; unset means unlimited
+DEFAULT_RPM = int(os.getenv("LLM_DEFAULT_RPM")) if os.getenv("LLM_DEFAULT_RPM") else None
+DEFAULT_TPM = int(os.getenv("LLM_DEFAULT_TPM")) if os.getenv("LLM_DEFAULT_TPM") else None
+# 429s, 5xx and connection errors are retried this many times with jittered exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+# Completion tokens assumed when a call sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+# Vision inputs are counted as this many tokens per image
+IMAGE_TOKENS = 1000
+# Recent wait times kept per priority for the percentiles in stats()
+WAIT_SAMPLES = 1000
+
+priority_var = contextvars.ContextVar("llm_priority", default=PRIORITY_INGESTION)
+
+
+def set_priority(priority):
+    """Run the LLM calls of the current request (and the tasks it starts) at this priority"""
+    priority_var.set(priority)
+
+
+@contextmanager
+def llm_priority(priority):
+    """Run the LLM calls made inside the block at this priority"""
+    token = priority_var.set(priority)
+    try:
+        yield
+    finally:
+        priority_var.reset(token)
+
+
+def parse_rate_limits(spec):
+    limits = {}
+    for entry in (spec or "").split(","):
+        if "=" not in entry:
+            continue
+        model, values = entry.split("=", 1)
+        rpm, tpm = values.split(":")
+        limits[model.strip()] = (int(rpm), int(tpm))
+    return limits
+
+
+def estimate_request_tokens(kwargs):
+    """Tokens a chat or embeddings request will count against TPM: its input plus max_tokens"""
+    if "input" in kwargs:
+        texts = kwargs["input"] if isinstance(kwargs["input"], list) else [kwargs["input"]]
+        return sum(estimate_tokens(text) for text in texts)
+    tokens = kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    for message in kwargs.get("messages", []):
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+        else:
+            for part in content:
+                tokens += estimate_tokens(part.get("text", "")) if part.get("type") == "text" else IMAGE_TOKENS
+    return tokens
+
+
+class TokenBucket:
+    """Refills per_minute units evenly over a minute, holding at most per_minute (None: unlimited)"""
+
+    def __init__(self, per_minute):
+        self.unlimited = per_minute is None
+        self.capacity = float("inf") if self.unlimited else per_minute
+        self.level = float(self.capacity)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.unlimited:
+            return
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount units are available (after refill)"""
+        amount = min(amount, self.capacity)  # a request larger than the bucket waits for a full one
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class ModelLimiter:
+    """Request and token buckets of one model, and its queue of waiting calls"""
+
+    def __init__(self, model, rpm, tpm):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.waiters = []  # heap of [priority, seq, tokens, enqueued_at, notify, state]
+        self.paused_until = 0.0
+        self.timer = None
+
+
+class LLMScheduler:
+    """Central gate for OpenAI calls: per-model RPM/TPM token buckets, priorities and retries.
+
+    Each call waits in its model's priority queue until both buckets can cover it, so bursts of
+    ingestion calls are spread out instead of tripping 429s, and an interactive call queued behind
+    them is granted first. Calls that still fail with a 429, a 5xx or a connection error are retried
+    with jittered exponential backoff (honouring Retry-After); a 429 also pauses the model's queue.
+    Both async and blocking calls are supported, so it can be shared by threads and the event loop.
+    """
+
+    def __init__(self, rate_limits=None, default_rpm=DEFAULT_RPM, default_tpm=DEFAULT_TPM,
+                 max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE_SECONDS,
+                 backoff_max=LLM_BACKOFF_MAX_SECONDS):
+        if rate_limits is None:
+            rate_limits = parse_rate_limits(RATE_LIMITS)
+        self.rate_limits = rate_limits
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self._limiters = {}
+        self._waits = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITY_NAMES}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    async def call_async(self, model, func, **kwargs):
+        """Await func(model=model, **kwargs) once the model's limits allow, retrying transient failures"""
+        tokens = estimate_request_tokens(kwargs)
+        kwargs = self._with_stream_usage(kwargs)
+        priority = priority_var.get()
+        for attempt in range(self.max_retries + 1):
+            loop = asyncio.get_running_loop()
+            granted = loop.create_future()
+
+            def notify(future=granted):
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+            state = self._enqueue(model, tokens, priority, notify)
+            try:
+                await granted
+            except asyncio.CancelledError:
+                self._cancel(model, state)
+                raise
+            started = time.perf_counter()
+            try:
+                response = await func(model=model, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt)
+                self._observe(model, started, "error" if delay is None else "retried")
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._observe(model, started, "ok")
+            return self._settled(model, tokens, kwargs, response)
+
+    def call(self, model, func, **kwargs):
+        """Blocking version of call_async, for synchronous clients"""
+        tokens = estimate_request_tokens(kwargs)
+        kwargs = self._with_stream_usage(kwargs)
+        priority = priority_var.get()
+        for attempt in range(self.max_retries + 1):
+            granted = threading.Event()
+            self._enqueue(model, tokens, priority, granted.set)
+            granted.wait()
+            started = time.perf_counter()
+            try:
+                response = func(model=model, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt)
+                self._observe(model, started, "error" if delay is None else "retried")
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._observe(model, started, "ok")
+            return self._settled(model, tokens, kwargs, response)
+
+    def stats(self):
+        """Queue depth per model and priority, wait times per priority, and call/retry/429 counters"""
+        with self._lock:
+            queue_depth = {}
+            for model, limiter in self._limiters.items():
+                depth = {name: 0 for name in PRIORITY_NAMES.values()}
+                for waiter in limiter.waiters:
+                    if waiter[5]["state"] == "waiting":
+                        depth[PRIORITY_NAMES[waiter[0]]] += 1
+                queue_depth[model] = depth
+            wait_seconds = {}
+            for priority, samples in self._waits.items():
+                ordered = sorted(samples)
+                wait_seconds[PRIORITY_NAMES[priority]] = {
+                    "count": len(ordered),
+                    "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+                    "p95": ordered[int(0.95 * (len(ordered) - 1))] if ordered else 0.0,
+                    "max": ordered[-1] if ordered else 0.0
+                }
+            return {
+                "queue_depth": queue_depth,
+                "wait_seconds": wait_seconds,
+                "calls": self.calls,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited
+            }
+
+    def _limiter(self, model):
+        """The model's limiter (lock must be held)"""
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            rpm, tpm = self.rate_limits.get(model, (self.default_rpm, self.default_tpm))
+            limiter = self._limiters[model] = ModelLimiter(model, rpm, tpm)
+        return limiter
+
+    def _enqueue(self, model, tokens, priority, notify):
+        state = {"state": "waiting"}
+        with self._lock:
+            limiter = self._limiter(model)
+            heapq.heappush(limiter.waiters, [priority, next(self._seq), tokens, time.monotonic(), notify, state])
+            self._dispatch(limiter)
+        return state
+
+    def _cancel(self, model, state):
+        with self._lock:
+            if state["state"] == "waiting":
+                state["state"] = "cancelled"
+            limiter = self._limiter(model)
+            self._dispatch(limiter)
+
+    def _dispatch(self, limiter):
+        """Grant queued calls in priority order while the buckets cover them (lock must be held)"""
+        now = time.monotonic()
+        limiter.requests.refill(now)
+        limiter.tokens.refill(now)
+        while limiter.waiters:
+            priority, _, tokens, enqueued_at, notify, state = limiter.waiters[0]
+            if state["state"] != "waiting":
+                heapq.heappop(limiter.waiters)
+                continue
+            delay = max(limiter.paused_until - now, limiter.requests.wait_time(1), limiter.tokens.wait_time(tokens))
+            if delay > 0:
+                self._schedule(limiter, delay)
+                return
+            heapq.heappop(limiter.waiters)
+            limiter.requests.level -= 1
+            limiter.tokens.level -= min(tokens, limiter.tokens.capacity)
+            state["state"] = "granted"
+            self.calls += 1
+            self._waits[priority].append(now - enqueued_at)
+            current_metrics().llm_queue_seconds.observe(now - enqueued_at, priority=PRIORITY_NAMES[priority])
+            notify()
+
+    def _schedule(self, limiter, delay):
+        """Dispatch the limiter again once its head of queue can be granted (lock must be held)"""
+        if limiter.timer is not None:
+            limiter.timer.cancel()
+        limiter.timer = threading.Timer(delay, self._wake, args=(limiter,))
+        limiter.timer.daemon = True
+        limiter.timer.start()
+
+    def _wake(self, limiter):
+        with self._lock:
+            limiter.timer = None
+            self._dispatch(limiter)
+
+    def _observe(self, model, started, outcome):
+        metrics = current_metrics()
+        metrics.llm_request_seconds.observe(time.perf_counter() - started, model=model)
+        metrics.llm_requests.inc(model=model, outcome=outcome)
+
+    def _with_stream_usage(self, kwargs):
+        """Ask streamed completions for a final usage chunk, so their tokens can be settled too"""
+        if not kwargs.get("stream"):
+            return kwargs
+        return dict(kwargs, stream_options=dict(kwargs.get("stream_options") or {}, include_usage=True))
+
+    def _settled(self, model, estimated, kwargs, response):
+        """Settle the call's tokens now, or for a stream once its usage chunk (or its end) comes through"""
+        if not kwargs.get("stream"):
+            usage = getattr(response, "usage", None)
+            record_usage(model, usage)
+            self._correct(model, estimated, getattr(usage, "total_tokens", None))
+            return response
+        prompt_tokens = estimated - (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+        return SettlingStream(response, model, estimated, prompt_tokens, self)
+
+    def _correct(self, model, estimated, total):
+        """Correct the model's token bucket by the difference between the estimate and the actual total"""
+        if not isinstance(total, int):
+            return
+        with self._lock:
+            limiter = self._limiter(model)
+            limiter.tokens.level -= total - min(estimated, limiter.tokens.capacity)
+            self._dispatch(limiter)
+
+    def _retry_delay(self, model, error, attempt):
+        """Backoff before retrying a failed call, or None if it should not be retried"""
+        if isinstance(error, openai.APIStatusError):
+            retryable = error.status_code == 429 or error.status_code >= 500
+        else:
+            retryable = isinstance(error, openai.APIConnectionError)
+        if not retryable or attempt >= self.max_retries:
+            return None
+        delay = random.uniform(0.5, 1.0) * min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        retry_after = None
+        if isinstance(error, openai.APIStatusError):
+            try:
+                retry_after = float(error.response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        with self._lock:
+            self.retries += 1
+            if isinstance(error, openai.APIStatusError) and error.status_code == 429:
+                # Hold back the rest of the model's queue too, instead of letting it hit the same limit
+                self.rate_limited += 1
+                limiter = self._limiter(model)
+                limiter.paused_until = max(limiter.paused_until, time.monotonic() + delay)
+        logging.warning(f"{model} call failed ({error.__class__.__name__}), retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+
+class SettlingStream:
+    """A streamed completion passed through to the caller, settling the scheduler's token estimate.
+
+    The usage chunk requested with stream_options is counted and settles the call; a stream that ends
+    without one is settled from the output tokens counted along the way.
+    """
+
+    def __init__(self, stream, model, estimated, prompt_tokens, scheduler):
+        self._stream = stream
+        self._model = model
+        self._estimated = estimated
+        self._prompt_tokens = prompt_tokens
+        self._scheduler = scheduler
+        self._output_tokens = 0
+        self._settled = False
+
+    def __iter__(self):
+        for event in self._stream:
+            self._observe(event)
+            yield event
+        self._finish()
+
+    async def __aiter__(self):
+        async for event in self._stream:
+            self._observe(event)
+            yield event
+        self._finish()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def _observe(self, event):
+        usage = getattr(event, "usage", None)
+        if usage and not self._settled:
+            self._settled = True
+            record_usage(self._model, usage)
+            self._scheduler._correct(self._model, self._estimated, getattr(usage, "total_tokens", None))
+        for choice in getattr(event, "choices", None) or []:
+            content = getattr(choice.delta, "content", None)
+            if content:
+                self._output_tokens += estimate_tokens(content)
+
+    def _finish(self):
+        if not self._settled:
+            self._settled = True
+            self._scheduler._correct(self._model, self._estimated, self._prompt_tokens + self._output_tokens)
+
+
+class _Endpoint:
+    """client.chat.completions or client.embeddings, with create() going through the scheduler"""
+
+    def __init__(self, endpoint, scheduler, is_async):
+        self._endpoint = endpoint
+        self._scheduler = scheduler
+        self._is_async = is_async
+
+    def create(self, model, **kwargs):
+        if self._is_async:
+            return self._scheduler.call_async(model, self._endpoint.create, **kwargs)
+        return self._scheduler.call(model, self._endpoint.create, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._endpoint, name)
+
+
+class ScheduledClient:
+    """Wraps an OpenAI or AsyncOpenAI client so chat completions and embeddings go through an LLMScheduler"""
+
+    def __init__(self, client, scheduler=None, is_async=None):
+        self._client = client
+        self.scheduler = scheduler or llm_scheduler
+        if is_async is None:
+            is_async = isinstance(client, openai.AsyncOpenAI)
+        self.chat = types.SimpleNamespace(completions=_Endpoint(client.chat.completions, self.scheduler, is_async))
+        self.embeddings = _Endpoint(client.embeddings, self.scheduler, is_async)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+# The process-wide scheduler shared by every OpenAI client
+llm_scheduler = LLMScheduler()
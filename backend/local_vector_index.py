@@ -0,0 +1,265 @@
+import os
+import json
+import zlib
+import logging
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from metrics import traced
+
+load_dotenv()
+
+DEFAULT_DIMENSION = 1536  # for OpenAI embeddings
+DEFAULT_SNAPSHOT_PATH = os.getenv("LOCAL_INDEX_PATH", "local_index")
+DEFAULT_AUTOSAVE = os.getenv("LOCAL_INDEX_AUTOSAVE", "true").lower() == "true"
+# A snapshot rewrites the whole index, so autosave waits for this many writes...
+DEFAULT_SAVE_EVERY = int(os.getenv("LOCAL_INDEX_SAVE_EVERY", "100"))
+# ...or this many seconds after the first unsaved write, whichever comes first
+DEFAULT_SAVE_SECONDS = float(os.getenv("LOCAL_INDEX_SAVE_SECONDS", "60"))
+
+
+class LocalVectorIndex:
+    """In-process vector index with the same interface as PineconeService.
+
+    Vectors live in one contiguous, L2-normalized float32 matrix so a query is a single
+    matrix-vector product followed by a partial sort. Tags are kept in a boolean row x tag
+    matrix so the `tags $in [...]` filter is vectorized too. Snapshots are written to
+    <snapshot_path>.npy (vectors) and <snapshot_path>.json (ids and metadata) by autosave
+    (after save_every writes or save_seconds, see _written) and by flush() at shutdown. The
+    index is copied under the lock and written outside it, so queries and upserts keep running
+    during a save; the .json records the row count and a checksum of the .npy so load() never
+    pairs ids with the rows of another snapshot.
+    """
+
+    def __init__(self, dimension=DEFAULT_DIMENSION, snapshot_path=DEFAULT_SNAPSHOT_PATH, autosave=DEFAULT_AUTOSAVE,
+                 save_every=DEFAULT_SAVE_EVERY, save_seconds=DEFAULT_SAVE_SECONDS):
+        self.dimension = dimension
+        self.snapshot_path = snapshot_path
+        self.autosave = autosave
+        self.save_every = save_every
+        self.save_seconds = save_seconds
+        self._unsaved_writes = 0
+        self._save_timer = None
+        self._lock = threading.RLock()
+        # Serializes snapshot writes, so a slower earlier save cannot overwrite a newer one
+        self._save_lock = threading.Lock()
+        self._vectors = np.zeros((1024, dimension), dtype=np.float32)
+        self._tag_matrix = np.zeros((1024, 16), dtype=bool)
+        self._size = 0
+        self._ids = []
+        self._metadata = []
+        self._id_to_row = {}
+        self._tag_to_column = {}
+        if snapshot_path and os.path.exists(f"{snapshot_path}.npy"):
+            self.load()
+
+    @traced("upsert")
+    def upsert_chunks(self, filename, chunks):
+        """Store chunks with their associated tags, replacing existing chunks with the same id"""
+        with self._lock:
+            stored = 0
+            for i, chunk in enumerate(chunks):
+                embedding = chunk.get('embedding', None)
+                # Only add vector if we have an embedding
+                if embedding is None or len(embedding) == 0:
+                    continue
+                chunk_id = chunk.get('chunk_id', f"{filename}-chunk-{i}")
+                metadata = {
+                    "filename": chunk.get('filename', filename),
+                    "chunkText": chunk.get('text', ''),
+                    "chunkIndex": chunk.get('chunk_index', i),
+                    "chunkId": chunk_id,
+                    "tags": chunk.get('tags', [])
+                }
+                self._put(chunk_id, embedding, metadata)
+                stored += 1
+            save_due = stored > 0 and self._written()
+        if save_due:
+            self.save()
+        return stored > 0
+
+    @traced("vector_delete")
+    def delete_chunks(self, chunk_ids):
+        """Remove chunks by id, keeping the matrix contiguous"""
+        with self._lock:
+            deleted = 0
+            for chunk_id in chunk_ids:
+                row = self._id_to_row.pop(chunk_id, None)
+                if row is None:
+                    continue
+                deleted += 1
+                last = self._size - 1
+                if row != last:
+                    # Move the last row into the hole
+                    self._vectors[row] = self._vectors[last]
+                    self._tag_matrix[row] = self._tag_matrix[last]
+                    self._ids[row] = self._ids[last]
+                    self._metadata[row] = self._metadata[last]
+                    self._id_to_row[self._ids[row]] = row
+                self._tag_matrix[last] = False
+                self._ids.pop()
+                self._metadata.pop()
+                self._size -= 1
+            save_due = deleted > 0 and self._written()
+        if save_due:
+            self.save()
+
+    @traced("vector_query")
+    def query(self, query_embedding, top_k=20, filter_categories=None):
+        """Return the top_k most similar chunks, optionally only those tagged with one of filter_categories"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            if self._size == 0:
+                return []
+            # One contiguous matrix-vector product; filtering only selects from the scores,
+            # which is cheaper than gathering the matching rows first
+            scores = self._vectors[:self._size] @ query
+            rows = None
+            if filter_categories:
+                columns = [self._tag_to_column[tag] for tag in filter_categories if tag in self._tag_to_column]
+                if not columns:
+                    return []
+                rows = np.flatnonzero(self._tag_matrix[:self._size, columns].any(axis=1))
+                if rows.size == 0:
+                    return []
+                scores = scores[rows]
+
+            k = min(top_k, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            matches = []
+            for position in top:
+                row = int(rows[position]) if rows is not None else int(position)
+                matches.append({
+                    "id": self._ids[row],
+                    "score": float(scores[position]),
+                    "metadata": self._metadata[row]
+                })
+            return matches
+
+    def save(self):
+        """Write a snapshot of the index to disk"""
+        with self._save_lock:
+            with self._lock:
+                self._unsaved_writes = 0
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self.snapshot_path:
+                    return
+                # Copy under the lock; serializing and writing happen without it
+                vectors = self._vectors[:self._size].copy()
+                ids = list(self._ids)
+                metadata = list(self._metadata)
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Write to temporary files first so a crash never leaves a half-written snapshot
+            with open(f"{self.snapshot_path}.npy.tmp", "wb") as f:
+                np.save(f, vectors)
+            with open(f"{self.snapshot_path}.json.tmp", "w") as f:
+                json.dump({"dimension": self.dimension, "rows": len(ids), "checksum": zlib.crc32(vectors.tobytes()),
+                           "ids": ids, "metadata": metadata}, f)
+            os.replace(f"{self.snapshot_path}.npy.tmp", f"{self.snapshot_path}.npy")
+            os.replace(f"{self.snapshot_path}.json.tmp", f"{self.snapshot_path}.json")
+
+    def flush(self):
+        """Save the snapshot if there are writes since the last one (called at shutdown and by the autosave timer)"""
+        with self._lock:
+            save_due = self._unsaved_writes > 0
+        if save_due:
+            self.save()
+
+    def load(self):
+        """Load the snapshot from disk, replacing the in-memory index.
+
+        Returns False, leaving the index as it is, if the .npy and .json are missing or come from
+        different saves (a crash between the two renames); the index is then rebuilt by re-ingesting.
+        """
+        try:
+            vectors = np.load(f"{self.snapshot_path}.npy")
+            with open(f"{self.snapshot_path}.json") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read local vector index snapshot {self.snapshot_path}: {e}")
+            return False
+        rows = vectors.shape[0]
+        if (data.get("rows") != rows or len(data["ids"]) != rows or len(data["metadata"]) != rows
+                or data.get("checksum") != zlib.crc32(vectors.tobytes())):
+            logging.error(f"Local vector index snapshot {self.snapshot_path} has vectors and ids from different "
+                          f"saves; ignoring it, re-ingest documents to rebuild the index")
+            return False
+        with self._lock:
+            self.dimension = data["dimension"]
+            self._vectors = np.zeros((max(1024, rows), self.dimension), dtype=np.float32)
+            self._vectors[:rows] = vectors
+            self._tag_matrix = np.zeros((self._vectors.shape[0], 16), dtype=bool)
+            self._tag_to_column = {}
+            self._size = rows
+            self._ids = data["ids"]
+            self._metadata = data["metadata"]
+            self._id_to_row = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+            for row, metadata in enumerate(self._metadata):
+                self._set_tags(row, metadata.get("tags", []))
+            logging.info(f"Loaded local vector index with {self._size} vectors")
+        return True
+
+    def __len__(self):
+        return self._size
+
+    def _written(self):
+        """Count a write call; True once save_every of them are unsaved, else a save is scheduled
+        save_seconds after the first (lock must be held; the caller saves after releasing it)"""
+        self._unsaved_writes += 1
+        if not self.autosave:
+            return False
+        if self._unsaved_writes >= self.save_every:
+            return True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_seconds, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+        return False
+
+    def _put(self, chunk_id, embedding, metadata):
+        """Insert or replace one vector (lock must be held)"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        row = self._id_to_row.get(chunk_id)
+        if row is None:
+            row = self._size
+            self._ensure_capacity(row + 1)
+            self._ids.append(chunk_id)
+            self._metadata.append(metadata)
+            self._id_to_row[chunk_id] = row
+            self._size += 1
+        else:
+            self._metadata[row] = metadata
+            self._tag_matrix[row] = False
+        self._vectors[row] = vector
+        self._set_tags(row, metadata["tags"])
+
+    def _set_tags(self, row, tags):
+        for tag in tags:
+            column = self._tag_to_column.get(tag)
+            if column is None:
+                column = len(self._tag_to_column)
+                self._tag_to_column[tag] = column
+                if column >= self._tag_matrix.shape[1]:
+                    extra = np.zeros((self._tag_matrix.shape[0], self._tag_matrix.shape[1]), dtype=bool)
+                    self._tag_matrix = np.hstack([self._tag_matrix, extra])
+            self._tag_matrix[row, column] = True
+
+    def _ensure_capacity(self, rows):
+        """Grow the vector and tag matrices geometrically"""
+        capacity = self._vectors.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, capacity * 2)
+        vectors = np.zeros((new_capacity, self.dimension), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+        tag_matrix = np.zeros((new_capacity, self._tag_matrix.shape[1]), dtype=bool)
+        tag_matrix[:self._size] = self._tag_matrix[:self._size]
+        self._tag_matrix = tag_matrix
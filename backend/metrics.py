@@ -0,0 +1,230 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Return each request's per-stage timings in a Server-Timing response header
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "false").lower() == "true"
+
+# Per-request {stage: [total seconds, calls]}, shared with the tasks the request starts
+request_timings_var = contextvars.ContextVar("request_timings", default=None)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}  # key -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = _format_labels(dict(labels, le=_format_value(float(bound))))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics rendered on /metrics: registered counters and histograms, plus collectors read at scrape time.
+
+    A collector returns [(name, type, help, [(labels dict, value), ...]), ...], for values that live
+    elsewhere (cache stats, queue depths) and are only read when scraped.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class PipelineMetrics:
+    """The stage, HTTP and OpenAI metrics the pipeline records, registered on one MetricsRegistry"""
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        self.stage_seconds = self.registry.histogram("pipeline_stage_seconds", "Latency of each pipeline stage",
+                                                     ["stage"])
+        self.stage_errors = self.registry.counter("pipeline_stage_errors_total", "Pipeline stage calls that raised",
+                                                  ["stage"])
+        self.request_seconds = self.registry.histogram("http_request_seconds", "Latency of HTTP requests",
+                                                       ["method", "route", "status"])
+        self.llm_request_seconds = self.registry.histogram(
+            "llm_request_seconds", "Latency of OpenAI calls, excluding scheduler queueing", ["model"])
+        self.llm_requests = self.registry.counter("llm_requests_total", "OpenAI calls by outcome", ["model", "outcome"])
+        self.llm_tokens = self.registry.counter("llm_tokens_total", "Tokens reported in the usage of OpenAI responses",
+                                                ["model", "kind"])
+        self.llm_queue_seconds = self.registry.histogram(
+            "llm_queue_wait_seconds", "Time OpenAI calls waited in the scheduler queue", ["priority"])
+
+
+default_metrics = PipelineMetrics()
+# Served on /metrics
+registry = default_metrics.registry
+# The PipelineMetrics spans and the LLM scheduler record to; tests set their own
+metrics_var = contextvars.ContextVar("metrics", default=default_metrics)
+
+
+def current_metrics():
+    """The PipelineMetrics of the current context (default_metrics unless a test set its own)"""
+    return metrics_var.get()
+
+
+def record_usage(model, usage):
+    """Count the prompt and completion tokens of an OpenAI response's usage"""
+    for kind in ("prompt", "completion"):
+        count = getattr(usage, f"{kind}_tokens", None)
+        if isinstance(count, int):
+            current_metrics().llm_tokens.inc(count, model=model, kind=kind)
+
+
+def start_request_timings():
+    """Begin collecting the current request's stage timings; returns the dict spans add to"""
+    timings = {}
+    request_timings_var.set(timings)
+    return timings
+
+
+def server_timing(timings):
+    """Server-Timing header value: total milliseconds per stage, with the call count when above one"""
+    entries = []
+    for stage, (seconds, calls) in timings.items():
+        entry = f"{stage};dur={seconds * 1000:.1f}"
+        if calls > 1:
+            entry += f';desc="{calls} calls"'
+        entries.append(entry)
+    return ", ".join(entries)
+
+
+@contextmanager
+def span(stage):
+    """Time a block as one call of a pipeline stage"""
+    metrics = current_metrics()
+    start = time.perf_counter()
+    try:
+        yield
+    except (GeneratorExit, asyncio.CancelledError):
+        # A client that went away or a cancelled task is not a failure of the stage
+        raise
+    except BaseException:
+        metrics.stage_errors.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.stage_seconds.observe(elapsed, stage=stage)
+        timings = request_timings_var.get()
+        if timings is not None:
+            entry = timings.setdefault(stage, [0.0, 0])
+            entry[0] += elapsed
+            entry[1] += 1
+
+
+def traced(stage):
+    """Decorator: run each call of the (sync or async) function inside span(stage)"""
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -1,121 +1,41 @@
 import os
 import json
 import base64
+import asyncio
+import hashlib
+import logging
 from datetime import datetime
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
+from llm_scheduler import ScheduledClient
+from metrics import traced
 
 load_dotenv()
 
-class OpenAIService:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
-    def process_document(self, content, filename, filetype='text'):
-        """Process document - treat each page/document as a single chunk with up to 5 ranked tags"""
-        # Define the valid competencies for strict validation
-        valid_competencies = [
-            "Results", "Execution", "Fearless Presenter", "Seize Opportunities",
-            "Connection", "Leadership", "Collaboration", "Awareness",
-            "Planning", "Constructive Thinking", "Organize", "Control",
-            "Authenticity", "CEO Perspective", "Vision", "Growth Mindset"
-        ]
-        
-        if filetype == 'image':
-            # Encode image to base64
-            base64_image = base64.b64encode(content).decode('utf-8')
-            # Prepare the API request for GPT-4o with updated prompt for strict tagging
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": """Analyze this educational image and classify it. 
+# Maximum number of pages/sections sent to OpenAI at the same time during ingestion
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+# Model for the per-page summary+tags call; it must support JSON mode
+INGESTION_MODEL = os.getenv("INGESTION_MODEL", "gpt-4o")
 
-Return a JSON object with:
-1. "text": All visible text from the image
-2. "summary": A brief description of the image content (2-3 sentences)
-3. "tags": An array of EXACTLY the most relevant competencies from this list (maximum 5, ranked by relevance):
-   - Results
-   - Execution
-   - Fearless Presenter
-   - Seize Opportunities
-   - Connection
-   - Leadership
-   - Collaboration
-   - Awareness
-   - Planning
-   - Constructive Thinking
-   - Organize
-   - Control
-   - Authenticity
-   - CEO Perspective
-   - Vision
-   - Growth Mindset
+# The valid competencies used for strict tag validation
+VALID_COMPETENCIES = [
+    "Results", "Execution", "Fearless Presenter", "Seize Opportunities",
+    "Connection", "Leadership", "Collaboration", "Awareness",
+    "Planning", "Constructive Thinking", "Organize", "Control",
+    "Authenticity", "CEO Perspective", "Vision", "Growth Mindset"
+]
 
-IMPORTANT: The tags must be exactly as written above - no variations. List them in order of relevance with the most relevant first.
-Respond ONLY with a valid JSON object."""},
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                        }
-                    ]
-                }
-            ]
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=1000
-            )
-            # Try to extract JSON from the response
-            content = response.choices[0].message.content
-            try:
-                json_start = content.find('{')
-                json_end = content.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = content[json_start:json_end]
-                    result = json.loads(json_str)
-                    
-                    # Create a single chunk with tags
-                    chunk = {
-                        "text": result.get("text", ""),
-                        "summary": result.get("summary", ""),
-                        "context": "",
-                        "chunk_id": f"{filename}_image",
-                        "tags": self._validate_tags(result.get("tags", []), valid_competencies)
-                    }
-                    
-                    return [chunk], {}  # Return as a list with a single chunk
-                else:
-                    return [], {}
-            except Exception as e:
-                print(f"Error processing image: {str(e)}")
-                return [], {}
-                
-        elif isinstance(content, list):  # PDF: list of page texts
-            all_processed_chunks = []
-            
-            for i, page_text in enumerate(content):
-                if not page_text.strip():
-                    continue
-                
-                # Treat each page as a single chunk - no sub-chunking
-                # Create a summary for the page
-                summary_response = self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "You are an expert at summarizing educational content."},
-                        {"role": "user", "content": f"Provide a brief 2-3 sentence summary of this page from an educational document:\n\n{page_text[:5000]}... (truncated if longer)"}
-                    ],
-                    max_tokens=200
-                )
-                
-                page_summary = summary_response.choices[0].message.content.strip()
-                
-                # Tag the entire page with strict tags
-                tag_response = self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": """You are a document tagging expert specializing in entrepreneurship education.
+# The four core values and the competencies under each
+CORE_VALUES = {
+    "ACTION": ["Results", "Execution", "Fearless Presenter", "Seize Opportunities"],
+    "RELATIONSHIPS": ["Connection", "Leadership", "Collaboration", "Awareness"],
+    "DISCIPLINE": ["Planning", "Constructive Thinking", "Organize", "Control"],
+    "PURPOSE": ["Authenticity", "CEO Perspective", "Vision", "Growth Mindset"]
+}
+
+SUMMARY_SYSTEM_PROMPT = "You are an expert at summarizing educational content."
+
+TAGGING_SYSTEM_PROMPT = """You are a document tagging expert specializing in entrepreneurship education.
 
 STRICTLY classify this educational content using the EXACT competencies from this list:
 
@@ -153,183 +73,294 @@ INSTRUCTIONS:
 Example correct response:
 ["Vision", "Leadership", "Planning", "Authenticity"]
 
-Respond ONLY with a valid JSON array of competencies."""},
-                        {"role": "user", "content": f"Document content to tag: {page_text[:7000]}... (truncated if longer)"}
-                    ]
-                )
-                
-                page_tags = self._parse_tags(tag_response.choices[0].message.content)
-                page_tags = self._validate_tags(page_tags, valid_competencies)
-                
-                # Create a single chunk for this page
-                chunk = {
-                    "text": page_text,
-                    "summary": page_summary,
-                    "context": f"Page {i+1} of document",
-                    "chunk_id": f"{filename}_page{i+1}",
-                    "tags": page_tags
-                }
-                
-                all_processed_chunks.append(chunk)
-                    
-            return all_processed_chunks, {}  # Return empty dict for backwards compatibility
-            
-        else:
-            # Text-based processing - keep as whole document or split by natural sections if very large
-            if len(content) > 10000:
-                # If document is large, process in sections
-                sections = self._split_into_sections(content)
-                processed_chunks = []
-                
-                for i, section in enumerate(sections):
-                    # Create summary for section
-                    summary_response = self.client.chat.completions.create(
-                        model="gpt-4",
-                        messages=[
-                            {"role": "system", "content": "You are an expert at summarizing educational content."},
-                            {"role": "user", "content": f"Provide a brief 2-3 sentence summary of this section from an educational document:\n\n{section[:5000]}... (truncated if longer)"}
-                        ],
-                        max_tokens=200
-                    )
-                    
-                    section_summary = summary_response.choices[0].message.content.strip()
-                    
-                    # Tag the section with strict tags
-                    tag_response = self.client.chat.completions.create(
-                        model="gpt-4",
-                        messages=[
-                            {"role": "system", "content": """You are a document tagging expert specializing in entrepreneurship education.
+Respond ONLY with a valid JSON array of competencies."""
 
-STRICTLY classify this educational content using the EXACT competencies from this list:
+PAGE_ANALYSIS_PROMPT = """You are an expert at summarizing and tagging educational content in entrepreneurship education.
 
-ACTION category:
-- Results
-- Execution
-- Fearless Presenter
-- Seize Opportunities
+Return a JSON object with:
+1. "summary": A brief 2-3 sentence summary of the content
+2. "tags": An array of the competencies this content addresses, using the EXACT names from this list:
+   - Results
+   - Execution
+   - Fearless Presenter
+   - Seize Opportunities
+   - Connection
+   - Leadership
+   - Collaboration
+   - Awareness
+   - Planning
+   - Constructive Thinking
+   - Organize
+   - Control
+   - Authenticity
+   - CEO Perspective
+   - Vision
+   - Growth Mindset
 
-RELATIONSHIPS category:
-- Connection
-- Leadership
-- Collaboration
-- Awareness
+Tag rules: a MAXIMUM of 5 competencies, no variations of the names, most relevant first, and only competencies that are substantially addressed in the content.
 
-DISCIPLINE category:
-- Planning
-- Constructive Thinking
-- Organize
-- Control
+Example correct response:
+{"summary": "This section explains how founders turn a long-term vision into a weekly plan.", "tags": ["Vision", "Planning"]}
 
-PURPOSE category:
-- Authenticity
-- CEO Perspective
-- Vision
-- Growth Mindset
+Respond ONLY with a valid JSON object."""
 
-INSTRUCTIONS:
-1. Return a JSON array with a MAXIMUM of 5 competencies that this content addresses
-2. Only use the EXACT competency names listed above - no variations whatsoever
-3. List them in order of relevance (most relevant first)
-4. Only include competencies that are substantially addressed in the content
-5. If fewer than 5 competencies are relevant, include fewer - quality over quantity
+IMAGE_TAGGING_PROMPT = """Analyze this educational image and classify it. 
 
-Example correct response:
-["Vision", "Leadership", "Planning", "Authenticity"]
+Return a JSON object with:
+1. "text": All visible text from the image
+2. "summary": A brief description of the image content (2-3 sentences)
+3. "tags": An array of EXACTLY the most relevant competencies from this list (maximum 5, ranked by relevance):
+   - Results
+   - Execution
+   - Fearless Presenter
+   - Seize Opportunities
+   - Connection
+   - Leadership
+   - Collaboration
+   - Awareness
+   - Planning
+   - Constructive Thinking
+   - Organize
+   - Control
+   - Authenticity
+   - CEO Perspective
+   - Vision
+   - Growth Mindset
 
-Respond ONLY with a valid JSON array of competencies."""},
-                            {"role": "user", "content": f"Document content to tag: {section[:7000]}... (truncated if longer)"}
-                        ]
-                    )
-                    
-                    section_tags = self._parse_tags(tag_response.choices[0].message.content)
-                    section_tags = self._validate_tags(section_tags, valid_competencies)
-                    
-                    # Create a chunk for this section
-                    chunk = {
-                        "text": section,
-                        "summary": section_summary,
-                        "context": f"Section {i+1} of document",
-                        "chunk_id": f"{filename}_section{i+1}",
-                        "tags": section_tags
-                    }
-                    
-                    processed_chunks.append(chunk)
-            else:
-                # For smaller documents, process as a single chunk
-                # Create summary
-                summary_response = self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "You are an expert at summarizing educational content."},
-                        {"role": "user", "content": f"Provide a brief 2-3 sentence summary of this educational document:\n\n{content[:5000]}... (truncated if longer)"}
-                    ],
-                    max_tokens=200
-                )
-                
-                summary = summary_response.choices[0].message.content.strip()
-                
-                # Tag the document with strict tags
-                tag_response = self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": """You are a document tagging expert specializing in entrepreneurship education.
+IMPORTANT: The tags must be exactly as written above - no variations. List them in order of relevance with the most relevant first.
+Respond ONLY with a valid JSON object."""
 
-STRICTLY classify this educational content using the EXACT competencies from this list:
+def content_hash(text):
+    """sha256 of a page/section text, used to detect unchanged pages on re-upload"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-ACTION category:
-- Results
-- Execution
-- Fearless Presenter
-- Seize Opportunities
+class OpenAIService:
+    def __init__(self, max_concurrency=None, http_pool=None, scheduler=None):
+        # With an HttpPool the clients reuse its connections instead of opening their own.
+        # Every call goes through the LLM scheduler, which also does the retrying.
+        self.client = ScheduledClient(OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, http_client=http_pool.client if http_pool else None
+        ), scheduler)
+        self.async_client = ScheduledClient(AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+            http_client=http_pool.async_client if http_pool else None
+        ), scheduler)
+        self.scheduler = self.client.scheduler
+        self.max_concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY
+    
+    def process_document(self, content, filename, filetype='text'):
+        """Blocking wrapper around process_document_async for callers outside an event loop"""
+        async def run():
+            # Use a short-lived client so its connections are bound to this event loop
+            async with AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0) as client:
+                return await self.process_document_async(content, filename, filetype=filetype,
+                                                         client=ScheduledClient(client, self.scheduler))
+        return asyncio.run(run())
+
+    async def process_document_async(self, content, filename, filetype='text', client=None, on_chunk=None,
+                                     previous_chunks=None, semaphore=None):
+        """Process document - treat each page/section as a single chunk with up to 5 ranked tags.
+
+        content may be a list of page texts, a string, or an async iterator of page texts that is
+        consumed as pages are parsed. Pages are processed concurrently (at most max_concurrency at
+        a time) and chunks are returned in page order, each with its chunk_index.
+        on_chunk, if given, is called with each chunk as soon as it is ready.
+        previous_chunks maps chunk_id -> chunk from an earlier ingestion of the same file; a page whose
+        content_hash matches any previous chunk reuses that chunk's summary, tags and embedding instead
+        of calling the LLM, even if pages were inserted or removed before it (it then gets the new chunk_id).
+        semaphore, if given, is shared with other documents processed at the same time.
+        A page whose tagging fails is kept without summary or tags instead of failing the document.
+        """
+        previous_chunks = previous_chunks or {}
+        # Chunk ids are positional, so a moved page is found by its content
+        previous_by_hash = {chunk["content_hash"]: chunk for chunk in previous_chunks.values() if chunk.get("content_hash")}
+        client = client or self.async_client
 
-RELATIONSHIPS category:
-- Connection
-- Leadership
-- Collaboration
-- Awareness
+        if filetype == 'image':
+            chunk = await self._process_image_async(client, content, filename)
+            return ([chunk] if chunk else []), {}  # Return as a list with a single chunk
 
-DISCIPLINE category:
-- Planning
-- Constructive Thinking
-- Organize
-- Control
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
 
-PURPOSE category:
-- Authenticity
-- CEO Perspective
-- Vision
-- Growth Mindset
+        async def run_unit(unit, chunk_index):
+            text, context, chunk_id, _ = unit
+            previous = previous_by_hash.get(content_hash(text))
+            if previous:
+                chunk = dict(previous, text=text, context=context, chunk_id=chunk_id)
+            else:
+                async with semaphore:
+                    try:
+                        chunk = await self._process_unit_async(client, *unit)
+                    except Exception as e:
+                        # Keep the page, searchable without tags, rather than failing the document; with no
+                        # content_hash it is tagged again on the next ingestion instead of being reused
+                        logging.error(f"Tagging {chunk_id} failed: {str(e)}")
+                        chunk = {"text": text, "summary": "", "context": context, "chunk_id": chunk_id,
+                                 "tags": [], "content_hash": None}
+            chunk["chunk_index"] = chunk_index
+            if on_chunk:
+                on_chunk(chunk)
+            return chunk
+
+        if hasattr(content, '__aiter__'):  # PDF: page texts streamed as they are parsed
+            return await self._process_page_stream(content, filename, run_unit), {}
+
+        # Each unit is (text, context, chunk_id, description used in the summary prompt)
+        if isinstance(content, list):  # PDF: list of page texts
+            # Treat each page as a single chunk - no sub-chunking
+            units = [
+                (page_text, f"Page {i+1} of document", f"{filename}_page{i+1}", "this page from an educational document")
+                for i, page_text in enumerate(content) if page_text.strip()
+            ]
+        elif len(content) > 10000:
+            # If document is large, process in sections
+            units = [
+                (section, f"Section {i+1} of document", f"{filename}_section{i+1}", "this section from an educational document")
+                for i, section in enumerate(self._split_into_sections(content))
+            ]
+        else:
+            # For smaller documents, process as a single chunk
+            units = [(content, "Complete document", f"{filename}_full", "this educational document")]
 
-INSTRUCTIONS:
-1. Return a JSON array with a MAXIMUM of 5 competencies that this content addresses
-2. Only use the EXACT competency names listed above - no variations whatsoever
-3. List them in order of relevance (most relevant first)
-4. Only include competencies that are substantially addressed in the content
-5. If fewer than 5 competencies are relevant, include fewer - quality over quantity
+        # gather preserves the order of units, so chunks come back in page order
+        chunks = await asyncio.gather(*[run_unit(unit, i) for i, unit in enumerate(units)])
+        return list(chunks), {}  # Return empty dict for backwards compatibility
 
-Example correct response:
-["Vision", "Leadership", "Planning", "Authenticity"]
+    async def _process_page_stream(self, pages, filename, run_unit):
+        """Start tagging each page as soon as it is parsed; returns the chunks in page order.
 
-Respond ONLY with a valid JSON array of competencies."""},
-                        {"role": "user", "content": f"Document content to tag: {content[:7000]}... (truncated if longer)"}
-                    ]
-                )
-                
-                document_tags = self._parse_tags(tag_response.choices[0].message.content)
-                document_tags = self._validate_tags(document_tags, valid_competencies)
-                
-                # Create a single chunk for the entire document
-                chunk = {
-                    "text": content,
-                    "summary": summary,
-                    "context": "Complete document",
-                    "chunk_id": f"{filename}_full",
-                    "tags": document_tags
+        At most twice max_concurrency pages are held between parsing and tagging, so a slow LLM
+        pauses parsing instead of letting parsed pages pile up in memory.
+        """
+        window = asyncio.Semaphore(self.max_concurrency * 2)
+        tasks = []
+        try:
+            page_number = 0
+            async for page_text in pages:
+                page_number += 1
+                if not page_text.strip():
+                    continue
+                await window.acquire()
+                unit = (page_text, f"Page {page_number} of document", f"{filename}_page{page_number}",
+                        "this page from an educational document")
+                task = asyncio.create_task(run_unit(unit, len(tasks)))
+                task.add_done_callback(lambda _: window.release())
+                tasks.append(task)
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    @traced("tagging")
+    async def _process_unit_async(self, client, text, context, chunk_id, description):
+        """Summarize and tag a single page/section with one JSON-mode call"""
+        response = await client.chat.completions.create(
+            model=INGESTION_MODEL,
+            messages=[
+                {"role": "system", "content": PAGE_ANALYSIS_PROMPT},
+                {"role": "user", "content": f"Content of {description}:\n\n{text[:7000]}... (truncated if longer)"}
+            ],
+            response_format={"type": "json_object"},
+            max_tokens=400
+        )
+        try:
+            result = json.loads(response.choices[0].message.content)
+        except (TypeError, ValueError):
+            result = {}
+        if not isinstance(result, dict):
+            result = {}
+
+        summary = result.get("summary")
+        tags = result.get("tags")
+        summary_ok = isinstance(summary, str) and summary.strip() != ""
+        # Extra or invalid tags are just dropped; only a reply without a single valid tag is re-asked
+        tags = self._validate_tags(tags, VALID_COMPETENCIES)
+        tags_ok = bool(tags)
+        if not (summary_ok and tags_ok):
+            # Re-ask only for the malformed field(s)
+            malformed = [field for field, ok in (("summary", summary_ok), ("tags", tags_ok)) if not ok]
+            logging.info(f"Repairing malformed {', '.join(malformed)} for {chunk_id}")
+            summary_repair = None if summary_ok else self._summarize_async(client, text, description)
+            tags_repair = None if tags_ok else self._tag_async(client, text)
+            repairs = await asyncio.gather(*[call for call in (summary_repair, tags_repair) if call is not None])
+            if not summary_ok:
+                summary = repairs.pop(0)
+            if not tags_ok:
+                tags = self._validate_tags(repairs.pop(0), VALID_COMPETENCIES)
+
+        return {
+            "text": text,
+            "summary": (summary or "").strip(),
+            "context": context,
+            "chunk_id": chunk_id,
+            "tags": tags,
+            "content_hash": content_hash(text)
+        }
+
+    async def _summarize_async(self, client, text, description):
+        """Summary-only call, used when the combined call returned no usable summary"""
+        response = await client.chat.completions.create(
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Provide a brief 2-3 sentence summary of {description}:\n\n{text[:5000]}... (truncated if longer)"}
+            ],
+            max_tokens=200
+        )
+        return response.choices[0].message.content
+
+    async def _tag_async(self, client, text):
+        """Tag-only call, used when the combined call returned malformed tags"""
+        response = await client.chat.completions.create(
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": TAGGING_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Document content to tag: {text[:7000]}... (truncated if longer)"}
+            ]
+        )
+        return self._parse_tags(response.choices[0].message.content)
+
+    @traced("tagging")
+    async def _process_image_async(self, client, content, filename):
+        """Extract text, summary and tags from an image with a single GPT-4o vision call"""
+        # Encode image to base64
+        base64_image = base64.b64encode(content).decode('utf-8')
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": IMAGE_TAGGING_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                    }
+                ]
+            }
+        ]
+        response = await client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=1000
+        )
+        # Try to extract JSON from the response
+        content = response.choices[0].message.content
+        try:
+            json_start = content.find('{')
+            json_end = content.rfind('}') + 1
+            if json_start >= 0 and json_end > json_start:
+                result = json.loads(content[json_start:json_end])
+                return {
+                    "text": result.get("text", ""),
+                    "summary": result.get("summary", ""),
+                    "context": "",
+                    "chunk_id": f"{filename}_image",
+                    "tags": self._validate_tags(result.get("tags", []), VALID_COMPETENCIES)
                 }
-                
-                processed_chunks = [chunk]
-                
-            return processed_chunks, {}  # Return empty dict for backwards compatibility
+            return None
+        except Exception as e:
+            print(f"Error processing image: {str(e)}")
+            return None
     
     def _validate_tags(self, tags, valid_competencies):
         """Validate and sanitize tags to ensure they match our requirements"""
@@ -1,13 +1,35 @@
 import os
+import time
+import random
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from pinecone import Pinecone
 from dotenv import load_dotenv
-import json
+from metrics import traced
+from service_registry import HTTP_MAX_KEEPALIVE_CONNECTIONS
+from request_logging import in_request_context
 
 load_dotenv()
 
+# Pinecone rejects upsert requests over 2MB and recommends at most 1000 vectors per request;
+# stay below both so a large document never fails as a whole
+UPSERT_MAX_BATCH_VECTORS = int(os.getenv("PINECONE_UPSERT_BATCH_VECTORS", "100"))
+UPSERT_MAX_BATCH_BYTES = int(os.getenv("PINECONE_UPSERT_BATCH_BYTES", str(1536 * 1024)))
+UPSERT_WORKERS = int(os.getenv("PINECONE_UPSERT_WORKERS", "4"))
+UPSERT_MAX_ATTEMPTS = int(os.getenv("PINECONE_UPSERT_MAX_ATTEMPTS", "3"))
+# Pinecone's per-vector metadata limit
+MAX_METADATA_BYTES = 40 * 1024
+
+
+def estimate_vector_bytes(vector_id, embedding, metadata):
+    """Approximate request size of one vector: JSON-encoded values, id and metadata"""
+    return len(vector_id) + len(embedding) * 12 + len(json.dumps(metadata))
+
 class PineconeService:
-    def __init__(self):
-        self.pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    def __init__(self, pc=None):
+        # pc is a Pinecone client, or a stand-in with the same calls (see fake_backends)
+        self.pc = pc or Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
         index_name = os.getenv("PINECONE_INDEX_NAME")
         # Auto-create index if it doesn't exist
         if index_name not in [i.name for i in self.pc.list_indexes()]:
@@ -17,7 +39,9 @@ class PineconeService:
                 metric="cosine",
                 spec={"serverless": {"cloud": "aws", "region": "us-east-1"}}
             )
-        self.index = self.pc.Index(index_name)
+        # The Pinecone client has its own urllib3 pool (HttpPool is httpx); size it like HttpPool's
+        self.index = self.pc.Index(index_name, connection_pool_maxsize=HTTP_MAX_KEEPALIVE_CONNECTIONS)
+        self.last_upsert_report = []
 
     # def upsert_chunks(self, filename, chunks, tags=None):
     #     """Store chunks in Pinecone with their associated tags"""
@@ -76,6 +100,7 @@ class PineconeService:
     #         return True
     #     return False
 
+    @traced("upsert")
     def upsert_chunks(self, filename, chunks):
         """Store chunks in Pinecone with their associated tags"""
         vectors = []
@@ -89,12 +114,14 @@ class PineconeService:
             
             # Create the metadata for this chunk
             metadata = {
-                "filename": filename,
+                # Batched upserts carry chunks of several documents
+                "filename": chunk.get('filename', filename),
                 "chunkText": chunk_text,
-                "chunkIndex": i,
+                "chunkIndex": chunk.get('chunk_index', i),
                 "chunkId": chunk_id,
                 "tags": chunk_tags  # Store tags directly - Pinecone handles lists fine
             }
+            metadata = self._fit_metadata(metadata)
             
             # Extract embedding
             embedding = chunk.get('embedding', None)
@@ -103,12 +130,87 @@ class PineconeService:
             if embedding:
                 vectors.append((chunk_id, embedding, metadata))
         
-        # Upsert vectors to Pinecone if we have any
-        if vectors:
-            self.index.upsert(vectors)
-            return True
-        return False
+        if not vectors:
+            return False
+
+        # Upsert vectors to Pinecone in size-limited batches, several in flight at once
+        batches = self._make_batches(vectors)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(UPSERT_WORKERS, len(batches))) as executor:
+            report = list(executor.map(in_request_context(self._upsert_batch), range(len(batches)), batches))
+        self.last_upsert_report = report
+
+        for batch in report:
+            logging.info(f"Upsert batch {batch['batch']}: {batch['vectors']} vectors, {batch['bytes']} bytes, "
+                         f"{batch['seconds']:.3f}s, {batch['attempts']} attempt(s), {'ok' if batch['ok'] else 'FAILED'}")
+        logging.info(f"Upserted {len(vectors)} vectors for {filename} in {len(batches)} batches "
+                     f"in {time.perf_counter() - start:.3f}s")
+
+        failed = [batch for batch in report if not batch["ok"]]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(batches)} Pinecone upsert batches failed: {failed[0]['error']}")
+        return True
+
+    def _fit_metadata(self, metadata):
+        """Truncate chunkText so a single vector stays under Pinecone's metadata size limit"""
+        overflow = len(json.dumps(metadata, ensure_ascii=False).encode("utf-8")) - MAX_METADATA_BYTES
+        if overflow > 0:
+            text = metadata["chunkText"]
+            # Cut the UTF-8 bytes (with some slack for escaping) rather than characters, so multi-byte
+            # text is not over-truncated; a character split at the cut is dropped
+            encoded = text.encode("utf-8")
+            truncated = encoded[:max(0, len(encoded) - overflow - 256)].decode("utf-8", errors="ignore")
+            logging.warning(f"Truncating chunkText of {metadata['chunkId']} from {len(text)} to {len(truncated)} characters for Pinecone")
+            metadata = dict(metadata, chunkText=truncated)
+        return metadata
+
+    def _make_batches(self, vectors):
+        """Split vectors into batches under the vector-count and byte-size limits"""
+        batches = []
+        current_batch = []
+        current_bytes = 0
+        for vector in vectors:
+            vector_bytes = estimate_vector_bytes(*vector)
+            if current_batch and (len(current_batch) >= UPSERT_MAX_BATCH_VECTORS
+                                  or current_bytes + vector_bytes > UPSERT_MAX_BATCH_BYTES):
+                batches.append(current_batch)
+                current_batch = []
+                current_bytes = 0
+            current_batch.append(vector)
+            current_bytes += vector_bytes
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+
+    def _upsert_batch(self, batch_number, batch):
+        """Upsert one batch, retrying just this batch with jittered backoff"""
+        batch_bytes = sum(estimate_vector_bytes(*vector) for vector in batch)
+        start = time.perf_counter()
+        error = None
+        for attempt in range(1, UPSERT_MAX_ATTEMPTS + 1):
+            try:
+                self.index.upsert(vectors=batch)
+                return {"batch": batch_number, "vectors": len(batch), "bytes": batch_bytes,
+                        "seconds": time.perf_counter() - start, "attempts": attempt, "ok": True, "error": None}
+            except Exception as e:
+                error = str(e)
+                logging.warning(f"Upsert batch {batch_number} attempt {attempt} failed: {error}")
+                if attempt < UPSERT_MAX_ATTEMPTS:
+                    time.sleep((2 ** (attempt - 1)) * (0.5 + random.random()))
+        return {"batch": batch_number, "vectors": len(batch), "bytes": batch_bytes,
+                "seconds": time.perf_counter() - start, "attempts": UPSERT_MAX_ATTEMPTS, "ok": False, "error": error}
+
+    @traced("vector_delete")
+    def delete_chunks(self, chunk_ids):
+        """Delete vectors by chunk id"""
+        chunk_ids = list(chunk_ids)
+        # Pinecone accepts at most 1000 ids per delete request
+        for start in range(0, len(chunk_ids), 1000):
+            self.index.delete(ids=chunk_ids[start:start + 1000])
+        if chunk_ids:
+            logging.info(f"Deleted {len(chunk_ids)} vectors")
 
+    @traced("vector_query")
     def query(self, query_embedding, top_k=20, filter_categories=None):
         """Query Pinecone index with optional category filtering"""
         if filter_categories:
@@ -0,0 +1,121 @@
+import sys
+import json
+import zlib
+import struct
+from array import array
+from collections import Counter
+
+# Binary layout of a processed/ artifact:
+#   MAGIC | header size (uint32, little-endian) | zlib(JSON header) | chunk records
+# The header holds the document fields, a tag summary and an index of (offset, size) per chunk, so the
+# tag summary or a single chunk can be read with ranged downloads. Each chunk record is zlib(JSON of the
+# chunk without its embedding) followed by the embedding as little-endian float32.
+MAGIC = b"HNHPROC1"
+ARTIFACT_SUFFIX = ".bin"
+PREFIX_SIZE = len(MAGIC) + 4
+# First ranged read when only the header is wanted; large headers take a second read
+HEADER_READ_BYTES = 16 * 1024
+
+
+def _float32_bytes(embedding):
+    values = array('f', embedding)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _float32_array(data):
+    values = array('f')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def tag_summary(chunks):
+    """How many chunks carry each tag"""
+    return dict(Counter(tag for chunk in chunks for tag in chunk.get("tags", [])))
+
+
+def encode(processed_data):
+    """Serialize processed_data ({"chunks": [...], ...}) into the binary artifact format"""
+    records = []
+    index = []
+    offset = 0
+    for chunk in processed_data.get("chunks", []):
+        embedding = chunk.get("embedding")
+        fields = {key: value for key, value in chunk.items() if key != "embedding"}
+        record = zlib.compress(json.dumps(fields, separators=(',', ':')).encode('utf-8'))
+        dimension = 0
+        if embedding is not None and len(embedding):
+            dimension = len(embedding)
+            record += _float32_bytes(embedding)
+        index.append({
+            "chunk_id": chunk.get("chunk_id"),
+            "tags": chunk.get("tags", []),
+            "offset": offset,
+            "size": len(record),
+            "dimension": dimension
+        })
+        records.append(record)
+        offset += len(record)
+
+    header = {
+        "version": 1,
+        "fields": {key: value for key, value in processed_data.items() if key != "chunks"},
+        "tag_summary": tag_summary(processed_data.get("chunks", [])),
+        "chunks": index
+    }
+    header_bytes = zlib.compress(json.dumps(header, separators=(',', ':')).encode('utf-8'))
+    return b"".join([MAGIC, struct.pack("<I", len(header_bytes)), header_bytes] + records)
+
+
+def is_artifact(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def header_end(prefix):
+    """Number of leading bytes that hold the header, given at least PREFIX_SIZE bytes of the artifact"""
+    if not is_artifact(prefix):
+        raise ValueError("Not a processed artifact")
+    return PREFIX_SIZE + struct.unpack("<I", prefix[len(MAGIC):PREFIX_SIZE])[0]
+
+
+def decode_header(data):
+    """Parse the header from the leading bytes of an artifact; chunk offsets are made absolute"""
+    end = header_end(data)
+    header = json.loads(zlib.decompress(data[PREFIX_SIZE:end]))
+    for entry in header["chunks"]:
+        entry["offset"] += end
+    return header
+
+
+def decode_chunk(entry, record):
+    """Rebuild one chunk from its index entry and record bytes; the embedding comes back as array('f')"""
+    embedding_size = 4 * entry["dimension"]
+    compressed = record[:len(record) - embedding_size] if embedding_size else record
+    chunk = json.loads(zlib.decompress(compressed))
+    if embedding_size:
+        chunk["embedding"] = _float32_array(record[len(record) - embedding_size:])
+    return chunk
+
+
+def decode(data):
+    """Parse a whole artifact back into processed_data"""
+    header = decode_header(data)
+    processed_data = dict(header["fields"])
+    processed_data["chunks"] = [
+        decode_chunk(entry, data[entry["offset"]:entry["offset"] + entry["size"]]) for entry in header["chunks"]
+    ]
+    return processed_data
+
+
+def header_from_processed(processed_data):
+    """Header-shaped view of processed_data read from an old JSON artifact (no offsets)"""
+    chunks = processed_data.get("chunks", [])
+    return {
+        "version": 0,
+        "fields": {key: value for key, value in processed_data.items() if key != "chunks"},
+        "tag_summary": tag_summary(chunks),
+        "chunks": [{"chunk_id": chunk.get("chunk_id"), "tags": chunk.get("tags", [])} for chunk in chunks]
+    }
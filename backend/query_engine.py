@@ -1,9 +1,11 @@
 from openai import OpenAI
+from llm_scheduler import ScheduledClient, PRIORITY_INTERACTIVE, llm_priority
 
 class QueryEngine:
     def __init__(self, vector_store, openai_api_key):
         self.vector_store = vector_store
-        self.openai_client = OpenAI(api_key=openai_api_key)
+        # Calls are rate limited and retried by the shared LLM scheduler
+        self.openai_client = ScheduledClient(OpenAI(api_key=openai_api_key, max_retries=0))
         
     def process_query(self, query, filters=None, top_k=20):
         """Process a query using RAG"""
@@ -20,13 +22,14 @@ class QueryEngine:
         formatted_chunks = self._format_chunks_for_gpt(results)
         
         # Generate response using GPT
-        response = self.openai_client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": self._create_system_prompt()},
-                {"role": "user", "content": f"Query: {query}\n\nRelevant Materials:\n{formatted_chunks}"}
-            ]
-        )
+        with llm_priority(PRIORITY_INTERACTIVE):
+            response = self.openai_client.chat.completions.create(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": self._create_system_prompt()},
+                    {"role": "user", "content": f"Query: {query}\n\nRelevant Materials:\n{formatted_chunks}"}
+                ]
+            )
         
         suggestions = response.choices[0].message.content
         
@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import Counter
+from dotenv import load_dotenv
+from request_logging import log_payload, payload_logging_enabled
+from quote_aligner import QuoteAligner, QUOTE_ALIGNMENT_THRESHOLD
+from context_packer import ContextPacker
+from metrics import span, traced
+from openai_service import CORE_VALUES
+
+load_dotenv()
+
+# Widen the index search when a competency-filtered query returns fewer matches than this
+QUERY_MIN_MATCHES = int(os.getenv("QUERY_MIN_MATCHES", "8"))
+# top_k multiplier for the relaxed (core value) search
+QUERY_WIDEN_FACTOR = int(os.getenv("QUERY_WIDEN_FACTOR", "2"))
+# Stop widening once retrieval has taken this long
+QUERY_RETRIEVAL_BUDGET_MS = float(os.getenv("QUERY_RETRIEVAL_BUDGET_MS", "1500"))
+
+# Prompts for the GPT-4o lesson plan answer
+LESSON_PLAN_SYSTEM_PROMPT = """You are an expert curriculum developer specializing in entrepreneurship education at the Wolff Center for Entrepreneurship (WCE). 
+
+IMPORTANT INSTRUCTIONS FOR EXTRACTING CONTENT:
+1. Extract ONLY direct quotes from the provided context. Do NOT paraphrase or summarize.
+2. Each chunk may come from different documents - look for a 'filename' field in the chunk metadata if available.
+3. If the filename is not explicitly given, refer to the chunk by its content and position (e.g., "Chunk about Law of Curiosity").
+4. When providing references, be specific about where in the document the content appears (e.g., section title, page if available).
+5. If you can't find an exact location reference, explicitly state "Reference: [Document name], exact location unknown".
+6. If the content doesn't contain information about a requested competency, don't include that chunk dont attempt to extract irrelevant content.
+
+Your goal is to provide a structured lesson plan with accurate, directly quoted content and precise source attributions."""
+
+# Filled in with .format(query=..., context=...)
+LESSON_PLAN_USER_PROMPT = """
+I need you to analyze the provided context and extract the most relevant material for developing a lesson plan for the Wolff Center for Entrepreneurship (WCE) at the University of Houston's C. T. Bauer College of Business.
+
+The WCE is guided by a philosophy centered on empowering students to understand their values, articulate their dreams, and achieve tangible outcomes. The program emphasizes both academic rigor and real-world application, preparing students to assume leadership roles in business by teaching them how to develop and implement their own ventures. WCE fosters personal and professional growth through mentorship, experiential learning, and a commitment to integrity and innovation.
+
+Our program focuses on four core value categories, each with four specific behavioral competencies:
+
+1. ACTION
+   - Results
+   - Execution
+   - Fearless Presenter
+   - Seize Opportunities
+
+2. RELATIONSHIPS
+   - Connection
+   - Leadership
+   - Collaboration
+   - Awareness
+
+3. DISCIPLINE
+   - Planning
+   - Constructive Thinking
+   - Organize
+   - Control
+
+4. PURPOSE
+   - Authenticity
+   - CEO Perspective
+   - Vision
+   - Growth Mindset
+
+For the behavioral competency: {query}
+
+Please extract 8-10 relevant sections from the context, provide precise references for each, and suggest how to incorporate them into our entrepreneurship-focused lesson plan. Each suggestion should specifically reinforce the behavioral competency while aligning with WCE's overall philosophy. Conclude with an overall approach for teaching this competency.
+
+In the reference output, please explicitly mention the filename from the content. It is listed in the metadata at the top of each file as "filename".
+
+The additional user and assistant prompts are only for reference. Do not use them in your response. Please only use use the context provided. Do not assume the lesson plan the user is asking for, allow them to tell you. 
+
+Context:
+{context}
+"""
+
+# Worked examples shown to the model before the real question
+FEW_SHOT_MESSAGES = [
+    {"role": "user", "content": "We want to develop a lesson plan on 'Fearless Presenter' for our WCE students. Please extract the relevant material and provide suggestions that align with this behavioral competency under the ACTION core value."},
+    {"role": "assistant", "content": """
+{
+  "competency": "Fearless Presenter",
+  "category": "ACTION",
+  "extracts": [
+    {
+      "content": "Effective communication is not merely about slide design or voice projection—it's about conveying conviction in your venture's value proposition. Research indicates that investors make preliminary funding decisions within the first 3 minutes of a pitch, responding primarily to the founder's passionate belief in their solution.",
+      "reference": "Entrepreneurial_Communication_Guide.pdf, Chapter 4, 'Pitch Psychology,' Pages 78-82",
+      "teaching_suggestion": "Structure a progressive pitching exercise where students present the same concept three times with increasing stakes: first to a peer, then to a small group, and finally to a panel of visiting entrepreneurs. Provide specific feedback on how their conviction comes through in each iteration."
+    },
+    {
+      "content": "Fear management techniques distinguish novice from experienced presenters. The entrepreneurial mindset reframes presentation anxiety as excitement, utilizing physiological arousal as fuel rather than allowing it to become an obstacle to effective delivery.",
+      "reference": "Founder_Psychology_Handbook.pdf, Section 5.3, 'Performance Under Pressure'",
+      "teaching_suggestion": "Teach specific pre-presentation routines that embrace nervous energy, including power posing, controlled breathing, and positive visualization. Have students develop personalized 5-minute pre-presentation rituals they can implement before important pitches."
+    },
+    {
+      "content": "Story-driven presentations generate 63% better recall than fact-based approaches. The entrepreneurial narrative arc—establishing the problem, revealing the journey to the solution, and painting the vision of impact—creates both emotional connection and logical understanding.",
+      "reference": "Pitch_Deck_Development_Manual.pdf, Chapter 2, 'Narrative Structures for Entrepreneurs'",
+      "teaching_suggestion": "Challenge students to identify their venture's 'origin story' and craft it into a 2-minute opening that establishes both credibility and emotional resonance before any business metrics are shared."
+    },
+    {
+      "content": "Data visualization literacy separates memorable presentations from forgettable ones. Entrepreneurs must transform complex business information into instantly comprehensible visual insights that support rather than overwhelm their core message.",
+      "reference": "Data_Communication_Guide.pdf, Pages 45-51, 'Visual Storytelling for Business Impact'",
+      "teaching_suggestion": "Conduct a workshop where students bring their venture's most complex dataset and develop three different visualization approaches, then test which creates the fastest understanding with audience members."
+    }
+  ],
+  "lesson_approach": "To develop 'Fearless Presenter' competency in WCE students, I recommend an immersive approach that integrates technical presentation skills with emotional resilience building. The lesson should begin by addressing the psychological barriers many entrepreneurs face when presenting their ventures, framing fear as a natural response that can be channeled productively. I suggest implementing a 'presentation laboratory' format where students regularly present in increasingly challenging scenarios—from informal peer sessions to formal investor panels with real-world entrepreneurs. Throughout this progression, focus on three pillars: (1) authentic message development that aligns with the student's personal values, (2) strategic presentation design that emphasizes story over slides, and (3) embodied communication techniques that build physical confidence. The most effective approach would culminate in a high-stakes presentation opportunity where students must respond to unexpected challenges or questions, reinforcing WCE's action-oriented philosophy. Consider recording presentations at various stages of development so students can witness their own growth, reinforcing the Growth Mindset competency from the Purpose category while building their confidence as Fearless Presenters."
+}
+
+"""},
+    {"role": "user", "content": "We want to develop a lesson plan on 'CEO Perspective' for our WCE students. Please extract the relevant material and provide suggestions that align with this behavioral competency under the PURPOSE core value."},
+    {"role": "assistant", "content": """
+
+{
+  "competency": "CEO Perspective",
+  "category": "PURPOSE",
+  "extracts": [
+    {
+      "content": "The CEO Perspective requires entrepreneurs to simultaneously hold three time horizons: immediate tactical execution, mid-range strategic positioning, and long-term vision fulfillment. Research with successful founders reveals that this cognitive flexibility—switching between operational details and big-picture thinking—correlates strongly with venture longevity.",
+      "reference": "Executive_Mindset_Manual.pdf, Chapter 3, 'Temporal Leadership Dimensions,' Pages 72-79",
+      "teaching_suggestion": "Implement a 'three horizons exercise' where students make decisions about the same business challenge from three different timeframes (next week, next year, next decade), then analyze how these perspectives lead to different priorities and actions."
+    },
+    {
+      "content": "CEO Perspective encompasses the ability to analyze stakeholder ecosystems holistically. Novice entrepreneurs often optimize for customer needs alone, while experienced founders balance the interests of customers, team members, investors, partners, and community with sophisticated tradeoff analysis.",
+      "reference": "Stakeholder_Management_Guide.pdf, Section 4.2, 'Multi-constituency Decision Making'",
+      "teaching_suggestion": "Create a stakeholder simulation where student teams navigate a complex business decision with actors representing different stakeholders with competing interests. Debrief by evaluating how effectively they balanced diverse needs while staying true to core venture values."
+    },
+    {
+      "content": "The psychological burden of ultimate accountability distinguishes the CEO role from all others. Research on entrepreneur resilience indicates that those who develop rituals for processing failure, celebrating small wins, and maintaining perspective during crises demonstrate significantly higher leadership effectiveness scores.",
+      "reference": "Founder_Psychology_Report.pdf, Pages 115-127, 'Decision-Making Under Uncertainty'",
+      "teaching_suggestion": "Establish a regular 'CEO reflection practice' where students document their decision processes, assumptions, and emotional responses to outcomes. Partner with the Psychology department to provide structured feedback on their self-awareness and emotional regulation strategies."
+    },
+    {
+      "content": "Houston's most successful entrepreneurs demonstrate a distinct form of CEO Perspective through their ability to connect industry-specific opportunities with broader economic and social trends. This contextual intelligence—seeing how their venture fits within larger systems—enables more strategic resource allocation and more compelling narrative creation.",
+      "reference": "Houston_Entrepreneurship_Case_Studies.pdf, Volume 3, 'Systems Thinking in Practice'",
+      "teaching_suggestion": "Organize small-group sessions with successful Houston CEOs where students present their analysis of how macro trends impact their specific venture concept, receiving feedback on their contextual intelligence and systems thinking."
+    },
+    {
+      "content": "Financial literacy transforms from a technical skill to a strategic advantage when entrepreneurs develop what veteran CEOs call 'number sense'—the ability to quickly identify which metrics truly drive business health and which are vanity metrics that distract from core value creation.",
+      "reference": "Financial_Leadership_for_Entrepreneurs.pdf, Chapter 8, 'From Accounting to Strategy'",
+      "teaching_suggestion": "Challenge students to identify the 3-5 most critical metrics for their venture and defend why these specific numbers deserve CEO attention. Have them create a one-page 'CEO Dashboard' that would guide their weekly decision-making."
+    }
+  ],
+  "lesson_approach": "To develop the 'CEO Perspective' competency under the PURPOSE core value, I recommend a lesson approach that balances conceptual understanding with experiential learning. Begin with a session exploring the distinction between management (doing things right) and leadership (doing the right things), using case studies that illustrate how CEO Perspective manifests in entrepreneurial decision-making. The heart of the lesson should utilize a comprehensive business simulation where students rotate through the CEO role, facing escalating challenges that require them to balance competing priorities, make decisions with incomplete information, and communicate their reasoning to various stakeholders. Critical to this approach is structured reflection after each simulation round, where students articulate how their decisions align with both immediate business needs and longer-term vision. Throughout the lesson, deliberately connect CEO Perspective to the other PURPOSE competencies, particularly Vision and Authenticity, showing how effective CEOs maintain alignment between personal values, company mission, and strategic decisions. Consider partnering with the WCE mentorship network to arrange shadow opportunities where students observe real CEOs navigating complex decisions, followed by debrief conversations about the thought processes witnessed. The assessment should evaluate students not on the specific decisions made, but on their ability to articulate comprehensive reasoning that demonstrates holistic understanding of their venture's ecosystem."
+}
+     
+"""},
+]
+
+QUOTE_EXTRACTION_PROMPT = "You are an expert at extracting direct quotes from educational content. Given a chunk of text and a question, extract the most relevant section (3-4 sentences) from the text that is most relevant to the topic in the question. Only return the exact quote, do not paraphrase or summarize and write out the full section. If no relevant quote exists, return an empty string."
+
+
+def format_sse(event, data):
+    """Encode one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class QueryPipeline:
+    """Answer a lesson plan query: classify, retrieve, prompt GPT-4o and post-process its JSON reply"""
+
+    def __init__(self, openai_service, embedding_service, category_classifier, vector_service, top_k=20,
+                 quote_alignment_threshold=QUOTE_ALIGNMENT_THRESHOLD, context_packer=None,
+                 min_matches=QUERY_MIN_MATCHES, widen_factor=QUERY_WIDEN_FACTOR, retrieval_budget_ms=QUERY_RETRIEVAL_BUDGET_MS):
+        self.openai_service = openai_service
+        self.embedding_service = embedding_service
+        self.category_classifier = category_classifier
+        self.vector_service = vector_service
+        self.top_k = top_k
+        self.quote_alignment_threshold = quote_alignment_threshold
+        self.context_packer = context_packer or ContextPacker()
+        self.min_matches = min_matches
+        self.widen_factor = widen_factor
+        self.retrieval_budget_ms = retrieval_budget_ms
+        # How often each search path ends a retrieval
+        self.retrieval_stats = Counter()
+
+    async def answer(self, query):
+        """Run the whole pipeline and return the formatted markdown reply"""
+        relevant_categories, filtered_matches = await self.retrieve(query)
+        messages = self.build_messages(query, filtered_matches)
+        response_json = await self.generate(messages)
+        return await self.format_reply(query, response_json, filtered_matches)
+
+    async def stream_events(self, query):
+        """Yield server-sent events: the sources as soon as retrieval finishes, then model tokens, then the final reply"""
+        try:
+            relevant_categories, filtered_matches = await self.retrieve(query)
+            yield format_sse("sources", {
+                "categories": relevant_categories,
+                "sources": [self._source_summary(match) for match in filtered_matches]
+            })
+
+            messages = self.build_messages(query, filtered_matches)
+            parts = []
+            async for token in self.stream_generate(messages):
+                parts.append(token)
+                yield format_sse("token", {"text": token})
+
+            formatted = await self.format_reply(query, "".join(parts), filtered_matches)
+            yield format_sse("final", {"reply": formatted})
+        except Exception as e:
+            logging.exception("Error in /query/stream")
+            yield format_sse("error", {"detail": str(e)})
+
+    async def retrieve(self, query):
+        """Return the relevant competencies and the retrieved matches for a query"""
+        # Generate embedding for query
+        with span("query_embedding"):
+            query_embedding = await self.embedding_service.embed_text_async(query)
+
+        # Classify the query (local, LLM only when unsure) so the index can filter by competency
+        with span("category_analysis"):
+            relevant_categories = await self.category_classifier.classify_async(query, query_embedding)
+        filtered_matches = await self.search(query_embedding, relevant_categories)
+
+        # One compact line for every request; chunk previews only for sampled requests
+        logging.info(f"Retrieved {len(filtered_matches)} chunks for categories {relevant_categories}: "
+                     f"{[match['metadata'].get('chunkId', '') for match in filtered_matches]}")
+        if payload_logging_enabled():
+            log_payload("CHUNKS RETRIEVED FROM PINECONE", "\n".join(
+                f"CHUNK {i+1}: {match['metadata'].get('filename', 'unknown')} "
+                f"{match['metadata'].get('tags', [])} {match['metadata'].get('chunkText', '')[:300]}"
+                for i, match in enumerate(filtered_matches)
+            ))
+
+        return relevant_categories, filtered_matches
+
+    @traced("retrieval")
+    async def search(self, query_embedding, categories):
+        """Tag-filtered index search that widens when the filtered result is thin.
+
+        Tries the query's competencies first, then every competency under the same core values with a
+        larger top_k, then no filter at all, stopping as soon as min_matches are found or the latency
+        budget is spent. Earlier (better targeted) matches always rank ahead of later ones.
+        """
+        start = time.perf_counter()
+        attempts = []
+        if categories:
+            attempts.append(("filtered", categories, self.top_k))
+            relaxed = [c for competencies in CORE_VALUES.values() if set(competencies) & set(categories) for c in competencies]
+            if set(relaxed) != set(categories):
+                attempts.append(("relaxed", relaxed, self.top_k * self.widen_factor))
+        attempts.append(("unfiltered", None, self.top_k))
+
+        matches = []
+        seen = set()
+        outcome = None
+        for path, filter_categories, top_k in attempts:
+            results = await asyncio.to_thread(self.vector_service.query, query_embedding, top_k=top_k,
+                                              filter_categories=filter_categories)
+            for match in results:
+                if match["id"] not in seen:
+                    seen.add(match["id"])
+                    matches.append(match)
+            outcome = path
+            if len(matches) >= self.min_matches:
+                break
+            if (time.perf_counter() - start) * 1000 >= self.retrieval_budget_ms:
+                # Counted instead of the path, so every search records exactly one outcome
+                outcome = "budget_exhausted"
+                break
+        self.retrieval_stats[outcome] += 1
+        logging.info(f"Index search path: {path}, outcome: {outcome} ({len(matches)} matches in {(time.perf_counter() - start) * 1000:.0f} ms)")
+        return matches[:self.top_k]
+
+    def build_context(self, query, filtered_matches):
+        """Build the context block from the retrieved chunks, packed into the context token budget"""
+        return self.context_packer.pack(query, filtered_matches)
+
+    @traced("context_packing")
+    def build_messages(self, query, filtered_matches):
+        """Assemble the GPT-4o messages for a query; the context is sent once, in the final user message"""
+        context, report = self.build_context(query, filtered_matches)
+
+        log_payload("CONTEXT BEING FED TO GPT", context)
+
+        messages = [
+            {"role": "system", "content": LESSON_PLAN_SYSTEM_PROMPT},
+            *FEW_SHOT_MESSAGES,
+            {"role": "user", "content": LESSON_PLAN_USER_PROMPT.format(query=query, context=context)}
+        ]
+
+        # The context used to be sent twice in full, once in the prompt and once as a separate message
+        tokens_saved = 2 * report["context_tokens_full"] - report["context_tokens_packed"]
+        logging.info(f"Packed context: {report['chunks_retrieved']} chunks, {report['duplicates_dropped']} duplicates dropped, "
+                     f"{report['chunks_trimmed']} trimmed, {report['context_tokens_packed']} tokens (~{tokens_saved} saved)")
+        # The system prompt and worked examples are constant and the context is logged above, so only sizes are logged here
+        logging.info(f"Sending {len(messages)} messages ({sum(len(msg['content']) for msg in messages)} chars) to GPT")
+        return messages
+
+    @traced("generation")
+    async def generate(self, messages):
+        """Get the complete GPT-4o answer"""
+        response = await self.openai_service.async_client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages
+        )
+        return response.choices[0].message.content
+
+    async def stream_generate(self, messages):
+        """Yield GPT-4o answer tokens as they arrive"""
+        with span("generation"):
+            stream = await self.openai_service.async_client.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                # The scheduler asks for the usage chunk and counts it
+                stream=True
+            )
+            async for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
+
+    @traced("format_reply")
+    async def format_reply(self, query, response_json, filtered_matches):
+        """Repair non-verbatim quotes and render the JSON answer as markdown"""
+        try:
+            data = json.loads(response_json)
+            # Post-process: ensure 'content' in each extract is a direct quote from the context
+            chunk_texts = [match["metadata"].get("chunkText", "") for match in filtered_matches]
+            aligner = QuoteAligner(chunk_texts)
+            extracts_to_repair = []
+            for extract in data.get('extracts', []):
+                quote = extract.get('content', '').strip()
+                # Check if the quote is a direct substring of any chunk in the context
+                if quote and any(quote in chunk_text for chunk_text in chunk_texts):
+                    continue
+                # Otherwise snap it to the closest verbatim span across all chunks
+                match = aligner.align(quote)
+                if match and match.score >= self.quote_alignment_threshold:
+                    extract['content'] = match.text
+                else:
+                    # Ask GPT only when nothing local is close enough, using the chunk that came closest
+                    chunk_index = match.chunk_index if match else 0
+                    extracts_to_repair.append((extract, chunk_texts[chunk_index] if chunk_texts else ""))
+
+            # All remaining repairs run in parallel
+            new_quotes = await asyncio.gather(*[
+                self.repair_quote(query, chunk_text) for _, chunk_text in extracts_to_repair
+            ])
+            for (extract, _), new_quote in zip(extracts_to_repair, new_quotes):
+                if new_quote:
+                    extract['content'] = new_quote
+            if extracts_to_repair:
+                logging.info(f"Repaired {len(extracts_to_repair)} of {len(data.get('extracts', []))} quotes with GPT")
+            formatted = f"### Competency: {data.get('competency', '')}  \n**Category:** {data.get('category', '')}\n\n\n\n## Extracts\n\n"
+            teaching_suggestions = []
+            for i, extract in enumerate(data.get('extracts', []), 1):
+                teaching_suggestion = extract.get('teaching_suggestion', '').replace('. ', '.\n   - ')
+                teaching_suggestions.append(teaching_suggestion)
+                formatted += f"{i}. **Content:**  \n   {extract.get('content', '')}  \n   **Reference:**  \n   {extract.get('reference', '')}\n\n"
+            formatted += "\n\n\n## Lesson Approach\n\n" + data.get('lesson_approach', '')
+            # Add all teaching suggestions at the end
+            formatted += "\n\n\n## Teaching Suggestions\n\n"
+            for i, suggestion in enumerate(teaching_suggestions, 1):
+                formatted += f"{i}. {suggestion}\n\n"
+        except Exception:
+            formatted = response_json  # fallback to raw if not JSON
+        return formatted
+
+    @traced("quote_repair")
+    async def repair_quote(self, query, chunk_text):
+        """Ask GPT-4o for a verbatim quote from chunk_text that answers the query"""
+        quote_prompt = [
+            {"role": "system", "content": QUOTE_EXTRACTION_PROMPT},
+            {"role": "user", "content": f"Text: {chunk_text}\n\nQuestion: {query}"}
+        ]
+        quote_response = await self.openai_service.async_client.chat.completions.create(
+            model="gpt-4o",
+            messages=quote_prompt
+        )
+        return quote_response.choices[0].message.content.strip().strip('"')
+
+    def _source_summary(self, match):
+        """Small, JSON-safe description of a retrieved chunk for streaming clients"""
+        metadata = match["metadata"]
+        return {
+            "chunk_id": metadata.get("chunkId", ""),
+            "filename": metadata.get("filename", "unknown"),
+            "tags": list(metadata.get("tags", [])),
+            "score": match["score"],
+            "preview": metadata.get("chunkText", "")[:300]
+        }
@@ -0,0 +1,108 @@
+import os
+import re
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Minimum similarity for a local alignment to replace a quote without asking GPT
+QUOTE_ALIGNMENT_THRESHOLD = float(os.getenv("QUOTE_ALIGNMENT_THRESHOLD", "0.8"))
+NGRAM_SIZE = 3
+# Number of candidate (chunk, offset) diagonals scored in full per quote
+MAX_CANDIDATES = 5
+
+WORD_PATTERN = re.compile(r"\w+(?:['’]\w+)*")
+
+
+def tokenize(text):
+    """Lowercased words with their (start, end) character offsets; whitespace and punctuation are ignored"""
+    return [(m.group().lower().replace("’", "'"), m.start(), m.end()) for m in WORD_PATTERN.finditer(text)]
+
+
+class QuoteMatch:
+    """The closest verbatim span found for a quote"""
+
+    def __init__(self, chunk_index, text, score):
+        self.chunk_index = chunk_index
+        self.text = text
+        self.score = score
+
+    def __repr__(self):
+        return f"QuoteMatch(chunk_index={self.chunk_index}, score={self.score:.3f}, text={self.text[:40]!r})"
+
+
+class QuoteAligner:
+    """Find the closest verbatim span for a quote across a set of chunks.
+
+    Chunks are tokenized into lowercased words (so whitespace, punctuation and curly quotes do not
+    matter) and indexed by word n-gram. A quote votes for (chunk, offset) diagonals through its own
+    n-grams; the best diagonals are then scored with a word-level SequenceMatcher and the matched
+    words are mapped back to the original characters of the chunk.
+    """
+
+    def __init__(self, chunk_texts, ngram_size=NGRAM_SIZE):
+        self.chunk_texts = list(chunk_texts)
+        self.ngram_size = ngram_size
+        self._tokens = [tokenize(text) for text in self.chunk_texts]
+        self._words = [[word for word, _, _ in tokens] for tokens in self._tokens]
+        self._index = defaultdict(list)
+        self._unigrams = defaultdict(list)
+        for chunk_index, words in enumerate(self._words):
+            for position, word in enumerate(words):
+                self._unigrams[word].append((chunk_index, position))
+            for position in range(len(words) - ngram_size + 1):
+                self._index[tuple(words[position:position + ngram_size])].append((chunk_index, position))
+
+    def align(self, quote):
+        """Return the best QuoteMatch for quote, or None if it shares no words with any chunk"""
+        quote_words = [word for word, _, _ in tokenize(quote)]
+        if not quote_words:
+            return None
+
+        # Vote for diagonals: chunk position minus quote position is constant along a verbatim run
+        votes = Counter()
+        if len(quote_words) >= self.ngram_size:
+            for q in range(len(quote_words) - self.ngram_size + 1):
+                for chunk_index, position in self._index.get(tuple(quote_words[q:q + self.ngram_size]), ()):
+                    votes[(chunk_index, position - q)] += 1
+        if not votes:
+            # Short or heavily paraphrased quotes fall back to single words
+            for q, word in enumerate(quote_words):
+                for chunk_index, position in self._unigrams.get(word, ()):
+                    votes[(chunk_index, position - q)] += 1
+        if not votes:
+            return None
+
+        best = None
+        for (chunk_index, offset), _ in votes.most_common(MAX_CANDIDATES):
+            match = self._score_candidate(quote_words, chunk_index, offset)
+            if match and (best is None or match.score > best.score):
+                best = match
+        return best
+
+    def _score_candidate(self, quote_words, chunk_index, offset):
+        """Score the chunk window around one diagonal and map the matched words back to chunk text"""
+        words = self._words[chunk_index]
+        slack = len(quote_words) // 4 + 2
+        window_start = max(0, offset - slack)
+        window_end = min(len(words), offset + len(quote_words) + slack)
+        matcher = SequenceMatcher(None, quote_words, words[window_start:window_end], autojunk=False)
+        blocks = [block for block in matcher.get_matching_blocks() if block.size]
+        if not blocks:
+            return None
+
+        first = window_start + blocks[0].b
+        last = window_start + blocks[-1].b + blocks[-1].size - 1
+        matched = sum(block.size for block in blocks)
+        score = 2.0 * matched / (len(quote_words) + last - first + 1)
+
+        tokens = self._tokens[chunk_index]
+        text = self.chunk_texts[chunk_index]
+        start, end = tokens[first][1], tokens[last][2]
+        # Keep punctuation attached to the first and last words (opening quotes, final full stop)
+        while start > 0 and not text[start - 1].isspace():
+            start -= 1
+        while end < len(text) and not text[end].isspace():
+            end += 1
+        return QuoteMatch(chunk_index, text[start:end], score)
@@ -0,0 +1,106 @@
+import os
+import re
+import uuid
+import queue
+import random
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Fraction of requests whose prompt/context payloads are logged, and how much of each payload
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.1"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+# Client-supplied request ids must look like this to be logged and echoed
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+payload_sampled_var = contextvars.ContextVar("payload_sampled", default=False)
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp each record with the current request's correlation id"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+def setup_logging(level=logging.INFO):
+    """Route all logging through a queue so file and console writes happen on a background thread"""
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter("%(asctime)s [%(levelname)s] [%(request_id)s] %(message)s")
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # The filter runs on the caller's thread, where the request context is still visible
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and stop the background writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def start_request(request_id=None):
+    """Give the current request a correlation id and decide whether its payloads are logged.
+
+    A supplied id (the client's X-Request-ID) is kept only if it is a short token; anything else,
+    such as CR/LF that would forge log lines or headers, is replaced by a generated id.
+    """
+    if not request_id or not REQUEST_ID_PATTERN.fullmatch(request_id):
+        request_id = uuid.uuid4().hex[:12]
+    request_id_var.set(request_id)
+    payload_sampled_var.set(random.random() < LOG_PAYLOAD_SAMPLE_RATE)
+    return request_id
+
+
+def in_request_context(func):
+    """Wrap func for a ThreadPoolExecutor so its log lines keep the calling request's id.
+
+    Pool threads do not inherit context variables (asyncio.to_thread already copies them); each call
+    runs in its own copy of the caller's context, so calls can run on several threads at once.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+
+def payload_logging_enabled():
+    """Whether the current request was sampled for payload logging"""
+    return payload_sampled_var.get()
+
+
+def log_payload(label, text, max_chars=LOG_PAYLOAD_MAX_CHARS):
+    """Log a large payload (prompt, context) for sampled requests only, truncated to max_chars"""
+    if not payload_sampled_var.get():
+        return
+    if len(text) > max_chars:
+        text = f"{text[:max_chars]}... [truncated {len(text) - max_chars} chars]"
+    logging.info(f"{label}:\n{text}")
@@ -0,0 +1,108 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# One connection pool is shared by every OpenAI client of the app (chat, embeddings, classifier fallback).
+# Pinecone's client runs on urllib3, so it keeps its own pool, sized to HTTP_MAX_KEEPALIVE_CONNECTIONS;
+# the GCS client keeps its default requests session
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "32"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "120"))
+
+
+class HttpPool:
+    """The sync and async httpx clients, with tuned limits, that the OpenAI clients are built on.
+
+    Only OpenAI traffic goes through it: Pinecone and GCS use other HTTP libraries with their own pools.
+    """
+
+    def __init__(self, max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS):
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                              keepalive_expiry=keepalive_expiry)
+        timeout = httpx.Timeout(HTTP_READ_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS)
+        self.client = httpx.Client(limits=limits, timeout=timeout)
+        self.async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    async def aclose(self):
+        self.client.close()
+        await self.async_client.aclose()
+
+
+class ServiceRegistry:
+    """Creates the app's services on first use instead of at import time.
+
+    register(name, factory) records how to build a service; get(name) builds it once (factories may
+    get() the services they depend on) and caches it. A failed build is remembered for status() and
+    retried on the next get(). aget() builds on a worker thread, since several services make network
+    calls in their constructors.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._services = {}
+        self._errors = {}
+        self._init_seconds = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+
+    def get(self, name):
+        service = self._services.get(name)
+        if service is not None:
+            return service
+        with self._lock:
+            if name not in self._services:
+                start = time.perf_counter()
+                try:
+                    self._services[name] = self._factories[name]()
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    logging.exception(f"Creating {name} failed")
+                    raise
+                self._errors.pop(name, None)
+                self._init_seconds[name] = time.perf_counter() - start
+                logging.info(f"Created {name} in {self._init_seconds[name]:.2f}s")
+            return self._services[name]
+
+    async def aget(self, name):
+        service = self._services.get(name)
+        if service is not None:
+            return service
+        return await asyncio.to_thread(self.get, name)
+
+    def peek(self, name):
+        """The service if it has been created, else None"""
+        return self._services.get(name)
+
+    async def warm_up(self, names=None):
+        """Create services in the background; failures are logged and left for status() and /ready"""
+        for name in names or list(self._factories):
+            try:
+                await self.aget(name)
+            except Exception:
+                pass
+
+    def status(self):
+        """Per service: "ready" (with its init time), "failed" (with the error) or "pending" """
+        report = {}
+        for name in self._factories:
+            if name in self._services:
+                report[name] = {"status": "ready", "init_seconds": round(self._init_seconds[name], 3)}
+            elif name in self._errors:
+                report[name] = {"status": "failed", "error": self._errors[name]}
+            else:
+                report[name] = {"status": "pending"}
+        return report
+
+    def ready(self):
+        return all(name in self._services for name in self._factories)
@@ -0,0 +1,224 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_CACHE_DIR = os.getenv("STORAGE_CACHE_DIR", "storage_cache")
+DEFAULT_CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Objects up to this total size are also kept in memory
+DEFAULT_MEMORY_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+# Bucket listings have no generation number, so they are reused for this long (or until this process writes)
+DEFAULT_LIST_TTL_SECONDS = float(os.getenv("STORAGE_CACHE_LIST_TTL_SECONDS", "60"))
+# Hits update last_access in memory; they are written to SQLite before evicting or once this many are pending
+ACCESS_FLUSH_ENTRIES = 1000
+
+
+class StorageCache:
+    """Read-through cache for GCS objects, keyed by object name and validated by generation number.
+
+    Object bytes live in files under cache_dir with an SQLite index (name, generation, size,
+    last_access); the least recently used files are evicted when they exceed max_bytes. Recently
+    read objects are also kept in an in-memory LRU capped at memory_max_bytes. Prefix listings are
+    cached for list_ttl seconds.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES,
+                 memory_max_bytes=DEFAULT_MEMORY_MAX_BYTES, list_ttl=DEFAULT_LIST_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.list_ttl = list_ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.list_hits = 0
+        self.list_misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # name -> (generation, data)
+        self._memory_bytes = 0
+        self._lists = {}  # prefix -> (time, names)
+        self._pending_access = {}  # name -> last access time not yet written
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS objects (
+                name TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_objects_last_access ON objects (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def get(self, name, generation):
+        """Return the cached bytes of an object if the cached copy has this generation, else None"""
+        with self._lock:
+            entry = self._memory.get(name)
+            if entry and entry[0] == generation:
+                self._memory.move_to_end(name)
+                data = entry[1]
+            else:
+                data = self._read_file(name, generation)
+                if data is not None:
+                    self._remember(name, generation, data)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += len(data)
+            self._pending_access[name] = time.time()
+            if len(self._pending_access) >= ACCESS_FLUSH_ENTRIES:
+                self._write_access()
+                self._conn.commit()
+            return data
+
+    def generation(self, name):
+        """Generation of the cached copy of an object, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT generation FROM objects WHERE name = ?", (name,)).fetchone()
+            return row[0] if row else None
+
+    def put(self, name, generation, data):
+        """Store the bytes of an object at a generation, replacing any older copy"""
+        with self._lock:
+            path = self._path(name)
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+            row = self._conn.execute("SELECT size FROM objects WHERE name = ?", (name,)).fetchone()
+            if row:
+                self._total_bytes -= row[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO objects (name, generation, size, last_access) VALUES (?, ?, ?, ?)",
+                (name, generation, len(data), time.time())
+            )
+            self._total_bytes += len(data)
+            self._pending_access.pop(name, None)
+            self._write_access()
+            self._evict()
+            self._conn.commit()
+            self._remember(name, generation, data)
+
+    def invalidate(self, name):
+        """Forget an object, e.g. after this process overwrote or deleted it"""
+        with self._lock:
+            self._forget_memory(name)
+            self._pending_access.pop(name, None)
+            row = self._conn.execute("SELECT size FROM objects WHERE name = ?", (name,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM objects WHERE name = ?", (name,))
+                self._conn.commit()
+                self._total_bytes -= row[0]
+                self._remove_file(name)
+            self._lists.clear()
+
+    def get_list(self, prefix):
+        """Cached object names under a prefix, or None when missing or older than list_ttl"""
+        with self._lock:
+            entry = self._lists.get(prefix)
+            if entry and time.time() - entry[0] < self.list_ttl:
+                self.list_hits += 1
+                return list(entry[1])
+            self.list_misses += 1
+            return None
+
+    def put_list(self, prefix, names):
+        with self._lock:
+            self._lists[prefix] = (time.time(), list(names))
+
+    def stats(self):
+        """Hit/miss counters, bytes served locally instead of downloaded, and current size"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+            lookups = self.hits + self.misses
+            list_lookups = self.list_hits + self.list_misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "list_hits": self.list_hits,
+                "list_misses": self.list_misses,
+                "list_hit_rate": self.list_hits / list_lookups if list_lookups else 0.0,
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "memory_bytes": self._memory_bytes
+            }
+
+    def close(self):
+        """Write pending access times and close the index"""
+        with self._lock:
+            self._write_access()
+            self._conn.commit()
+            self._conn.close()
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, hashlib.sha256(name.encode("utf-8")).hexdigest())
+
+    def _read_file(self, name, generation):
+        """Bytes of the disk copy if it has this generation (lock must be held)"""
+        row = self._conn.execute("SELECT generation FROM objects WHERE name = ?", (name,)).fetchone()
+        if not row or row[0] != generation:
+            return None
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except OSError:
+            logging.warning(f"Storage cache file for {name} is missing")
+            return None
+
+    def _remember(self, name, generation, data):
+        """Keep an object in the memory LRU if it fits (lock must be held)"""
+        self._forget_memory(name)
+        if len(data) > self.memory_max_bytes:
+            return
+        self._memory[name] = (generation, data)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _forget_memory(self, name):
+        entry = self._memory.pop(name, None)
+        if entry:
+            self._memory_bytes -= len(entry[1])
+
+    def _remove_file(self, name):
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+
+    def _write_access(self):
+        """Write the pending access times of cache hits (lock must be held; the caller commits)"""
+        if not self._pending_access:
+            return
+        self._conn.executemany(
+            "UPDATE objects SET last_access = ? WHERE name = ? AND last_access < ?",
+            [(now, name, now) for name, now in self._pending_access.items()]
+        )
+        self._pending_access = {}
+
+    def _evict(self):
+        """Drop least recently used files until the cache fits under max_bytes (lock must be held)"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        for name, size in self._conn.execute("SELECT name, size FROM objects ORDER BY last_access").fetchall():
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM objects WHERE name = ?", (name,))
+            self._remove_file(name)
+            self._forget_memory(name)
+            self._total_bytes -= size
+            evicted += 1
+        logging.info(f"Evicted {evicted} objects from the storage cache")
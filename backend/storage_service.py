@@ -11,51 +11,179 @@ if os.getenv("RAILWAY") == "true":
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = temp_path
 
 from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+from google.api_core.exceptions import NotFound
 import json
+import shutil
+import logging
+import processed_artifact
+from processed_artifact import ARTIFACT_SUFFIX, HEADER_READ_BYTES
 from datetime import datetime
 from dotenv import load_dotenv
+from metrics import traced
 
 # Load environment variables
 load_dotenv()
 
+# Originals are uploaded in resumable chunks of this size (a multiple of 256 KB)
+GCS_UPLOAD_CHUNK_BYTES = int(os.getenv("GCS_UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024)))
+# How long a failing chunk of an upload is retried before the upload gives up
+GCS_UPLOAD_RETRY_SECONDS = float(os.getenv("GCS_UPLOAD_RETRY_SECONDS", "300"))
+
 class StorageService:
-    def __init__(self, bucket_name):
+    def __init__(self, bucket_name, cache=None, client=None):
         self.bucket_name = bucket_name
-        self.client = storage.Client()
+        # client is a google.cloud.storage.Client, or a stand-in with the same calls (see fake_backends)
+        self.client = client or storage.Client()
         self.bucket = self.client.get_bucket(bucket_name)
+        # Optional StorageCache in front of object reads and listings
+        self.cache = cache
     
+    @traced("storage")
     def upload_file(self, content, filename):
-        """Upload original document"""
+        """Upload original document, given as bytes or as an open binary file (uploaded resumably)"""
         blob = self.bucket.blob(f"documents/{filename}")
-        blob.upload_from_string(content)
+        if isinstance(content, (bytes, str)):
+            blob.upload_from_string(content)
+        else:
+            self._upload_resumable(blob, content)
+        self._invalidate(f"documents/{filename}")
         return f"gs://{self.bucket_name}/documents/{filename}"
+
+    def _upload_resumable(self, blob, file_obj):
+        """Upload a file in GCS_UPLOAD_CHUNK_BYTES chunks through a resumable upload session"""
+        file_obj.seek(0)
+        # The blob writer sends each chunk under the retry policy; a failed chunk is resent from the
+        # offset GCS confirmed, not the whole file from byte 0
+        retry = DEFAULT_RETRY.with_deadline(GCS_UPLOAD_RETRY_SECONDS)
+        with blob.open("wb", chunk_size=GCS_UPLOAD_CHUNK_BYTES, content_type="application/octet-stream",
+                       retry=retry) as writer:
+            shutil.copyfileobj(file_obj, writer, GCS_UPLOAD_CHUNK_BYTES)
+        logging.info(f"Uploaded {blob.name} ({file_obj.tell()} bytes)")
     
+    @traced("storage")
     def store_processed_content(self, filename, processed_data):
-        """Store processed chunks and tags as JSON"""
-        json_blob = self.bucket.blob(f"processed/{filename}.json")
-        json_blob.upload_from_string(
-            json.dumps(processed_data, indent=2),
-            content_type="application/json"
-        )
-        return f"gs://{self.bucket_name}/processed/{filename}.json"
+        """Store processed chunks and tags as a compact binary artifact (see processed_artifact)"""
+        blob = self.bucket.blob(f"processed/{filename}{ARTIFACT_SUFFIX}")
+        blob.upload_from_string(processed_artifact.encode(processed_data), content_type="application/octet-stream")
+        # A JSON artifact from before the binary format would otherwise go stale
+        try:
+            self.bucket.blob(f"processed/{filename}.json").delete()
+        except NotFound:
+            pass
+        self._invalidate(f"processed/{filename}{ARTIFACT_SUFFIX}")
+        self._invalidate(f"processed/{filename}.json")
+        return f"gs://{self.bucket_name}/processed/{filename}{ARTIFACT_SUFFIX}"
     
     def list_documents(self):
         """List all original documents"""
-        blobs = self.client.list_blobs(self.bucket_name, prefix="documents/")
-        return [blob.name.replace("documents/", "") for blob in blobs]
+        return [name.replace("documents/", "") for name in self._list("documents/")]
     
     def list_processed(self):
         """List all processed documents"""
-        blobs = self.client.list_blobs(self.bucket_name, prefix="processed/")
-        return [blob.name.replace("processed/", "").replace(".json", "") for blob in blobs]
+        names = []
+        for name in self._list("processed/"):
+            name = name.replace("processed/", "")
+            for suffix in (ARTIFACT_SUFFIX, ".json"):
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+            if name not in names:
+                names.append(name)
+        return names
     
     def get_document(self, filename):
         """Get original document"""
-        blob = self.bucket.blob(f"documents/{filename}")
-        return blob.download_as_bytes()
+        return self._download(f"documents/{filename}")
     
     def get_processed(self, filename):
-        """Get processed chunks and tags"""
-        blob = self.bucket.blob(f"processed/{filename}.json")
-        content = blob.download_as_string()
-        return json.loads(content)
\ No newline at end of file
+        """Get processed chunks and tags (embeddings, when stored, come back as float32 arrays)"""
+        try:
+            data = self._download(f"processed/{filename}{ARTIFACT_SUFFIX}")
+        except NotFound:
+            # Artifacts written before the binary format
+            content = self._download(f"processed/{filename}.json")
+            return json.loads(content)
+        return processed_artifact.decode(data)
+
+    def get_processed_header(self, filename):
+        """Get the document fields, tag summary and chunk index without downloading the chunks"""
+        name = f"processed/{filename}{ARTIFACT_SUFFIX}"
+        try:
+            data = self._download(name, start=0, end=HEADER_READ_BYTES - 1)
+        except NotFound:
+            return processed_artifact.header_from_processed(self.get_processed(filename))
+        end = processed_artifact.header_end(data)
+        if end > len(data):
+            data += self._download(name, start=len(data), end=end - 1)
+        return processed_artifact.decode_header(data)
+
+    def get_tag_summary(self, filename):
+        """Number of chunks per tag for a processed document"""
+        return self.get_processed_header(filename)["tag_summary"]
+
+    def get_processed_chunk(self, filename, chunk_id, header=None):
+        """Get a single processed chunk with one ranged download, or None if there is no such chunk"""
+        header = header or self.get_processed_header(filename)
+        entry = next((entry for entry in header["chunks"] if entry["chunk_id"] == chunk_id), None)
+        if entry is None:
+            return None
+        if "offset" not in entry:
+            # Old JSON artifacts can only be read whole
+            return next(chunk for chunk in self.get_processed(filename)["chunks"] if chunk.get("chunk_id") == chunk_id)
+        record = self._download(f"processed/{filename}{ARTIFACT_SUFFIX}",
+                                start=entry["offset"], end=entry["offset"] + entry["size"] - 1)
+        return processed_artifact.decode_chunk(entry, record)
+
+    def get_processed_if_exists(self, filename):
+        """Get processed chunks and tags, or None if the file was never processed"""
+        try:
+            return self.get_processed(filename)
+        except NotFound:
+            return None
+
+    def warm_cache(self, prefixes=("processed/",)):
+        """Download objects under the given prefixes whose cached copy is missing or stale"""
+        if self.cache is None:
+            return 0
+        warmed = 0
+        for prefix in prefixes:
+            blobs = list(self.client.list_blobs(self.bucket_name, prefix=prefix))
+            self.cache.put_list(prefix, [blob.name for blob in blobs])
+            for blob in blobs:
+                if self.cache.generation(blob.name) != blob.generation:
+                    self.cache.put(blob.name, blob.generation, blob.download_as_bytes(if_generation_match=blob.generation))
+                    warmed += 1
+        logging.info(f"Warmed storage cache with {warmed} objects")
+        return warmed
+
+    def _download(self, name, start=None, end=None):
+        """Download an object (or the byte range [start, end]); served locally when the cached generation is current.
+
+        A ranged read of an object that is not cached goes straight to GCS and is not cached, so lazy
+        artifact reads stay cheap; whole-object reads fill the cache.
+        """
+        if self.cache is None or (start is not None and self.cache.generation(name) is None):
+            return self.bucket.blob(name).download_as_bytes(start=start, end=end)
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            raise NotFound(name)
+        data = self.cache.get(name, blob.generation)
+        if data is None:
+            if start is not None:
+                return blob.download_as_bytes(start=start, end=end, if_generation_match=blob.generation)
+            data = blob.download_as_bytes(if_generation_match=blob.generation)
+            self.cache.put(name, blob.generation, data)
+        return data if start is None else data[start:end + 1]
+
+    def _list(self, prefix):
+        """Object names under a prefix, from the cache while its listing is fresh"""
+        names = self.cache.get_list(prefix) if self.cache is not None else None
+        if names is None:
+            names = [blob.name for blob in self.client.list_blobs(self.bucket_name, prefix=prefix)]
+            if self.cache is not None:
+                self.cache.put_list(prefix, names)
+        return names
+
+    def _invalidate(self, name):
+        if self.cache is not None:
+            self.cache.invalidate(name)
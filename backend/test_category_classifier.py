@@ -0,0 +1,134 @@
+import asyncio
+import json
+import types
+
+import numpy as np
+
+from category_classifier import CategoryClassifier, CATEGORY_ANALYSIS_PROMPT
+from openai_service import VALID_COMPETENCIES
+
+
+class OneHotEmbeddingService:
+    """Embeds each competency description as its own axis"""
+
+    def embed_texts(self, texts):
+        return [np.eye(len(VALID_COMPETENCIES))[VALID_COMPETENCIES.index(text.split(":")[0])].tolist()
+                for text in texts]
+
+    async def embed_texts_async(self, texts):
+        return self.embed_texts(texts)
+
+
+class FakeCompletions:
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+
+    async def create(self, model, messages):
+        self.calls.append(messages)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=self.reply))])
+
+
+def make_classifier(reply='["Vision"]', **kwargs):
+    completions = FakeCompletions(reply)
+    llm_client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    classifier = CategoryClassifier(OneHotEmbeddingService(), llm_client=llm_client, prototypes_path=None, **kwargs)
+    return classifier, completions
+
+
+def query_vector(weights):
+    vector = np.zeros(len(VALID_COMPETENCIES))
+    for name, weight in weights.items():
+        vector[VALID_COMPETENCIES.index(name)] = weight
+    return vector.tolist()
+
+
+def test_top_three_competencies_come_from_the_prototypes():
+    classifier, completions = make_classifier()
+    query = query_vector({"Planning": 0.9, "Vision": 0.7, "Organize": 0.5, "Control": 0.1})
+
+    categories, confidence = classifier.classify(query)
+    assert categories == ["Planning", "Vision", "Organize"]
+    assert confidence > 0.5
+    assert asyncio.run(classifier.classify_async("How do I plan?", query)) == categories
+    assert completions.calls == [] and classifier.llm_calls == 0
+
+
+def test_low_confidence_falls_back_to_the_llm():
+    classifier, completions = make_classifier(reply='Sure! ["Vision", "Bogus", "Leadership"]')
+    # Every competency scores the same, so top - median is zero
+    query = [1.0] * len(VALID_COMPETENCIES)
+
+    assert classifier.classify(query)[1] == 0.0
+    assert asyncio.run(classifier.classify_async("Anything?", query)) == ["Vision", "Leadership"]
+    assert classifier.llm_calls == 1
+    assert completions.calls[0][0]["content"] == CATEGORY_ANALYSIS_PROMPT
+
+
+def test_unusable_llm_reply_keeps_the_local_categories():
+    classifier, _ = make_classifier(reply="I am not sure.")
+    query = [1.0] * len(VALID_COMPETENCIES)
+    local, _ = classifier.classify(query)
+    assert asyncio.run(classifier.classify_async("Anything?", query)) == local
+
+    classifier, completions = make_classifier(llm_fallback=False)
+    assert asyncio.run(classifier.classify_async("Anything?", query)) == local
+    assert completions.calls == []
+
+
+def test_parse_categories_handles_non_json_and_partial_replies():
+    classifier, _ = make_classifier()
+    assert classifier._parse_categories('["Vision", "Planning"]') == ["Vision", "Planning"]
+    assert classifier._parse_categories('Categories: ["Vision", "vision", 3, "Control"] hope that helps') == [
+        "Vision", "Control"]
+    assert classifier._parse_categories("Vision, Planning") == []
+    assert classifier._parse_categories('["Vision", "Plan') == []
+    assert classifier._parse_categories('["Vision" "Planning"]') == []
+    # A reply cut off after a complete array still yields it
+    assert classifier._parse_categories('{"categories": ["Vision"]') == ["Vision"]
+
+
+def test_tagged_chunks_pull_prototypes_and_are_saved_on_flush(tmp_path):
+    path = str(tmp_path / "prototypes.npz")
+    classifier = CategoryClassifier(OneHotEmbeddingService(), prototypes_path=path, save_seconds=3600)
+    # A chunk about control, tagged Vision, moves the Vision prototype towards the Control axis
+    classifier.add_tagged_chunks([{"embedding": query_vector({"Control": 1.0}), "tags": ["Vision"]}])
+    categories, _ = classifier.classify(query_vector({"Control": 1.0}))
+    assert categories[:2] == ["Control", "Vision"]
+
+    assert not (tmp_path / "prototypes.npz").exists()
+    classifier.flush()
+    reloaded = CategoryClassifier(OneHotEmbeddingService(), prototypes_path=path)
+    assert json.dumps(reloaded._example_counts.tolist()) == json.dumps(classifier._example_counts.tolist())
+    assert reloaded.classify(query_vector({"Control": 1.0}))[0][:2] == ["Control", "Vision"]
+
+
+def test_removed_chunks_come_back_out_of_the_prototypes():
+    classifier, _ = make_classifier()
+    control_chunk = {"embedding": query_vector({"Control": 1.0}), "tags": ["Vision", "Planning"]}
+    classifier.add_tagged_chunks([control_chunk])
+    assert classifier.classify(query_vector({"Control": 1.0}))[0][0] == "Control"
+    assert classifier._example_counts[VALID_COMPETENCIES.index("Planning")] == 0.5
+
+    classifier.remove_tagged_chunks([control_chunk])
+    assert not classifier._example_counts.any() and not classifier._example_sums.any()
+    # Back to the descriptions alone: Control ranks first and the rest tie at zero
+    assert classifier.score(query_vector({"Control": 1.0}))[VALID_COMPETENCIES.index("Vision")] == 0.0
+
+
+def test_missing_prototypes_are_backfilled_from_processed_documents(tmp_path):
+    path = str(tmp_path / "prototypes.npz")
+    processed = {
+        "a.pdf": {"chunks": [{"embedding": np.array(query_vector({"Control": 1.0}), dtype=np.float32),
+                              "tags": ["Vision"]}]},
+        "old.pdf": {"chunks": [{"tags": ["Planning"]}]},
+    }
+    storage = types.SimpleNamespace(list_processed=lambda: list(processed), get_processed=processed.get)
+
+    classifier = CategoryClassifier(OneHotEmbeddingService(), prototypes_path=path, save_seconds=3600)
+    assert classifier.needs_backfill
+    classifier.backfill(storage)
+    assert not classifier.needs_backfill
+    assert classifier.classify(query_vector({"Control": 1.0}))[0][:2] == ["Control", "Vision"]
+    # Saved right away, so the next start loads them instead of backfilling again
+    assert not CategoryClassifier(OneHotEmbeddingService(), prototypes_path=path).needs_backfill
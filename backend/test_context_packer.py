@@ -0,0 +1,42 @@
+import types
+
+from context_packer import ContextPacker
+from embedding_service import estimate_tokens
+from query_pipeline import QueryPipeline
+
+FILLER = "Unrelated administrative detail about the course schedule and room bookings. "
+
+
+def _match(chunk_id, text):
+    return {"id": chunk_id, "score": 0.9, "metadata": {
+        "chunkText": text, "chunkId": chunk_id, "filename": f"{chunk_id}.pdf", "tags": ["Vision"]
+    }}
+
+
+def test_drops_near_duplicates_and_stays_within_budget():
+    page = "Vision guides the venture through uncertainty. " + FILLER * 60
+    matches = [_match("a", page), _match("b", page + " Page 2"), _match("c", "Growth mindset matters. " + FILLER * 60)]
+    context, report = ContextPacker(token_budget=400).pack("Vision", matches)
+
+    assert report["duplicates_dropped"] == 1
+    assert report["chunks_trimmed"] == 2
+    assert estimate_tokens(context) <= 400
+    assert report["context_tokens_packed"] < report["context_tokens_full"]
+    assert "Vision guides the venture through uncertainty." in context
+    assert "Chunk ID: b" not in context
+
+
+def test_trim_keeps_relevant_sentences_in_document_order():
+    text = FILLER * 5 + "A clear vision aligns the team. " + FILLER * 5 + "Vision statements should be short."
+    trimmed = ContextPacker().trim(text, {"vision"}, 20)
+
+    assert trimmed == "A clear vision aligns the team. ... Vision statements should be short."
+
+
+def test_context_is_sent_once():
+    pipeline = QueryPipeline(types.SimpleNamespace(), None, None, None)
+    messages = pipeline.build_messages("Vision", [_match("a", "Vision guides the venture.")])
+
+    assert sum("Vision guides the venture." in message["content"] for message in messages) == 1
+    assert messages[-1]["role"] == "user"
+    assert "Vision guides the venture." in messages[-1]["content"]
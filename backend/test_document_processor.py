@@ -0,0 +1,72 @@
+import asyncio
+import io
+
+import docx
+
+from benchmark_pipeline import make_pdf
+from document_processor import DocumentProcessor, _extract_pdf_page_range
+
+PAGES = [f"Page number {i} of the handbook." for i in range(12)]
+
+
+class RecordingExecutor:
+    """Passes work on to the process pool, recording the page range of each extraction task"""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.ranges = []
+
+    def submit(self, func, *args):
+        if func is _extract_pdf_page_range:
+            self.ranges.append(args[1:])
+        return self.executor.submit(func, *args)
+
+
+def make_processor():
+    processor = DocumentProcessor(max_workers=2, pages_per_task=5, stream_pages_per_task=3, openai_service=object())
+    recorder = RecordingExecutor(processor._get_executor())
+    processor._get_executor = lambda: recorder
+    return processor, recorder
+
+
+def test_pdf_pages_are_split_into_ranges_and_merged_in_order(tmp_path):
+    data = make_pdf(PAGES)
+    processor, recorder = make_processor()
+    try:
+        pages, filetype = asyncio.run(processor.extract_content_async("handbook.pdf", data))
+        assert filetype == "text"
+        assert recorder.ranges == [(0, 5), (5, 10), (10, 15)]
+
+        path = tmp_path / "handbook.pdf"
+        path.write_bytes(data)
+        recorder.ranges = []
+
+        async def stream():
+            return [page async for page in processor.iter_pdf_pages(str(path))]
+
+        streamed = asyncio.run(stream())
+        assert recorder.ranges == [(0, 3), (3, 6), (6, 9), (9, 12)]
+    finally:
+        processor.shutdown()
+
+    for extracted in (pages, streamed):
+        assert len(extracted) == len(PAGES)
+        assert all(expected in page for expected, page in zip(PAGES, extracted))
+
+
+def test_text_and_docx_pass_through_as_one_text(tmp_path):
+    document = docx.Document()
+    document.add_paragraph("First paragraph.")
+    document.add_paragraph("Second paragraph.")
+    buffer = io.BytesIO()
+    document.save(buffer)
+
+    processor, recorder = make_processor()
+    try:
+        assert asyncio.run(processor.extract_content_async("notes.txt", "Plain notes ✓".encode("utf-8"))) == (
+            "Plain notes ✓", "text")
+        assert asyncio.run(processor.extract_content_async("notes.docx", buffer.getvalue())) == (
+            "First paragraph.\nSecond paragraph.", "text")
+    finally:
+        processor.shutdown()
+    assert recorder.ranges == []
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import types
+
+from openai_service import OpenAIService, content_hash
+
+
+class FakeCompletions:
+    """Tags each page after a delay; earlier pages take longer, so replies arrive out of order"""
+
+    def __init__(self, pages):
+        self.delays = {page: 0.01 * (len(pages) - i) for i, page in enumerate(pages)}
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = []
+
+    async def create(self, model, messages, **kwargs):
+        page = messages[1]["content"].split("\n\n", 1)[1].split("...")[0]
+        self.calls.append(page)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays.get(page, 0.01))
+            if page == "Page broken":
+                raise ConnectionError("connection reset")
+            content = json.dumps({"summary": f"About {page}", "tags": ["Vision"]})
+            return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+        finally:
+            self.in_flight -= 1
+
+
+def make_service(pages, max_concurrency=3):
+    completions = FakeCompletions(pages)
+    service = object.__new__(OpenAIService)
+    service.max_concurrency = max_concurrency
+    service.async_client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    return service, completions
+
+
+async def stream(pages):
+    for page in pages:
+        await asyncio.sleep(0)
+        yield page
+
+
+def test_chunks_come_back_in_page_order_when_replies_do_not():
+    pages = [f"Page {i}" for i in range(10)]
+    service, completions = make_service(pages)
+    ready = []
+
+    chunks, _ = asyncio.run(service.process_document_async(pages, "doc.pdf", on_chunk=lambda c: ready.append(c["text"])))
+    assert [chunk["text"] for chunk in chunks] == pages
+    assert [chunk["chunk_index"] for chunk in chunks] == list(range(10))
+    assert [chunk["chunk_id"] for chunk in chunks] == [f"doc.pdf_page{i + 1}" for i in range(10)]
+    assert chunks[4]["summary"] == "About Page 4"
+    # on_chunk saw them as they finished, not in page order
+    assert ready != pages and sorted(ready) == sorted(pages)
+
+    streamed, _ = asyncio.run(make_service(pages)[0].process_document_async(stream(pages), "doc.pdf"))
+    assert [chunk["text"] for chunk in streamed] == pages
+
+
+def test_in_flight_calls_are_capped():
+    pages = [f"Page {i}" for i in range(12)]
+    service, completions = make_service(pages, max_concurrency=3)
+    asyncio.run(service.process_document_async(stream(pages), "doc.pdf"))
+    assert completions.peak == 3 and len(completions.calls) == 12
+
+    # A semaphore shared by several documents caps them together
+    service, completions = make_service(pages, max_concurrency=8)
+
+    async def two_documents():
+        shared = asyncio.Semaphore(2)
+        await asyncio.gather(service.process_document_async(pages[:6], "a.pdf", semaphore=shared),
+                             service.process_document_async(pages[6:], "b.pdf", semaphore=shared))
+
+    asyncio.run(two_documents())
+    assert completions.peak == 2
+
+
+def test_previous_chunks_are_reused_by_content_hash_without_a_call():
+    pages = ["Page new", "Page kept"]
+    service, completions = make_service(pages)
+    previous = {"doc.pdf_page1": {"text": "Page kept", "summary": "Old summary", "tags": ["Planning"],
+                                  "chunk_id": "doc.pdf_page1", "chunk_index": 0,
+                                  "content_hash": content_hash("Page kept"), "embedding": [1.0, 0.0]}}
+
+    chunks, _ = asyncio.run(service.process_document_async(pages, "doc.pdf", previous_chunks=previous))
+    assert completions.calls == ["Page new"]
+    assert chunks[1]["summary"] == "Old summary" and chunks[1]["tags"] == ["Planning"]
+    assert chunks[1]["chunk_id"] == "doc.pdf_page2" and chunks[1]["chunk_index"] == 1
+    assert chunks[1]["embedding"] == [1.0, 0.0]
+    # The previous chunk itself is left as it was
+    assert previous["doc.pdf_page1"]["chunk_id"] == "doc.pdf_page1"
+
+
+def test_a_failed_page_does_not_fail_the_others():
+    pages = ["Page 0", "Page broken", "Page 2"]
+    service, _ = make_service(pages)
+
+    chunks, _ = asyncio.run(service.process_document_async(stream(pages), "doc.pdf"))
+    assert [chunk["text"] for chunk in chunks] == pages
+    assert [chunk["tags"] for chunk in chunks] == [["Vision"], [], ["Vision"]]
+    assert chunks[1]["summary"] == "" and chunks[1]["content_hash"] is None
+    assert chunks[2]["summary"] == "About Page 2"
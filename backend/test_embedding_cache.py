@@ -0,0 +1,65 @@
+import sqlite3
+
+from embedding_cache import EmbeddingCache, text_hash
+
+# Four float32 values per vector
+VECTOR_BYTES = 16
+
+
+def vector(value):
+    return [value, 0.0, 0.0, 0.0]
+
+
+def test_hits_and_misses_are_counted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    cache.put_many("model-a", ["one", "two"], [vector(1.0), vector(2.0)])
+
+    assert cache.get_many("model-a", ["one", "three", "two", "one"]) == [vector(1.0), None, vector(2.0), vector(1.0)]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+    assert stats["hit_rate"] == 0.75
+    assert stats["entries"] == 2 and stats["bytes"] == 2 * VECTOR_BYTES
+
+
+def test_entries_are_keyed_by_model_and_text_hash(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(path)
+    cache.put("model-a", "same text", vector(1.0))
+    cache.put("model-b", "same text", vector(2.0))
+    cache.put("model-a", "same text", vector(3.0))
+
+    assert cache.get("model-a", "same text") == vector(3.0)
+    assert cache.get("model-b", "same text") == vector(2.0)
+    assert cache.get("model-c", "same text") is None
+    assert cache.stats()["bytes"] == 2 * VECTOR_BYTES
+    cache.close()
+
+    keys = sqlite3.connect(path).execute("SELECT model, text_hash FROM embeddings ORDER BY model").fetchall()
+    assert keys == [("model-a", text_hash("same text")), ("model-b", text_hash("same text"))]
+
+
+def test_least_recently_used_entries_are_evicted_over_the_byte_cap(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(path, max_bytes=3 * VECTOR_BYTES)
+    for i, text in enumerate(["a", "b", "c"]):
+        cache.put("model", text, vector(float(i)))
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("model", "a") == vector(0.0)
+    cache.put("model", "d", vector(3.0))
+
+    assert cache.get_many("model", ["a", "b", "c", "d"]) == [vector(0.0), None, vector(2.0), vector(3.0)]
+    assert cache.stats()["bytes"] == 3 * VECTOR_BYTES
+
+
+def test_hits_do_not_write_until_the_next_put(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(path)
+    cache.put("model", "a", vector(1.0))
+    reader = sqlite3.connect(path)
+    before = reader.execute("SELECT last_access FROM embeddings").fetchone()[0]
+
+    cache.get("model", "a")
+    assert reader.execute("SELECT last_access FROM embeddings").fetchone()[0] == before
+    cache.put("model", "b", vector(2.0))
+    assert reader.execute("SELECT last_access FROM embeddings WHERE text_hash = ?",
+                          (text_hash("a"),)).fetchone()[0] > before
@@ -0,0 +1,72 @@
+import asyncio
+import types
+
+from embedding_cache import EmbeddingCache
+from embedding_service import EmbeddingService, estimate_tokens
+
+
+class FakeEmbeddings:
+    """Embeds text as [len(text), call number] and returns the items in reverse order, like an unordered API reply"""
+
+    def __init__(self):
+        self.requests = []
+
+    def create(self, input, model):
+        self.requests.append(list(input))
+        data = [types.SimpleNamespace(index=i, embedding=[float(len(text)), float(len(self.requests))])
+                for i, text in enumerate(input)]
+        return types.SimpleNamespace(data=list(reversed(data)))
+
+
+class AsyncFakeEmbeddings(FakeEmbeddings):
+    async def create(self, input, model):
+        await asyncio.sleep(0.001 * (3 - len(self.requests) % 3))
+        return super().create(input, model)
+
+
+def make_service(embeddings, **kwargs):
+    client = types.SimpleNamespace(embeddings=embeddings)
+    if isinstance(embeddings, AsyncFakeEmbeddings):
+        return EmbeddingService(None, client, **kwargs)
+    return EmbeddingService(client, **kwargs)
+
+
+def test_batches_respect_the_input_and_token_limits():
+    service = make_service(FakeEmbeddings(), max_batch_inputs=3, max_batch_tokens=10)
+    texts = ["a" * 8] * 5 + ["b" * 60, "c" * 4]
+    # 3 tokens each for the short texts, 16 for the long one, which goes into a batch of its own
+    assert [estimate_tokens(text) for text in texts] == [3, 3, 3, 3, 3, 16, 2]
+    assert service._make_batches(texts) == [[0, 1, 2], [3, 4], [5], [6]]
+
+
+def test_results_keep_input_order_across_batches():
+    embeddings = FakeEmbeddings()
+    service = make_service(embeddings, max_batch_inputs=2, max_concurrent_batches=3)
+    texts = ["x", "yy", "zzz", "yy", "wwww", ""]
+
+    result = service.embed_texts(texts)
+    assert [embedding[0] for embedding in result] == [1.0, 2.0, 3.0, 2.0, 4.0, 1.0]
+    # The duplicate is sent once, and the empty text is sent as a single space
+    assert sorted(text for request in embeddings.requests for text in request) == [" ", "wwww", "x", "yy", "zzz"]
+    assert len(embeddings.requests) == 3
+
+
+def test_async_chunk_embeddings_map_to_their_chunk_ids():
+    embeddings = AsyncFakeEmbeddings()
+    service = make_service(embeddings, max_batch_inputs=2)
+    chunks = [{"chunk_id": f"doc.pdf_page{i}", "text": "t" * i} for i in range(1, 6)]
+
+    result = asyncio.run(service.embed_chunks_async(chunks))
+    assert {chunk_id: embedding[0] for chunk_id, embedding in result.items()} == {
+        f"doc.pdf_page{i}": float(i) for i in range(1, 6)}
+    assert len(embeddings.requests) == 3
+
+
+def test_cached_texts_are_not_sent_again(tmp_path):
+    embeddings = FakeEmbeddings()
+    service = make_service(embeddings, cache=EmbeddingCache(str(tmp_path / "cache.db")))
+    first = service.embed_texts(["one", "two"])
+    second = service.embed_texts(["two", "three", "one"])
+
+    assert embeddings.requests == [["one", "two"], ["three"]]
+    assert second == [first[1], [5.0, 2.0], first[0]]
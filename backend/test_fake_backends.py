@@ -0,0 +1,56 @@
+import asyncio
+import io
+import json
+
+from benchmark_pipeline import make_pdf
+from document_processor import _count_pdf_pages, _extract_pdf_page_range
+from fake_backends import FakeLatency, FakeOpenAI, FakePinecone, FakeGCSClient, PARAPHRASED_QUOTE
+from llm_scheduler import LLMScheduler, ScheduledClient
+from pinecone_service import PineconeService
+from query_pipeline import LESSON_PLAN_SYSTEM_PROMPT
+from storage_service import StorageService
+
+
+def test_fake_openai_failures_are_retried_and_counted():
+    fake = FakeOpenAI(FakeLatency(failure_rate=0.5, seed=3), paraphrased_quote_rate=0.0)
+    client = ScheduledClient(fake, LLMScheduler(rate_limits={}, backoff_base=0.001, max_retries=20), is_async=True)
+    prompt = "Context:\n--- CHUNK 1 ---\nContent: Plan the week on Monday. Then review it on Friday.\n"
+
+    async def main():
+        analysis = await client.chat.completions.create(
+            model="gpt-4o", messages=[{"role": "user", "content": "Some page"}], response_format={"type": "json_object"}
+        )
+        plan = await client.chat.completions.create(model="gpt-4o", messages=[
+            {"role": "system", "content": LESSON_PLAN_SYSTEM_PROMPT}, {"role": "user", "content": prompt}
+        ])
+        return json.loads(analysis.choices[0].message.content), json.loads(plan.choices[0].message.content)
+
+    analysis, plan = asyncio.run(main())
+    assert analysis["tags"] and analysis["summary"]
+    assert plan["extracts"][0]["content"] == "Plan the week on Monday."
+    assert PARAPHRASED_QUOTE not in json.dumps(plan)
+    stats = fake.stats()["gpt-4o"]
+    assert stats["calls"] == 2 and stats["failures"] > 0 and stats["prompt_tokens"] > 0
+
+
+def test_services_run_against_fake_pinecone_and_gcs():
+    vector_service = PineconeService(pc=FakePinecone())
+    vector_service.upsert_chunks("a.pdf", [
+        {"chunk_id": "a1", "text": "one", "tags": ["Vision"], "embedding": [1.0, 0.0]},
+        {"chunk_id": "a2", "text": "two", "tags": ["Planning"], "embedding": [0.0, 1.0]},
+    ])
+    matches = vector_service.query([0.0, 1.0], top_k=5, filter_categories=["Vision"])
+    assert [match["id"] for match in matches] == ["a1"]
+
+    storage = StorageService("bucket", client=FakeGCSClient())
+    storage.upload_file(io.BytesIO(b"x" * 1000), "a.pdf")
+    storage.store_processed_content("a.pdf", {"filename": "a.pdf", "chunks": [{"chunk_id": "a1", "tags": ["Vision"]}]})
+    assert storage.get_document("a.pdf") == b"x" * 1000
+    assert storage.get_tag_summary("a.pdf") == {"Vision": 1}
+    assert storage.list_documents() == ["a.pdf"]
+
+
+def test_generated_pdfs_are_readable():
+    data = make_pdf(["First page (with parentheses).", "Second page."])
+    assert _count_pdf_pages(data) == 2
+    assert "Second page." in _extract_pdf_page_range(data, 0, 2)[1]
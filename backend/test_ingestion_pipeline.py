@@ -0,0 +1,243 @@
+import asyncio
+import os
+import tempfile
+import time
+import types
+
+import pytest
+
+from ingestion_pipeline import IngestionPipeline
+from job_queue import Job
+from openai_service import OpenAIService, content_hash
+
+PAGES = 40
+
+
+class FakeDocumentProcessor:
+    def __init__(self, events):
+        self.events = events
+
+    async def count_pdf_pages_async(self, path):
+        return PAGES
+
+    async def iter_pdf_pages(self, path, page_count):
+        for i in range(page_count):
+            await asyncio.sleep(0.005)
+            self.events.append(("parsed", i))
+            yield f"Text of page {i}"
+
+
+class FakeOpenAIService(OpenAIService):
+    def __init__(self):
+        self.max_concurrency = 4
+        self.async_client = None
+
+    async def _process_unit_async(self, client, text, context, chunk_id, description):
+        await asyncio.sleep(0.01)
+        return {"text": text, "summary": "", "context": context, "chunk_id": chunk_id, "tags": ["Vision"],
+                "content_hash": str(hash(text))}
+
+
+class FakeEmbeddingService:
+    def __init__(self, events):
+        self.events = events
+
+    async def embed_chunks_async(self, chunks):
+        self.events.append(("embedded", len(chunks)))
+        return {chunk["chunk_id"]: [1.0, 0.0] for chunk in chunks}
+
+
+class FakeStorage:
+    def get_processed_if_exists(self, filename):
+        return None
+
+    def upload_file(self, content, filename):
+        return f"gs://bucket/documents/{filename}"
+
+    def store_processed_content(self, filename, processed_data):
+        self.processed_data = processed_data
+
+
+def test_pages_are_embedded_while_later_pages_are_still_parsing():
+    events = []
+    vector_service = types.SimpleNamespace(upserted=[])
+    vector_service.upsert_chunks = lambda filename, chunks: vector_service.upserted.extend(chunks)
+    classifier = types.SimpleNamespace(add_tagged_chunks=lambda chunks: None)
+    storage = FakeStorage()
+    pipeline = IngestionPipeline(FakeDocumentProcessor(events), FakeOpenAIService(), storage, vector_service,
+                                 FakeEmbeddingService(events), classifier, batch_size=8, linger_seconds=0.05)
+
+    path = os.path.join(tempfile.mkdtemp(), "upload")
+    with open(path, "wb") as f:
+        f.write(b"%PDF")
+    job = Job("doc.pdf", path)
+    result = asyncio.run(pipeline.run(job))
+
+    first_embedding = events.index(next(event for event in events if event[0] == "embedded"))
+    last_parse = events.index(("parsed", PAGES - 1))
+    assert first_embedding < last_parse
+    assert result["chunks_processed"] == PAGES
+    assert [chunk["chunk_index"] for chunk in vector_service.upserted] == list(range(PAGES))
+    assert [chunk["chunk_id"] for chunk in storage.processed_data["chunks"]] == [f"doc.pdf_page{i + 1}" for i in range(PAGES)]
+    assert job.progress["pages_extracted"] == job.progress["chunks_upserted"] == PAGES
+
+
+class FailingDocumentProcessor(FakeDocumentProcessor):
+    async def iter_pdf_pages(self, path, page_count):
+        if path.endswith("broken"):
+            raise ValueError("corrupt PDF")
+        async for page_text in super().iter_pdf_pages(path, 3):
+            yield page_text
+
+
+def test_batch_shares_embedding_requests_and_isolates_failures():
+    events = []
+    vector_service = types.SimpleNamespace(upserts=[], labels=[])
+
+    def upsert_chunks(filename, chunks):
+        vector_service.labels.append(filename)
+        vector_service.upserts.append(chunks)
+
+    vector_service.upsert_chunks = upsert_chunks
+    classifier = types.SimpleNamespace(add_tagged_chunks=lambda chunks: None)
+    pipeline = IngestionPipeline(FailingDocumentProcessor(events), FakeOpenAIService(), FakeStorage(),
+                                 vector_service, FakeEmbeddingService(events), classifier,
+                                 batch_size=32, linger_seconds=0.2)
+
+    directory = tempfile.mkdtemp()
+    jobs = []
+    for name in ("a", "b", "c", "broken"):
+        path = os.path.join(directory, name)
+        with open(path, "wb") as f:
+            f.write(b"%PDF")
+        jobs.append(Job(f"{name}.pdf", path))
+    results = asyncio.run(pipeline.run_batch(jobs))
+
+    assert [result["chunks_processed"] for result in results[:3]] == [3, 3, 3]
+    assert isinstance(results[3], ValueError)
+    # Nine pages of three documents, embedded and upserted together
+    assert [event for event in events if event[0] == "embedded"] == [("embedded", 9)]
+    assert len(vector_service.upserts) == 1
+    assert {chunk["filename"] for chunk in vector_service.upserts[0]} == {"a.pdf", "b.pdf", "c.pdf"}
+    assert vector_service.labels == ["3 documents"]
+
+
+class PagesDocumentProcessor:
+    def __init__(self):
+        self.pages = []
+
+    async def count_pdf_pages_async(self, path):
+        return len(self.pages)
+
+    async def iter_pdf_pages(self, path, page_count):
+        for page in self.pages:
+            yield page
+
+
+class CountingOpenAIService(FakeOpenAIService):
+    def __init__(self):
+        super().__init__()
+        self.tagged = []
+
+    async def _process_unit_async(self, client, text, context, chunk_id, description):
+        self.tagged.append(text)
+        return {"text": text, "summary": f"About {text}", "context": context, "chunk_id": chunk_id,
+                "tags": ["Vision"], "content_hash": content_hash(text)}
+
+
+class StoringStorage(FakeStorage):
+    processed_data = None
+
+    def get_processed_if_exists(self, filename):
+        return self.processed_data
+
+
+def test_reingesting_an_edited_document_only_tags_and_embeds_new_pages():
+    events = []
+    processor = PagesDocumentProcessor()
+    openai_service = CountingOpenAIService()
+    vector_service = types.SimpleNamespace(upserts=[], deleted=[])
+    vector_service.upsert_chunks = lambda filename, chunks: vector_service.upserts.append(chunks)
+    vector_service.delete_chunks = lambda chunk_ids: vector_service.deleted.extend(chunk_ids)
+    classifier = types.SimpleNamespace(taught=[], removed=[])
+    classifier.add_tagged_chunks = lambda chunks: classifier.taught.extend(chunks)
+    classifier.remove_tagged_chunks = lambda chunks: classifier.removed.extend(chunks)
+    storage = StoringStorage()
+    pipeline = IngestionPipeline(processor, openai_service, storage, vector_service, FakeEmbeddingService(events),
+                                 classifier, batch_size=8, linger_seconds=0.01)
+
+    path = os.path.join(tempfile.mkdtemp(), "upload")
+    with open(path, "wb") as f:
+        f.write(b"%PDF")
+
+    def ingest(pages):
+        processor.pages = pages
+        openai_service.tagged = []
+        events.clear()
+        vector_service.upserts.clear()
+        classifier.taught.clear()
+        classifier.removed.clear()
+        job = Job("doc.pdf", path)
+        return job, asyncio.run(pipeline.run(job))
+
+    ingest(["Page A", "Page B", "Page C", "Page D"])
+    # A new first page shifts A to page 2; B and D are gone; C stays page 3
+    job, result = ingest(["Page X", "Page A", "Page C"])
+
+    assert openai_service.tagged == ["Page X"]
+    assert events == [("embedded", 1)]
+    upserted = {chunk["chunk_id"]: chunk for chunks in vector_service.upserts for chunk in chunks}
+    assert sorted(upserted) == ["doc.pdf_page1", "doc.pdf_page2"]
+    assert upserted["doc.pdf_page2"]["text"] == "Page A" and upserted["doc.pdf_page2"]["chunk_index"] == 1
+    assert upserted["doc.pdf_page2"]["embedding"] == [1.0, 0.0]
+    assert vector_service.deleted == ["doc.pdf_page4"]
+    # The classifier's centroids follow the index: old pages 1, 2 and 4 out, new pages 1 and 2 in
+    assert [(chunk["chunk_id"], chunk["text"]) for chunk in classifier.taught] == [
+        ("doc.pdf_page1", "Page X"), ("doc.pdf_page2", "Page A")]
+    assert sorted((chunk["chunk_id"], chunk["text"]) for chunk in classifier.removed) == [
+        ("doc.pdf_page1", "Page A"), ("doc.pdf_page2", "Page B"), ("doc.pdf_page4", "Page D")]
+    assert job.progress["pages_unchanged"] == 1 and job.progress["pages_moved"] == 1
+    assert job.progress["chunks_embedded"] == 1 and job.progress["chunks_removed"] == 1
+    assert result["chunks_changed"] == 2
+    chunks = storage.processed_data["chunks"]
+    assert [(chunk["chunk_id"], chunk["summary"]) for chunk in chunks] == [
+        ("doc.pdf_page1", "About Page X"), ("doc.pdf_page2", "About Page A"), ("doc.pdf_page3", "About Page C")]
+
+
+class SlowUploadStorage(StoringStorage):
+    upload_finished = False
+
+    def upload_file(self, content, filename):
+        time.sleep(0.1)
+        content.read()
+        self.upload_finished = True
+        return super().upload_file(content, filename)
+
+
+def test_original_upload_finishes_before_a_failed_document_returns():
+    processor = PagesDocumentProcessor()
+    processor.pages = ["Page A"]
+    vector_service = types.SimpleNamespace(upsert_chunks=lambda filename, chunks: None)
+
+    def delete_chunks(chunk_ids):
+        raise RuntimeError("delete failed")
+
+    vector_service.delete_chunks = delete_chunks
+    classifier = types.SimpleNamespace(add_tagged_chunks=lambda chunks: None)
+    storage = SlowUploadStorage()
+    # The previous ingestion had a second page, so its vector is deleted
+    storage.processed_data = {"chunks": [], "page_hashes": {"doc.pdf_page2": "old"}}
+    pipeline = IngestionPipeline(processor, CountingOpenAIService(), storage, vector_service,
+                                 FakeEmbeddingService([]), classifier, batch_size=8, linger_seconds=0.01)
+
+    path = os.path.join(tempfile.mkdtemp(), "upload")
+    with open(path, "wb") as f:
+        f.write(b"%PDF")
+
+    async def main():
+        with pytest.raises(RuntimeError, match="delete failed"):
+            await pipeline.run(Job("doc.pdf", path))
+        # The job queue removes the spool file once run returns; the upload must be done with it by then
+        assert storage.upload_finished
+
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+import asyncio
+import os
+
+import job_queue
+from job_queue import LocalJobQueue
+
+
+class FakeUpload:
+    """Mimics UploadFile's async read(size)"""
+
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+
+    async def read(self, size):
+        self.reads.append(size)
+        piece, self.data = self.data[:size], self.data[size:]
+        return piece
+
+
+def run_jobs(queue, submit):
+    async def main():
+        await queue.start()
+        try:
+            jobs = await submit()
+            await queue._queue.join()
+            return jobs
+        finally:
+            await queue.stop()
+
+    return asyncio.run(main())
+
+
+def test_uploads_are_spooled_in_pieces_and_removed_after_the_job(monkeypatch, tmp_path):
+    monkeypatch.setattr(job_queue, "SPOOL_CHUNK_BYTES", 4)
+    seen = {}
+
+    async def handler(job):
+        seen["path"] = job.path
+        seen["content"] = job.read_content()
+        job.stage = "processing"
+        job.progress["pages_total"] = 1
+        job.progress["pages_tagged"] += 1
+        return {"chunks_processed": 1}
+
+    queue = LocalJobQueue(handler, num_workers=1, spool_dir=str(tmp_path))
+    upload = FakeUpload(b"%PDF-1.4 body")
+    [job] = run_jobs(queue, lambda: asyncio.gather(queue.submit("doc.pdf", upload)))
+
+    assert seen["content"] == b"%PDF-1.4 body"
+    assert upload.reads == [4, 4, 4, 4, 4]
+    assert not os.path.exists(seen["path"])
+    status = queue.get(job.id).to_dict()
+    assert status["status"] == "completed" and status["stage"] is None
+    assert status["result"] == {"chunks_processed": 1}
+    assert set(status["progress"]) == {"pages_total", "pages_extracted", "pages_tagged", "pages_unchanged",
+                                       "pages_moved", "chunks_removed", "chunks_embedded", "chunks_upserted"}
+    assert status["progress"]["pages_total"] == status["progress"]["pages_tagged"] == 1
+    assert status["started_at"] and status["finished_at"]
+
+
+def test_workers_run_jobs_concurrently_up_to_the_pool_size(tmp_path):
+    running = []
+    peak = []
+
+    async def handler(job):
+        running.append(job.id)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.remove(job.id)
+        return {}
+
+    queue = LocalJobQueue(handler, num_workers=2, spool_dir=str(tmp_path))
+    jobs = run_jobs(queue, lambda: asyncio.gather(*[queue.submit(f"{i}.pdf", b"%PDF") for i in range(5)]))
+
+    assert max(peak) == 2
+    assert all(job.status == "completed" for job in jobs)
+    assert os.listdir(tmp_path) == []
+
+
+def test_a_failing_job_is_marked_failed_without_stopping_the_worker(tmp_path):
+    async def handler(job):
+        if job.filename == "broken.pdf":
+            raise ValueError("corrupt PDF")
+        return {"chunks_processed": 3}
+
+    queue = LocalJobQueue(handler, num_workers=1, spool_dir=str(tmp_path))
+
+    async def submit():
+        return [await queue.submit(name, b"%PDF") for name in ("a.pdf", "broken.pdf", "c.pdf")]
+
+    jobs = run_jobs(queue, submit)
+    assert [job.status for job in jobs] == ["completed", "failed", "completed"]
+    assert jobs[1].error == "corrupt PDF" and jobs[1].result is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_batches_get_a_result_or_error_per_job(tmp_path):
+    async def batch_handler(jobs):
+        return [ValueError("corrupt PDF") if job.filename == "broken.pdf" else {"filename": job.filename}
+                for job in jobs]
+
+    queue = LocalJobQueue(None, num_workers=1, spool_dir=str(tmp_path), batch_handler=batch_handler)
+    jobs = run_jobs(queue, lambda: queue.submit_batch([("a.pdf", b"%PDF"), ("broken.pdf", FakeUpload(b"%PDF"))]))
+
+    assert [job.status for job in jobs] == ["completed", "failed"]
+    assert jobs[0].result == {"filename": "a.pdf"}
+    assert os.listdir(tmp_path) == []
+
+
+def test_only_the_newest_finished_jobs_are_kept(tmp_path):
+    async def handler(job):
+        return {}
+
+    queue = LocalJobQueue(handler, num_workers=1, spool_dir=str(tmp_path), max_finished_jobs=2)
+
+    async def submit():
+        return [await queue.submit(f"{i}.pdf", b"%PDF") for i in range(4)]
+
+    jobs = run_jobs(queue, submit)
+    assert list(queue.jobs) == [job.id for job in jobs[2:]]
+    assert queue.get(jobs[0].id) is None
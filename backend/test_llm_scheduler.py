@@ -0,0 +1,140 @@
+import asyncio
+import types
+
+import httpx
+import openai
+
+from llm_scheduler import LLMScheduler, ScheduledClient, PRIORITY_INTERACTIVE, llm_priority
+
+
+def rate_limit_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, request=request, headers={"retry-after": "0.05"})
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_interactive_calls_overtake_queued_ingestion_calls():
+    # 600 RPM grants one call every 0.1s once the bucket is empty
+    scheduler = LLMScheduler(rate_limits={"gpt-4o": (600, 1000000)})
+    scheduler._limiter("gpt-4o").requests.level = 0
+    order = []
+
+    async def create(model, messages, **kwargs):
+        order.append(messages[0]["content"])
+        return types.SimpleNamespace(usage=None)
+
+    async def main():
+        calls = [scheduler.call_async("gpt-4o", create, messages=[{"role": "user", "content": f"page {i}"}])
+                 for i in range(3)]
+        tasks = [asyncio.create_task(call) for call in calls]
+        await asyncio.sleep(0.01)
+        with llm_priority(PRIORITY_INTERACTIVE):
+            query = asyncio.create_task(scheduler.call_async(
+                "gpt-4o", create, messages=[{"role": "user", "content": "query"}]
+            ))
+        await asyncio.gather(query, *tasks)
+
+    asyncio.run(main())
+    assert order[0] == "query"
+    stats = scheduler.stats()
+    assert stats["calls"] == 4
+    assert stats["wait_seconds"]["interactive"]["count"] == 1
+    assert stats["wait_seconds"]["ingestion"]["max"] >= 0.2
+
+
+def test_rate_limited_calls_are_retried_after_backoff():
+    scheduler = LLMScheduler(rate_limits={}, backoff_base=0.01)
+    attempts = []
+
+    def create(model, input):
+        attempts.append(model)
+        if len(attempts) < 3:
+            raise rate_limit_error()
+        return types.SimpleNamespace(usage=types.SimpleNamespace(total_tokens=5), data=[])
+
+    client = ScheduledClient(types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=None), embeddings=types.SimpleNamespace(create=create)
+    ), scheduler)
+    response = client.embeddings.create(model="text-embedding-ada-002", input=["hello"])
+
+    assert response.data == [] and len(attempts) == 3
+    stats = scheduler.stats()
+    assert stats["retries"] == 2 and stats["rate_limited"] == 2
+
+
+def test_token_budget_spreads_calls_and_other_errors_are_not_retried():
+    # 6000 TPM refills 100 tokens per second; the first call uses the whole burst
+    scheduler = LLMScheduler(rate_limits={"gpt-4": (1000, 6000)})
+    started = []
+
+    async def create(model, messages, max_tokens):
+        started.append(asyncio.get_running_loop().time())
+        if len(started) == 3:
+            raise ValueError("bad request")
+        return types.SimpleNamespace(usage=types.SimpleNamespace(total_tokens=max_tokens))
+
+    async def main():
+        await scheduler.call_async("gpt-4", create, messages=[], max_tokens=6000)
+        await scheduler.call_async("gpt-4", create, messages=[], max_tokens=30)
+        try:
+            await scheduler.call_async("gpt-4", create, messages=[], max_tokens=1)
+        except ValueError:
+            return True
+
+    assert asyncio.run(main())
+    assert started[1] - started[0] >= 0.25
+    assert len(started) == 3 and scheduler.stats()["retries"] == 0
+
+
+def test_calls_are_not_throttled_without_configured_limits():
+    scheduler = LLMScheduler()
+    assert scheduler.rate_limits == {}
+
+    async def create(model, messages, max_tokens):
+        return types.SimpleNamespace(usage=types.SimpleNamespace(total_tokens=max_tokens))
+
+    async def main():
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(*[scheduler.call_async("gpt-4", create, messages=[], max_tokens=100000)
+                               for _ in range(20)])
+        return asyncio.get_running_loop().time() - start
+
+    assert asyncio.run(main()) < 0.5
+    assert scheduler.stats()["wait_seconds"]["ingestion"]["max"] < 0.1
+
+
+def stream_events(texts, usage=None):
+    async def events():
+        for text in texts:
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))],
+                                        usage=None)
+        if usage is not None:
+            yield types.SimpleNamespace(choices=[], usage=usage)
+    return events()
+
+
+def test_streamed_completions_settle_their_token_estimate():
+    scheduler = LLMScheduler(rate_limits={"gpt-4o": (1000, 60000)})
+    requests = []
+
+    async def create(model, messages, max_tokens, stream, stream_options):
+        requests.append(stream_options)
+        if len(requests) == 1:
+            return stream_events(["Hello", " world"], types.SimpleNamespace(
+                prompt_tokens=10, completion_tokens=2, total_tokens=12))
+        # No usage chunk: settled from the output counted along the way
+        return stream_events(["x" * 40])
+
+    async def main():
+        texts = []
+        for _ in range(2):
+            stream = await scheduler.call_async("gpt-4o", create, messages=[], max_tokens=5000, stream=True)
+            async for event in stream:
+                texts.extend(choice.delta.content for choice in event.choices)
+        return texts
+
+    assert asyncio.run(main()) == ["Hello", " world", "x" * 40]
+    assert requests == [{"include_usage": True}] * 2
+    # 60000 minus 12 reported tokens minus the 10 tokens counted for the second stream, not 2 x 5000 reserved
+    level = scheduler._limiter("gpt-4o").tokens.level
+    assert 60000 - 12 - 10 - 1 <= level <= 60000 - 12 - 10 + 5
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+
+import local_vector_index
+from local_vector_index import LocalVectorIndex
+
+
+def chunk(chunk_id, embedding, tags):
+    return {"chunk_id": chunk_id, "text": f"text of {chunk_id}", "tags": tags, "embedding": embedding}
+
+
+def make_index(snapshot_path=None, **kwargs):
+    index = LocalVectorIndex(dimension=3, snapshot_path=snapshot_path, **kwargs)
+    index.upsert_chunks("doc.pdf", [
+        chunk("a", [1.0, 0.0, 0.0], ["Vision"]),
+        chunk("b", [0.8, 0.6, 0.0], ["Planning"]),
+        chunk("c", [0.0, 1.0, 0.0], ["Vision", "Organize"]),
+        chunk("d", [0.0, 0.0, 1.0], ["Organize"]),
+    ])
+    return index
+
+
+def test_query_ranks_by_cosine_similarity():
+    index = make_index()
+    matches = index.query([2.0, 0.0, 0.0], top_k=3)
+    assert [match["id"] for match in matches] == ["a", "b", "c"]
+    assert abs(matches[0]["score"] - 1.0) < 1e-6
+    assert matches[1]["metadata"] == {"filename": "doc.pdf", "chunkText": "text of b", "chunkIndex": 1,
+                                      "chunkId": "b", "tags": ["Planning"]}
+
+
+def test_tag_filter_keeps_chunks_with_any_of_the_tags():
+    index = make_index()
+    assert [match["id"] for match in index.query([1.0, 0.0, 0.0], filter_categories=["Vision"])] == ["a", "c"]
+    assert {match["id"] for match in index.query([1.0, 0.0, 0.0], filter_categories=["Planning", "Organize"])} == {
+        "b", "c", "d"}
+    assert index.query([1.0, 0.0, 0.0], filter_categories=["Unknown"]) == []
+
+
+def test_delete_moves_the_last_row_into_the_hole():
+    index = make_index()
+    index.delete_chunks(["a", "missing"])
+    assert len(index) == 3
+    # "d" was the last row and now fills row 0
+    assert index._id_to_row == {"d": 0, "b": 1, "c": 2}
+    assert [match["id"] for match in index.query([0.0, 0.0, 1.0], top_k=1)] == ["d"]
+    assert [match["id"] for match in index.query([0.0, 0.5, 1.0], filter_categories=["Organize"])] == ["d", "c"]
+    assert [match["id"] for match in index.query([1.0, 0.0, 0.0], filter_categories=["Vision"])] == ["c"]
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "index")
+    index = make_index(path, autosave=False)
+    index.delete_chunks(["b"])
+    assert not os.path.exists(f"{path}.npy")
+    index.flush()
+
+    loaded = LocalVectorIndex(dimension=3, snapshot_path=path)
+    assert len(loaded) == 3
+    assert [match["id"] for match in loaded.query([0.0, 1.0, 0.0], filter_categories=["Vision"])] == ["c", "a"]
+    assert loaded.query([0.0, 0.0, 1.0], top_k=1)[0]["metadata"]["tags"] == ["Organize"]
+
+
+def test_autosave_waits_for_several_writes(tmp_path):
+    path = str(tmp_path / "index")
+    index = make_index(path, save_every=3, save_seconds=3600)
+    index.upsert_chunks("doc.pdf", [chunk("e", [1.0, 1.0, 0.0], ["Vision"])])
+    assert not os.path.exists(f"{path}.npy")
+    index.delete_chunks(["e"])
+    assert os.path.exists(f"{path}.npy") and index._save_timer is None
+    assert len(LocalVectorIndex(dimension=3, snapshot_path=path)) == 4
+
+
+def test_queries_and_upserts_run_while_a_snapshot_is_written(tmp_path, monkeypatch):
+    path = str(tmp_path / "index")
+    index = make_index(path, autosave=False)
+    during_save = []
+    dump = json.dump
+
+    def slow_dump(data, f):
+        # Another thread must get the index lock while the snapshot is being written
+        worker = threading.Thread(target=lambda: during_save.append((
+            index.upsert_chunks("doc.pdf", [chunk("e", [1.0, 1.0, 0.0], ["Vision"])]),
+            index.query([1.0, 0.0, 0.0], top_k=1)[0]["id"])))
+        worker.start()
+        worker.join(5)
+        dump(data, f)
+
+    monkeypatch.setattr(local_vector_index.json, "dump", slow_dump)
+    index.save()
+    monkeypatch.undo()
+
+    assert during_save == [(True, "a")]
+    # The snapshot holds the index as it was when the save started
+    assert len(LocalVectorIndex(dimension=3, snapshot_path=path)) == 4
+    assert index._unsaved_writes == 1
+
+
+def test_a_snapshot_with_vectors_from_another_save_is_not_loaded(tmp_path):
+    path = str(tmp_path / "index")
+    index = make_index(path, autosave=False)
+    index.save()
+    with open(f"{path}.npy", "rb") as f:
+        old_vectors = f.read()
+    # Same row count, but the last row moved into b's place
+    index.delete_chunks(["b"])
+    index.upsert_chunks("doc.pdf", [chunk("e", [1.0, 1.0, 0.0], ["Vision"])])
+    index.save()
+    # A crash between the two renames leaves the old vectors beside the new ids
+    with open(f"{path}.npy", "wb") as f:
+        f.write(old_vectors)
+
+    loaded = LocalVectorIndex(dimension=3, snapshot_path=path)
+    assert len(loaded) == 0
+    assert not loaded.load()
@@ -0,0 +1,112 @@
+import asyncio
+import types
+
+import pytest
+
+from llm_scheduler import LLMScheduler
+from metrics import (MetricsRegistry, PipelineMetrics, metrics_var, server_timing, span, start_request_timings,
+                     traced)
+
+
+def sample(text, line_start):
+    return next(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(line_start))
+
+
+@pytest.fixture
+def metrics():
+    """A fresh PipelineMetrics for the test, instead of the process-wide one served on /metrics"""
+    metrics = PipelineMetrics()
+    token = metrics_var.set(metrics)
+    yield metrics
+    metrics_var.reset(token)
+
+
+def test_histograms_counters_and_collectors_render_in_prometheus_text_format():
+    metrics = MetricsRegistry()
+    latency = metrics.histogram("demo_seconds", "Demo latency", ["stage"], buckets=(0.1, 1))
+    errors = metrics.counter("demo_errors_total", "Demo errors", ["stage"])
+    metrics.register_collector(lambda: [("demo_hit_ratio", "gauge", "Demo hit ratio", [({"cache": 'a"b'}, 0.5)])])
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, stage="upsert")
+    errors.inc(stage="upsert")
+
+    text = metrics.render()
+    assert "# TYPE demo_seconds histogram" in text
+    assert 'demo_seconds_bucket{stage="upsert",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="upsert",le="1.0"} 2' in text
+    assert 'demo_seconds_bucket{stage="upsert",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{stage="upsert"} 3' in text
+    assert sample(text, 'demo_seconds_sum{stage="upsert"}') == pytest.approx(5.55)
+    assert 'demo_errors_total{stage="upsert"} 1' in text
+    assert 'demo_hit_ratio{cache="a\\"b"} 0.5' in text
+
+
+def test_spans_record_stage_latency_and_the_request_breakdown(metrics):
+    @traced("repair")
+    async def repair():
+        await asyncio.sleep(0.01)
+
+    async def handle_request():
+        timings = start_request_timings()
+        with span("retrieval"):
+            await asyncio.gather(repair(), repair())
+        with pytest.raises(ValueError):
+            with span("generation"):
+                raise ValueError("bad reply")
+        return timings
+
+    timings = asyncio.run(handle_request())
+    assert timings["repair"][1] == 2 and timings["repair"][0] >= 0.02
+    assert timings["retrieval"][0] >= 0.01
+    header = server_timing(timings)
+    assert 'repair;dur=' in header and 'desc="2 calls"' in header and 'retrieval;dur=' in header
+
+    text = metrics.registry.render()
+    assert 'pipeline_stage_seconds_count{stage="repair"} 2' in text
+    assert 'pipeline_stage_errors_total{stage="generation"} 1' in text
+    assert 'pipeline_stage_errors_total{stage="retrieval"}' not in text
+
+
+def test_closed_streams_and_cancelled_tasks_are_not_stage_errors(metrics):
+    async def stream():
+        with span("generation"):
+            for token in ("a", "b", "c"):
+                yield token
+
+    async def slow():
+        with span("retrieval"):
+            await asyncio.sleep(10)
+
+    async def main():
+        # The client disconnects after the first token: the generator is closed inside the span
+        tokens = stream()
+        assert await tokens.__anext__() == "a"
+        await tokens.aclose()
+        task = asyncio.create_task(slow())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    text = metrics.registry.render()
+    assert 'pipeline_stage_seconds_count{stage="generation"} 1' in text
+    assert 'pipeline_stage_seconds_count{stage="retrieval"} 1' in text
+    assert "pipeline_stage_errors_total{" not in text
+
+
+def test_scheduler_counts_tokens_from_each_response_usage(metrics):
+    scheduler = LLMScheduler(rate_limits={})
+
+    async def create(model, messages):
+        return types.SimpleNamespace(usage=types.SimpleNamespace(prompt_tokens=12, completion_tokens=3, total_tokens=15))
+
+    async def main():
+        for _ in range(2):
+            await scheduler.call_async("test-model", create, messages=[{"role": "user", "content": "hi"}])
+
+    asyncio.run(main())
+    text = metrics.registry.render()
+    assert sample(text, 'llm_tokens_total{model="test-model",kind="prompt"}') == 24
+    assert sample(text, 'llm_tokens_total{model="test-model",kind="completion"}') == 6
+    assert 'llm_requests_total{model="test-model",outcome="ok"} 2' in text
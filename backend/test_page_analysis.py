@@ -0,0 +1,90 @@
+import asyncio
+import json
+import types
+
+from openai_service import OpenAIService, PAGE_ANALYSIS_PROMPT, SUMMARY_SYSTEM_PROMPT, TAGGING_SYSTEM_PROMPT
+
+
+class FakeCompletions:
+    def __init__(self, combined_reply):
+        self.combined_reply = combined_reply
+        self.prompts = []
+
+    async def create(self, model, messages, **kwargs):
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        if prompt == PAGE_ANALYSIS_PROMPT:
+            content = self.combined_reply
+        elif prompt == SUMMARY_SYSTEM_PROMPT:
+            content = "Repaired summary."
+        else:
+            content = '["Planning"]'
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+
+
+def analyze(combined_reply):
+    completions = FakeCompletions(combined_reply)
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    # The API clients are not needed for a single unit
+    service = object.__new__(OpenAIService)
+    chunk = asyncio.run(service._process_unit_async(client, "Page text", "", "doc.pdf_page1", "page 1 of doc.pdf"))
+    return chunk, completions.prompts
+
+
+def test_one_call_per_page():
+    chunk, prompts = analyze(json.dumps({"summary": "A summary.", "tags": ["Vision", "Planning"]}))
+
+    assert prompts == [PAGE_ANALYSIS_PROMPT]
+    assert chunk["summary"] == "A summary."
+    assert chunk["tags"] == ["Vision", "Planning"]
+
+
+def test_only_malformed_tags_are_repaired():
+    chunk, prompts = analyze(json.dumps({"summary": "A summary.", "tags": ["vision", "Strategy"]}))
+
+    assert prompts == [PAGE_ANALYSIS_PROMPT, TAGGING_SYSTEM_PROMPT]
+    assert chunk["summary"] == "A summary."
+    assert chunk["tags"] == ["Planning"]
+
+
+def test_only_missing_summary_is_repaired():
+    chunk, prompts = analyze(json.dumps({"tags": ["Vision"]}))
+
+    assert prompts == [PAGE_ANALYSIS_PROMPT, SUMMARY_SYSTEM_PROMPT]
+    assert chunk["summary"] == "Repaired summary."
+    assert chunk["tags"] == ["Vision"]
+
+
+def test_extra_or_invalid_tags_are_dropped_without_a_repair_call():
+    tags = ["Vision", "planning", "Planning", "Organize", "Growth Mindset", "Fearless Presenter", "Leadership"]
+    chunk, prompts = analyze(json.dumps({"summary": "A summary.", "tags": tags}))
+
+    assert prompts == [PAGE_ANALYSIS_PROMPT]
+    assert chunk["tags"] == ["Vision", "Planning", "Organize", "Growth Mindset", "Fearless Presenter"]
+
+
+def test_empty_repaired_summary_does_not_raise():
+    completions = FakeCompletions(json.dumps({"tags": ["Vision"]}))
+    original_create = completions.create
+
+    async def create(model, messages, **kwargs):
+        response = await original_create(model, messages, **kwargs)
+        if messages[0]["content"] == SUMMARY_SYSTEM_PROMPT:
+            response.choices[0].message.content = None
+        return response
+
+    completions.create = create
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    service = object.__new__(OpenAIService)
+    chunk = asyncio.run(service._process_unit_async(client, "Page text", "", "doc.pdf_page1", "page 1 of doc.pdf"))
+
+    assert chunk["summary"] == ""
+    assert chunk["tags"] == ["Vision"]
+
+
+def test_unparseable_reply_repairs_both_fields():
+    chunk, prompts = analyze("not json")
+
+    assert sorted(prompts[1:]) == sorted([SUMMARY_SYSTEM_PROMPT, TAGGING_SYSTEM_PROMPT])
+    assert chunk["summary"] == "Repaired summary."
+    assert chunk["tags"] == ["Planning"]
@@ -0,0 +1,101 @@
+import json
+import threading
+import types
+
+import pytest
+
+import pinecone_service
+from pinecone_service import PineconeService, MAX_METADATA_BYTES, estimate_vector_bytes
+
+
+class FlakyIndex:
+    """Records upserts; the first attempt of any batch containing a vector in fail_once fails"""
+
+    def __init__(self, fail_once=(), fail_always=()):
+        self.fail_once = set(fail_once)
+        self.fail_always = set(fail_always)
+        self.attempts = []
+        self.vectors = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors):
+        ids = {vector[0] for vector in vectors}
+        with self._lock:
+            self.attempts.append(sorted(ids))
+            if ids & self.fail_always:
+                raise RuntimeError("upsert rejected")
+            if ids & self.fail_once:
+                self.fail_once -= ids
+                raise RuntimeError("connection reset")
+            for vector_id, embedding, metadata in vectors:
+                self.vectors[vector_id] = (embedding, metadata)
+
+
+def make_service(index, monkeypatch, max_vectors=4, max_bytes=10**6):
+    monkeypatch.setattr(pinecone_service, "UPSERT_MAX_BATCH_VECTORS", max_vectors)
+    monkeypatch.setattr(pinecone_service, "UPSERT_MAX_BATCH_BYTES", max_bytes)
+    monkeypatch.setattr(pinecone_service.time, "sleep", lambda seconds: None)
+    client = types.SimpleNamespace(list_indexes=lambda: [types.SimpleNamespace(name="test")], Index=lambda name, **kwargs: index)
+    monkeypatch.setenv("PINECONE_INDEX_NAME", "test")
+    return PineconeService(pc=client)
+
+
+def chunks(count, text="text"):
+    return [{"chunk_id": f"c{i}", "text": text, "tags": ["Vision"], "embedding": [0.1] * 8, "chunk_index": i}
+            for i in range(count)]
+
+
+def test_batches_stay_under_the_count_and_byte_limits(monkeypatch):
+    index = FlakyIndex()
+    sizes = [estimate_vector_bytes(f"c{i}", [0.1] * 8, {"filename": "doc.pdf", "chunkText": "x" * 100 * i,
+                                                       "chunkIndex": i, "chunkId": f"c{i}", "tags": ["Vision"]})
+             for i in range(10)]
+    service = make_service(index, monkeypatch, max_vectors=3, max_bytes=1000)
+    service.upsert_chunks("doc.pdf", [dict(chunk, text="x" * 100 * i) for i, chunk in enumerate(chunks(10))])
+
+    batches = [report["vectors"] for report in service.last_upsert_report]
+    assert sum(batches) == len(index.vectors) == 10
+    assert max(batches) <= 3
+    for report in service.last_upsert_report:
+        # Only a single vector may exceed the byte limit, in a batch of its own
+        assert report["bytes"] <= 1000 or report["vectors"] == 1
+    assert sum(report["bytes"] for report in service.last_upsert_report) == sum(sizes)
+
+
+def test_only_the_failed_batch_is_retried(monkeypatch):
+    index = FlakyIndex(fail_once={"c5"})
+    service = make_service(index, monkeypatch, max_vectors=4)
+    assert service.upsert_chunks("doc.pdf", chunks(10)) is True
+
+    assert sorted(map(tuple, index.attempts)) == sorted([
+        ("c0", "c1", "c2", "c3"), ("c4", "c5", "c6", "c7"), ("c4", "c5", "c6", "c7"), ("c8", "c9")])
+    report = service.last_upsert_report
+    assert [(batch["batch"], batch["vectors"], batch["attempts"], batch["ok"]) for batch in report] == [
+        (0, 4, 1, True), (1, 4, 2, True), (2, 2, 1, True)]
+    assert len(index.vectors) == 10
+
+
+def test_a_batch_that_keeps_failing_is_reported(monkeypatch):
+    index = FlakyIndex(fail_always={"c0"})
+    service = make_service(index, monkeypatch, max_vectors=4)
+    with pytest.raises(RuntimeError, match="1 of 2 Pinecone upsert batches failed: upsert rejected"):
+        service.upsert_chunks("doc.pdf", chunks(6))
+
+    report = service.last_upsert_report
+    assert [(batch["attempts"], batch["ok"], batch["error"]) for batch in report] == [
+        (pinecone_service.UPSERT_MAX_ATTEMPTS, False, "upsert rejected"), (1, True, None)]
+    assert sorted(index.vectors) == ["c4", "c5"]
+
+
+def test_oversized_metadata_is_truncated_to_the_byte_limit(monkeypatch):
+    index = FlakyIndex()
+    service = make_service(index, monkeypatch)
+    service.upsert_chunks("doc.pdf", chunks(1, text="x" * 100))
+    assert index.vectors["c0"][1]["chunkText"] == "x" * 100
+    service.upsert_chunks("doc.pdf", chunks(1, text="é" * MAX_METADATA_BYTES))
+
+    _, metadata = index.vectors["c0"]
+    size = len(json.dumps(metadata, ensure_ascii=False).encode("utf-8"))
+    assert MAX_METADATA_BYTES - 512 < size <= MAX_METADATA_BYTES
+    assert set(metadata["chunkText"]) == {"é"}
+    assert metadata["chunkId"] == "c0" and metadata["tags"] == ["Vision"]
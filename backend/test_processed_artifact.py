@@ -0,0 +1,99 @@
+import json
+
+from google.api_core.exceptions import NotFound
+
+import processed_artifact
+from storage_service import StorageService
+
+PROCESSED = {
+    "filename": "doc.pdf",
+    "gcs_path": "gs://bucket/documents/doc.pdf",
+    "chunks": [
+        {"text": f"Text of page {i}. " * 200, "summary": "Summary.", "context": f"Page {i + 1} of document",
+         "chunk_id": f"doc.pdf_page{i + 1}", "tags": ["Vision", "Planning"] if i % 2 else ["Vision"],
+         "content_hash": "abc", "chunk_index": i, "embedding": [0.25 * (j % 7) for j in range(1536)]}
+        for i in range(30)
+    ],
+    "tags": {},
+    "page_hashes": {f"doc.pdf_page{i + 1}": "abc" for i in range(30)},
+    "processed_date": "2025-01-01 00:00:00"
+}
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = data.encode() if isinstance(data, str) else data
+
+    def download_as_bytes(self, start=None, end=None):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        data = self.bucket.objects[self.name]
+        self.bucket.bytes_downloaded += len(data[start:None if end is None else end + 1])
+        return data[start:None if end is None else end + 1]
+
+    download_as_string = download_as_bytes
+
+    def delete(self):
+        if self.bucket.objects.pop(self.name, None) is None:
+            raise NotFound(self.name)
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects = {}
+        self.bytes_downloaded = 0
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+def make_service():
+    service = object.__new__(StorageService)
+    service.bucket_name = "bucket"
+    service.cache = None
+    service.bucket = FakeBucket()
+    return service
+
+
+def test_round_trip_keeps_fields_and_float32_embeddings():
+    data = processed_artifact.encode(PROCESSED)
+    decoded = processed_artifact.decode(data)
+
+    assert len(data) < len(json.dumps(PROCESSED, indent=2)) / 3
+    assert decoded["page_hashes"] == PROCESSED["page_hashes"]
+    for original, chunk in zip(PROCESSED["chunks"], decoded["chunks"]):
+        assert chunk["text"] == original["text"] and chunk["tags"] == original["tags"]
+        assert chunk["embedding"].typecode == 'f'
+        assert list(chunk["embedding"]) == original["embedding"]
+
+
+def test_tag_summary_and_single_chunk_are_read_lazily():
+    service = make_service()
+    service.store_processed_content("doc.pdf", PROCESSED)
+    size = len(service.bucket.objects["processed/doc.pdf.bin"])
+
+    assert service.get_tag_summary("doc.pdf") == {"Vision": 30, "Planning": 15}
+    header = service.get_processed_header("doc.pdf")
+    chunk = service.get_processed_chunk("doc.pdf", "doc.pdf_page7", header=header)
+
+    assert chunk["chunk_index"] == 6
+    assert service.get_processed_chunk("doc.pdf", "missing", header=header) is None
+    assert service.bucket.bytes_downloaded < size / 4
+
+
+def test_old_json_artifacts_stay_readable_and_are_replaced():
+    service = make_service()
+    legacy = dict(PROCESSED, chunks=[{key: value for key, value in chunk.items() if key != "embedding"}
+                                     for chunk in PROCESSED["chunks"]])
+    service.bucket.objects["processed/doc.pdf.json"] = json.dumps(legacy, indent=2).encode()
+
+    assert service.get_processed("doc.pdf") == legacy
+    assert service.get_tag_summary("doc.pdf") == {"Vision": 30, "Planning": 15}
+    assert service.get_processed_chunk("doc.pdf", "doc.pdf_page2")["tags"] == ["Vision", "Planning"]
+
+    service.store_processed_content("doc.pdf", PROCESSED)
+    assert list(service.bucket.objects) == ["processed/doc.pdf.bin"]
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import time
+import types
+
+from query_pipeline import QueryPipeline
+
+LLM_LATENCY = 0.2
+EMBEDDING_LATENCY = 0.05
+PINECONE_LATENCY = 0.1
+
+ANSWER = json.dumps({
+    "competency": "Vision",
+    "category": "PURPOSE",
+    "extracts": [
+        {"content": "a paraphrase that is not in the chunk", "reference": "a.pdf", "teaching_suggestion": "Try it."},
+        {"content": "another paraphrase", "reference": "a.pdf", "teaching_suggestion": "Try it."}
+    ],
+    "lesson_approach": "Approach"
+})
+
+
+def _completion(content):
+    message = types.SimpleNamespace(content=content)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+class FakeCompletions:
+    async def create(self, model, messages, **kwargs):
+        await asyncio.sleep(LLM_LATENCY)
+        if messages[0]["content"].startswith("You are an expert at extracting direct quotes"):
+            return _completion("Vision guides the venture.")
+        return _completion(ANSWER)
+
+
+class FakeEmbeddingService:
+    async def embed_text_async(self, text):
+        await asyncio.sleep(EMBEDDING_LATENCY)
+        return [1.0, 0.0]
+
+
+class FakeClassifier:
+    async def classify_async(self, query, query_embedding):
+        return ["Vision"]
+
+
+class FakeVectorService:
+    def query(self, query_embedding, top_k=20, filter_categories=None):
+        # Blocking like the real Pinecone client
+        time.sleep(PINECONE_LATENCY)
+        return [{
+            "id": "a.pdf_page1",
+            "score": 0.9,
+            "metadata": {"chunkText": "Vision guides the venture.", "tags": ["Vision"], "filename": "a.pdf", "chunkId": "a.pdf_page1"}
+        }]
+
+
+def make_pipeline():
+    openai_service = types.SimpleNamespace(
+        client=None,
+        async_client=types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions()))
+    )
+    # min_matches=1: the single fake match satisfies the competency-filtered search
+    return QueryPipeline(openai_service, FakeEmbeddingService(), FakeClassifier(), FakeVectorService(), min_matches=1)
+
+
+def test_concurrent_queries_finish_in_about_the_time_of_one():
+    pipeline = make_pipeline()
+
+    async def run(n):
+        start = time.perf_counter()
+        replies = await asyncio.gather(*[pipeline.answer(f"query {i}") for i in range(n)])
+        return time.perf_counter() - start, replies
+
+    single_time, _ = asyncio.run(run(1))
+    concurrent_time, replies = asyncio.run(run(10))
+
+    assert all("Vision guides the venture." in reply for reply in replies)
+    assert concurrent_time < single_time * 2
+
+
+def test_quote_repairs_run_in_parallel():
+    pipeline = make_pipeline()
+    start = time.perf_counter()
+    asyncio.run(pipeline.answer("query"))
+    elapsed = time.perf_counter() - start
+
+    # Embedding + Pinecone + answer + one round of (two parallel) quote repairs
+    sequential_repairs = EMBEDDING_LATENCY + PINECONE_LATENCY + 3 * LLM_LATENCY
+    assert elapsed < sequential_repairs
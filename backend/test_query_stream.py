@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+import tempfile
+
+import httpx
+
+import request_logging
+from query_pipeline import QueryPipeline
+from service_registry import ServiceRegistry
+
+# Importing app sets up logging; keep its log file out of the working tree
+request_logging.LOG_FILE = os.path.join(tempfile.mkdtemp(), "app.log")
+import app  # noqa: E402
+
+MATCH = {"id": "doc.pdf_page1", "score": 0.9,
+         "metadata": {"filename": "doc.pdf", "chunkText": "Plan the week.", "chunkId": "doc.pdf_page1",
+                      "tags": ["Planning"]}}
+
+
+def make_pipeline(tokens, fail_after=None):
+    pipeline = QueryPipeline(None, None, None, None)
+
+    async def retrieve(query):
+        return ["Planning"], [MATCH]
+
+    async def stream_generate(messages):
+        for i, token in enumerate(tokens):
+            if i == fail_after:
+                raise RuntimeError("stream dropped")
+            yield token
+
+    async def format_reply(query, response_json, filtered_matches):
+        return f"Reply to {query}: {response_json}"
+
+    pipeline.retrieve = retrieve
+    pipeline.build_messages = lambda query, matches: []
+    pipeline.stream_generate = stream_generate
+    pipeline.format_reply = format_reply
+    return pipeline
+
+
+def parse_sse(text):
+    """(event, data) pairs, checking that each event is framed as event/data lines ended by a blank line"""
+    assert text.endswith("\n\n")
+    events = []
+    for block in text[:-2].split("\n\n"):
+        event_line, data_line = block.split("\n")
+        assert event_line.startswith("event: ") and data_line.startswith("data: ")
+        events.append((event_line[len("event: "):], json.loads(data_line[len("data: "):])))
+    return events
+
+
+def collect(pipeline, query):
+    async def main():
+        return "".join([event async for event in pipeline.stream_events(query)])
+    return parse_sse(asyncio.run(main()))
+
+
+def test_events_are_sources_then_tokens_then_final():
+    events = collect(make_pipeline(['{"a"', ": 1}"]), "plan")
+    assert [event for event, _ in events] == ["sources", "token", "token", "final"]
+    assert events[0][1]["categories"] == ["Planning"]
+    assert [source["chunk_id"] for source in events[0][1]["sources"]] == ["doc.pdf_page1"]
+    assert [data["text"] for event, data in events if event == "token"] == ['{"a"', ": 1}"]
+    assert events[-1][1] == {"reply": 'Reply to plan: {"a": 1}'}
+
+
+def test_generation_failing_partway_ends_with_an_error_event():
+    events = collect(make_pipeline(["one", "two", "three"], fail_after=2), "plan")
+    assert [event for event, _ in events] == ["sources", "token", "token", "error"]
+    assert events[-1][1] == {"detail": "stream dropped"}
+
+
+def post_stream(monkeypatch, factory):
+    services = ServiceRegistry()
+    services.register("query_pipeline", factory)
+    monkeypatch.setattr(app, "services", services)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test") as client:
+            return await client.post("/query/stream", json={"query": "plan"})
+
+    return asyncio.run(main())
+
+
+def test_stream_endpoint_sends_framed_server_sent_events(monkeypatch):
+    response = post_stream(monkeypatch, lambda: make_pipeline(["Hi", "!"]))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert [event for event, _ in events] == ["sources", "token", "token", "final"]
+    assert events[-1][1] == {"reply": "Reply to plan: Hi!"}
+
+
+def test_stream_endpoint_reports_a_failed_service_like_query(monkeypatch):
+    def broken():
+        raise ConnectionError("index unreachable")
+
+    response = post_stream(monkeypatch, broken)
+    assert response.status_code == 500
+    assert response.json() == {"detail": "index unreachable"}
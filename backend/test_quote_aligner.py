@@ -0,0 +1,50 @@
+import time
+
+from quote_aligner import QuoteAligner
+
+CHUNKS = [
+    "Planning is the bridge between vision and execution. Founders who plan weekly ship more often.",
+    "The CEO Perspective requires entrepreneurs to simultaneously hold three time horizons:\nimmediate tactical execution, mid-range strategic positioning, and long-term vision fulfillment.",
+    "Fear management techniques distinguish novice from experienced presenters."
+]
+
+
+def test_aligns_across_whitespace_and_punctuation_differences():
+    aligner = QuoteAligner(CHUNKS)
+    match = aligner.align("the CEO perspective requires entrepreneurs to simultaneously hold three time horizons -- "
+                          "immediate tactical execution, mid range strategic positioning")
+
+    assert match.chunk_index == 1
+    assert match.score > 0.9
+    assert match.text.startswith("The CEO Perspective")
+    assert match.text.endswith("strategic positioning,")
+    assert match.text in CHUNKS[1]
+
+
+def test_picks_the_closest_chunk_not_the_first():
+    aligner = QuoteAligner(CHUNKS)
+    match = aligner.align("Fear management techniques separate novice from experienced presenters.")
+
+    assert match.chunk_index == 2
+    assert match.text == CHUNKS[2]
+    assert 0.8 < match.score < 1.0
+
+
+def test_paraphrases_score_below_the_threshold():
+    aligner = QuoteAligner(CHUNKS)
+    match = aligner.align("Entrepreneurs should think about many timeframes at once.")
+
+    assert match is None or match.score < 0.5
+    assert aligner.align("") is None
+
+
+def test_alignment_is_fast_on_a_full_retrieval():
+    chunks = [f"Chunk {i} talks about topic {i} in some detail. " * 40 for i in range(20)] + CHUNKS
+    aligner = QuoteAligner(chunks)
+    start = time.perf_counter()
+    for _ in range(10):
+        match = aligner.align("Founders who plan weekly ship more often")
+    elapsed = time.perf_counter() - start
+
+    assert match.chunk_index == 20
+    assert elapsed < 0.5
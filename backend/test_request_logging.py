@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import request_logging
+from request_logging import RequestIdFilter, in_request_context, start_request
+
+# Importing app sets up logging; keep its log file out of the working tree
+request_logging.LOG_FILE = os.path.join(tempfile.mkdtemp(), "app.log")
+import app  # noqa: E402
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.addFilter(RequestIdFilter())
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def capture_logs():
+    handler = RecordingHandler()
+    logging.getLogger().addHandler(handler)
+    return handler
+
+
+def test_pool_threads_log_with_the_calling_request_id():
+    handler = capture_logs()
+    try:
+        def work(i):
+            logging.warning(f"batch {i}")
+
+        start_request("req-pool")
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(in_request_context(work), range(6)))
+            # Without the wrapper, pool threads see no request
+            list(executor.map(work, range(6, 7)))
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+    ids = {record.getMessage(): record.request_id for record in handler.records}
+    assert [ids[f"batch {i}"] for i in range(6)] == ["req-pool"] * 6
+    assert ids["batch 6"] == "-"
+
+
+def test_supplied_request_id_is_echoed_and_logged():
+    handler = capture_logs()
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test") as client:
+            # Not JSON, so /query logs the error before touching any service
+            return await client.post("/query", content=b"not json", headers={"X-Request-ID": "req-from-client"})
+
+    try:
+        response = asyncio.run(main())
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+    assert response.status_code == 500
+    assert response.headers["X-Request-ID"] == "req-from-client"
+    [record] = [record for record in handler.records if record.getMessage() == "Error in /query endpoint"]
+    assert record.request_id == "req-from-client"
+
+
+def test_unsafe_request_ids_are_replaced():
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test") as client:
+            return [await client.get("/health", headers={"X-Request-ID": request_id})
+                    for request_id in ("req\r\nforged line", "x" * 65, "req id", "req.2024-01_a")]
+
+    forged, too_long, spaced, valid = [response.headers["X-Request-ID"] for response in asyncio.run(main())]
+    assert valid == "req.2024-01_a"
+    for replaced in (forged, too_long, spaced):
+        assert len(replaced) == 12 and replaced.isalnum()
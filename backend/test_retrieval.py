@@ -0,0 +1,55 @@
+import asyncio
+import types
+
+import numpy as np
+
+from local_vector_index import LocalVectorIndex
+from query_pipeline import QueryPipeline
+
+
+def make_index(tagged_counts):
+    index = LocalVectorIndex(dimension=4, snapshot_path=None)
+    rng = np.random.default_rng(0)
+    chunks = []
+    for tag, count in tagged_counts.items():
+        for i in range(count):
+            chunks.append({"chunk_id": f"{tag}-{i}", "text": f"{tag} {i}", "tags": [tag],
+                           "embedding": rng.random(4).tolist()})
+    index.upsert_chunks("doc.pdf", chunks)
+    return index
+
+
+def make_pipeline(index, **kwargs):
+    return QueryPipeline(types.SimpleNamespace(), None, None, index, top_k=10, **kwargs)
+
+
+def test_filtered_search_returns_only_matching_tags():
+    pipeline = make_pipeline(make_index({"Vision": 12, "Results": 30}), min_matches=8)
+    matches = asyncio.run(pipeline.search([1, 1, 1, 1], ["Vision"]))
+
+    assert len(matches) == 10
+    assert all(match["metadata"]["tags"] == ["Vision"] for match in matches)
+    assert pipeline.retrieval_stats == {"filtered": 1}
+
+
+def test_thin_results_relax_to_the_core_value_then_drop_the_filter():
+    index = make_index({"Vision": 2, "Growth Mindset": 3, "Results": 30})
+
+    pipeline = make_pipeline(index, min_matches=4)
+    matches = asyncio.run(pipeline.search([1, 1, 1, 1], ["Vision"]))
+    assert [match["metadata"]["tags"][0] for match in matches] == ["Vision"] * 2 + ["Growth Mindset"] * 3
+    assert pipeline.retrieval_stats == {"relaxed": 1}
+
+    pipeline = make_pipeline(index, min_matches=8)
+    matches = asyncio.run(pipeline.search([1, 1, 1, 1], ["Vision"]))
+    assert len(matches) == 10
+    assert [match["metadata"]["tags"][0] for match in matches[:2]] == ["Vision"] * 2
+    assert pipeline.retrieval_stats == {"unfiltered": 1}
+
+
+def test_widening_stops_when_the_latency_budget_is_spent():
+    pipeline = make_pipeline(make_index({"Vision": 2, "Results": 30}), min_matches=8, retrieval_budget_ms=0)
+    matches = asyncio.run(pipeline.search([1, 1, 1, 1], ["Vision"]))
+
+    assert len(matches) == 2
+    assert pipeline.retrieval_stats == {"budget_exhausted": 1}
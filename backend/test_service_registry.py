@@ -0,0 +1,96 @@
+import asyncio
+import os
+import tempfile
+import threading
+
+import httpx
+
+import request_logging
+from service_registry import ServiceRegistry
+
+# Importing app sets up logging; keep its log file out of the working tree
+request_logging.LOG_FILE = os.path.join(tempfile.mkdtemp(), "app.log")
+import app  # noqa: E402
+
+
+def test_services_are_created_once_on_first_use_with_their_dependencies():
+    created = []
+    services = ServiceRegistry()
+    services.register("pool", lambda: created.append("pool") or "pool")
+    services.register("client", lambda: created.append("client") or f"client on {services.get('pool')}")
+
+    assert created == [] and services.peek("client") is None
+    assert services.get("client") == "client on pool"
+    assert services.get("client") == "client on pool"
+    assert created == ["client", "pool"]
+    assert services.peek("pool") == "pool"
+
+
+def test_aget_builds_on_a_worker_thread():
+    threads = []
+    services = ServiceRegistry()
+    services.register("slow", lambda: threads.append(threading.get_ident()) or "slow")
+
+    assert asyncio.run(services.aget("slow")) == "slow"
+    assert threads != [threading.get_ident()]
+    # Created services come back without another thread hop
+    assert asyncio.run(services.aget("slow")) == "slow" and len(threads) == 1
+
+
+def test_a_failed_service_is_reported_and_retried():
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("bucket unreachable")
+        return "storage"
+
+    services = ServiceRegistry()
+    services.register("storage", connect)
+    services.register("cache", lambda: "cache")
+
+    asyncio.run(services.warm_up())
+    assert not services.ready()
+    status = services.status()
+    assert status["storage"] == {"status": "failed", "error": "bucket unreachable"}
+    assert status["cache"]["status"] == "ready" and status["cache"]["init_seconds"] >= 0
+
+    assert services.get("storage") == "storage"
+    assert services.ready()
+    assert services.status()["storage"]["status"] == "ready"
+    assert len(attempts) == 2
+
+
+def test_status_reports_pending_services():
+    services = ServiceRegistry()
+    services.register("storage", lambda: "storage")
+    assert services.status() == {"storage": {"status": "pending"}}
+    assert not services.ready()
+
+
+def test_ready_returns_503_until_the_services_are_warmed_up(monkeypatch):
+    release = threading.Event()
+    services = ServiceRegistry()
+    services.register("fast", lambda: "fast")
+    services.register("slow", lambda: release.wait(5) and "slow")
+    monkeypatch.setattr(app, "services", services)
+    monkeypatch.setattr(app, "shutdown_logging", lambda: None)
+
+    async def main():
+        async with app.app.router.lifespan_context(app.app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test") as client:
+                starting = await client.get("/ready")
+                release.set()
+                await app.warm_up_task
+                ready = await client.get("/ready")
+                return starting, ready
+
+    starting, ready = asyncio.run(main())
+    assert starting.status_code == 503
+    assert starting.json()["status"] == "starting"
+    assert starting.json()["services"]["slow"] == {"status": "pending"}
+    assert ready.status_code == 200
+    assert ready.json()["status"] == "ready"
+    assert {service["status"] for service in ready.json()["services"].values()} == {"ready"}
+
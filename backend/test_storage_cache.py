@@ -0,0 +1,168 @@
+import types
+
+from google.api_core.exceptions import NotFound
+
+from storage_cache import StorageCache
+from storage_service import StorageService
+
+PROCESSED = {
+    "filename": "doc.pdf",
+    "chunks": [{"text": f"Page {i}", "chunk_id": f"doc.pdf_page{i + 1}", "tags": ["Vision"]} for i in range(5)]
+}
+
+
+class FakeBlob:
+    """Just enough of google.cloud.storage.Blob, with generation numbers and download counting"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def generation(self):
+        return self.bucket.objects[self.name][0]
+
+    def upload_from_string(self, data, content_type=None):
+        data = data.encode() if isinstance(data, str) else data
+        generation = self.bucket.objects.get(self.name, (0, b""))[0] + 1
+        self.bucket.objects[self.name] = (generation, data)
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        generation, data = self.bucket.objects[self.name]
+        assert if_generation_match in (None, generation)
+        data = data[start:None if end is None else end + 1]
+        self.bucket.downloads += 1
+        self.bucket.bytes_downloaded += len(data)
+        return data
+
+    download_as_string = download_as_bytes
+
+    def delete(self):
+        if self.bucket.objects.pop(self.name, None) is None:
+            raise NotFound(self.name)
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects = {}
+        self.downloads = 0
+        self.bytes_downloaded = 0
+        self.listings = 0
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, bucket_name, prefix=""):
+        self.listings += 1
+        return [FakeBlob(self, name) for name in sorted(self.objects) if name.startswith(prefix)]
+
+
+def make_service(tmp_path, **cache_kwargs):
+    bucket = FakeBucket()
+    service = object.__new__(StorageService)
+    service.bucket_name = "bucket"
+    service.bucket = bucket
+    service.client = types.SimpleNamespace(list_blobs=bucket.list_blobs)
+    service.cache = StorageCache(cache_dir=str(tmp_path / "cache"), **cache_kwargs)
+    return service, bucket
+
+
+def test_reads_are_served_locally_until_the_generation_changes(tmp_path):
+    service, bucket = make_service(tmp_path)
+    service.store_processed_content("doc.pdf", PROCESSED)
+
+    for _ in range(3):
+        assert service.get_processed("doc.pdf")["chunks"][2]["chunk_id"] == "doc.pdf_page3"
+    assert bucket.downloads == 1
+
+    # Another writer replaces the artifact: the new generation is picked up
+    other, _ = make_service(tmp_path / "other")
+    other.bucket, other.cache = bucket, None
+    other.store_processed_content("doc.pdf", dict(PROCESSED, chunks=PROCESSED["chunks"][:1]))
+    assert len(service.get_processed("doc.pdf")["chunks"]) == 1
+    assert bucket.downloads == 2
+
+    stats = service.cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2
+    assert stats["bytes_saved"] > 0
+
+
+def test_cached_artifacts_serve_lazy_reads_without_downloads(tmp_path):
+    service, bucket = make_service(tmp_path)
+    service.store_processed_content("doc.pdf", PROCESSED)
+    service.get_processed("doc.pdf")
+
+    downloads = bucket.downloads
+    assert service.get_tag_summary("doc.pdf") == {"Vision": 5}
+    assert service.get_processed_chunk("doc.pdf", "doc.pdf_page4")["text"] == "Page 3"
+    assert bucket.downloads == downloads
+
+
+def test_listings_are_reused_and_invalidated_by_writes(tmp_path):
+    service, bucket = make_service(tmp_path)
+    service.upload_file(b"a", "a.pdf")
+
+    assert service.list_documents() == ["a.pdf"]
+    assert service.list_documents() == ["a.pdf"]
+    assert bucket.listings == 1
+
+    service.upload_file(b"b", "b.pdf")
+    assert service.list_documents() == ["a.pdf", "b.pdf"]
+    assert bucket.listings == 2
+
+
+def test_lru_eviction_keeps_the_cache_under_its_byte_cap(tmp_path):
+    service, bucket = make_service(tmp_path, max_bytes=2500, memory_max_bytes=0)
+    for name in ("a", "b", "c"):
+        service.upload_file(name.encode() * 1000, f"{name}.pdf")
+    service.get_document("a.pdf")
+    service.get_document("b.pdf")
+    service.get_document("a.pdf")
+    service.get_document("c.pdf")
+
+    assert service.cache.stats()["bytes"] <= 2500
+    assert service.cache.generation("documents/a.pdf") == 1
+    assert service.cache.generation("documents/b.pdf") is None
+
+
+def test_warm_up_survives_restarts(tmp_path):
+    service, bucket = make_service(tmp_path)
+    service.store_processed_content("doc.pdf", PROCESSED)
+    assert service.warm_cache() == 1
+
+    restarted, _ = make_service(tmp_path)
+    restarted.bucket = bucket
+    restarted.client = service.client
+    assert restarted.warm_cache() == 0
+    downloads = bucket.downloads
+    restarted.get_processed("doc.pdf")
+    assert bucket.downloads == downloads
+
+
+def test_hits_only_write_their_access_times_in_batches(tmp_path, monkeypatch):
+    cache = StorageCache(cache_dir=str(tmp_path / "cache"), memory_max_bytes=0)
+    for name in ("a", "b"):
+        cache.put(name, 1, name.encode() * 10)
+    changes = cache._conn.total_changes
+    last_access = dict(cache._conn.execute("SELECT name, last_access FROM objects").fetchall())
+
+    for _ in range(5):
+        assert cache.get("a", 1) == b"a" * 10
+    # The read path leaves SQLite alone
+    assert cache._conn.total_changes == changes and set(cache._pending_access) == {"a"}
+
+    monkeypatch.setattr("storage_cache.ACCESS_FLUSH_ENTRIES", 2)
+    cache.get("b", 1)
+    assert cache._pending_access == {}
+    written = dict(cache._conn.execute("SELECT name, last_access FROM objects").fetchall())
+    assert written["a"] > last_access["a"] and written["b"] > last_access["b"]
+
+    cache.get("a", 1)
+    cache.close()
+    reopened = StorageCache(cache_dir=str(tmp_path / "cache"))
+    assert dict(reopened._conn.execute("SELECT name, last_access FROM objects").fetchall())["a"] > written["a"]
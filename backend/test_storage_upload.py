@@ -0,0 +1,68 @@
+import io
+
+import storage_service
+from storage_service import StorageService
+
+
+class RecordingWriter:
+    """Mimics the blob.open("wb") writer, recording each write"""
+
+    def __init__(self):
+        self.writes = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.closed = True
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+        return len(data)
+
+
+class FakeBlob:
+    def __init__(self, name):
+        self.name = name
+        self.writer = None
+        self.open_kwargs = None
+
+    def open(self, mode, **kwargs):
+        assert mode == "wb"
+        self.open_kwargs = kwargs
+        self.writer = RecordingWriter()
+        return self.writer
+
+
+class FakeBucket:
+    def __init__(self):
+        self.blobs = {}
+
+    def blob(self, name):
+        return self.blobs.setdefault(name, FakeBlob(name))
+
+
+def test_file_is_streamed_through_a_chunked_resumable_writer(monkeypatch):
+    monkeypatch.setattr(storage_service, "GCS_UPLOAD_CHUNK_BYTES", 256 * 1024)
+    monkeypatch.setattr(storage_service, "GCS_UPLOAD_RETRY_SECONDS", 42.0)
+    service = object.__new__(StorageService)
+    service.bucket_name = "bucket"
+    service.cache = None
+    service.client = None
+    service.bucket = FakeBucket()
+
+    data = bytes(range(256)) * 4096  # 1 MB, four chunks
+    file_obj = io.BytesIO(data)
+    file_obj.seek(100)
+    assert service.upload_file(file_obj, "big.pdf") == "gs://bucket/documents/big.pdf"
+
+    blob = service.bucket.blobs["documents/big.pdf"]
+    assert blob.open_kwargs["chunk_size"] == 256 * 1024
+    assert blob.open_kwargs["content_type"] == "application/octet-stream"
+    # Failed chunks are retried (and resumed) by the writer for up to GCS_UPLOAD_RETRY_SECONDS
+    assert blob.open_kwargs["retry"]._deadline == 42.0
+    # Read from the start, one chunk at a time rather than the whole file at once
+    assert b"".join(blob.writer.writes) == data
+    assert [len(write) for write in blob.writer.writes] == [256 * 1024] * 4
+    assert blob.writer.closed
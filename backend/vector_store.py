@@ -1,9 +1,12 @@
 import pinecone
 from openai import OpenAI
+from llm_scheduler import ScheduledClient
 import logging
+from embedding_service import EmbeddingService
+from embedding_cache import EmbeddingCache
 
 class VectorStore:
-    def __init__(self, pinecone_api_key, openai_api_key, index_name="educational-content"):
+    def __init__(self, pinecone_api_key, openai_api_key, index_name="educational-content", embedding_cache=None):
         try:
             # Initialize Pinecone with the new client
             self.pc = pinecone.Pinecone(
@@ -26,7 +29,12 @@ class VectorStore:
                 )
                 
             self.index = self.pc.Index(index_name)
-            self.openai_client = OpenAI(api_key=openai_api_key)
+            self.openai_client = ScheduledClient(OpenAI(api_key=openai_api_key, max_retries=0))
+            self.embedding_service = EmbeddingService(
+                self.openai_client,
+                model="text-embedding-3-large",
+                cache=embedding_cache or EmbeddingCache()
+            )
             logging.info(f"Successfully initialized Pinecone index: {index_name}")
         except Exception as e:
             logging.error(f"Error initializing Pinecone: {str(e)}")
@@ -72,11 +80,7 @@ class VectorStore:
     def _generate_embedding(self, text):
         """Generate embeddings using OpenAI API"""
         try:
-            response = self.openai_client.embeddings.create(
-                input=text,
-                model="text-embedding-3-large"
-            )
-            return response.data[0].embedding
+            return self.embedding_service.embed_text(text)
         except Exception as e:
             logging.error(f"Error generating embedding: {str(e)}")
             return None 
\ No newline at end of file
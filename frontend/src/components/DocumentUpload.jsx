@@ -93,6 +93,28 @@ const ProgressFill = styled.div`
   transition: width 0.2s;
 `;
 
+const API_URL = 'https://head-n-heart-gpt-production.up.railway.app';
+
+const JOB_POLL_INTERVAL_MS = 2000;
+// Give up on a job that has not finished by then
+const JOB_TIMEOUT_MS = 30 * 60 * 1000;
+
+// Uploads are ingested in the background; poll the job until it finishes
+const waitForJob = async (jobId) => {
+  const deadline = Date.now() + JOB_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    const response = await axios.get(`${API_URL}/jobs/${jobId}`, { validateStatus: () => true });
+    // Jobs are kept in server memory, so a restart loses them
+    if (response.status === 404) throw new Error('The server lost track of this upload. Please upload it again.');
+    if (response.status !== 200) throw new Error(`Checking the upload failed (HTTP ${response.status}).`);
+    const { data } = response;
+    if (data.status === 'completed') return data;
+    if (data.status === 'failed') throw new Error(data.error || 'Processing failed');
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+  throw new Error('Processing is taking too long. Please check back later.');
+};
+
 function DocumentUpload() {
   const [files, setFiles] = useState([]);
   const [uploading, setUploading] = useState(false);
@@ -128,35 +150,28 @@ function DocumentUpload() {
     setOverallProgress(0);
 
     try {
-      for (let i = 0; i < files.length; i++) {
-        const file = files[i];
-        const formData = new FormData();
-        formData.append('file', file);
-
-        await axios.post('https://head-n-heart-gpt-production.up.railway.app/upload', formData, {
-          headers: {
-            'Content-Type': 'multipart/form-data',
-          },
-          onUploadProgress: (progressEvent) => {
-            const percentCompleted = Math.round((progressEvent.loaded * 100) / progressEvent.total);
-            setUploadProgress(prev => ({
-              ...prev,
-              [file.name]: percentCompleted
-            }));
-            // Calculate overall progress
-            const totalProgress = files.reduce((acc, f, idx) => {
-              return acc + (uploadProgress[f.name] || (idx < i ? 100 : 0));
-            }, 0);
-            setOverallProgress(Math.round(totalProgress / files.length));
-          }
-        });
-      }
+      // One request for all files so the server ingests them as a single batch
+      const formData = new FormData();
+      files.forEach(file => formData.append('files', file));
+
+      const response = await axios.post(`${API_URL}/upload/batch`, formData, {
+        headers: {
+          'Content-Type': 'multipart/form-data',
+        },
+        onUploadProgress: (progressEvent) => {
+          const percentCompleted = Math.round((progressEvent.loaded * 100) / progressEvent.total);
+          setUploadProgress(Object.fromEntries(files.map(f => [f.name, percentCompleted])));
+          setOverallProgress(percentCompleted);
+        }
+      });
+      const jobIds = response.data.jobs.map(job => job.job_id);
+      await Promise.all(jobIds.map(waitForJob));
       setStatus({ success: true, message: 'Files uploaded successfully!' });
       setFiles([]);
       setUploadProgress({});
       setOverallProgress(100);
     } catch (error) {
-      setStatus({ success: false, message: 'Error uploading files. Please try again.' });
+      setStatus({ success: false, message: `Error uploading files: ${error.message}` });
     } finally {
       setUploading(false);
     }
@@ -108,18 +108,64 @@ const Tag = styled.span`
   font-size: 0.9rem;
 `;
 
+const API_URL = 'https://head-n-heart-gpt-production.up.railway.app';
+
+// Read server-sent events from a fetch response body and hand each one to onEvent
+const readEventStream = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let data = '';
+      rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      });
+      onEvent(event, data ? JSON.parse(data) : null);
+    }
+  }
+};
+
 function QueryInterface() {
   const [query, setQuery] = useState('');
   const [loading, setLoading] = useState(false);
   const [results, setResults] = useState(null);
+  const [sources, setSources] = useState([]);
+  const [draft, setDraft] = useState('');
 
   const handleSubmit = async () => {
     if (!query.trim()) return;
 
     setLoading(true);
+    setResults(null);
+    setSources([]);
+    setDraft('');
     try {
-      const response = await axios.post(`https://head-n-heart-gpt-production.up.railway.app/query`, { query: query.trim() });
-      setResults(response.data);
+      const response = await fetch(`${API_URL}/query/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ query: query.trim() }),
+      });
+      if (!response.ok || !response.body) {
+        // Fall back to the non-streaming endpoint
+        const fallback = await axios.post(`${API_URL}/query`, { query: query.trim() });
+        setResults(fallback.data);
+        return;
+      }
+      await readEventStream(response, (event, data) => {
+        if (event === 'sources') setSources(data.sources);
+        else if (event === 'token') setDraft(prev => prev + data.text);
+        else if (event === 'final') setResults(data);
+        else if (event === 'error') console.error('Error querying content:', data.detail);
+      });
     } catch (error) {
       console.error('Error querying content:', error);
     } finally {
@@ -141,14 +187,35 @@ function QueryInterface() {
         {loading ? 'Searching...' : 'Search'}
       </SubmitButton>
 
-      {results && (
+      {(results || draft) && (
         <ResultsContainer>
           <SuggestionBox>
             <h2>Response</h2>
-            <ReactMarkdown>{results.reply}</ReactMarkdown>
+            {results ? (
+              <ReactMarkdown>{results.reply}</ReactMarkdown>
+            ) : (
+              <ChunkText>{draft}</ChunkText>
+            )}
           </SuggestionBox>
         </ResultsContainer>
       )}
+
+      {sources.length > 0 && (
+        <ChunkList>
+          {sources.map((source, index) => (
+            <ChunkItem key={index}>
+              <ChunkHeader>
+                <ChunkSource>{source.filename}</ChunkSource>
+                <ConfidenceScore>{source.score.toFixed(2)}</ConfidenceScore>
+              </ChunkHeader>
+              <ChunkText>{source.preview}</ChunkText>
+              <TagList>
+                {source.tags.map(tag => <Tag key={tag}>{tag}</Tag>)}
+              </TagList>
+            </ChunkItem>
+          ))}
+        </ChunkList>
+      )}
     </QueryContainer>
   );
 }